@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Adaptive concurrency shared by step 2 and step 3.
+
+AdjustableGate is a semaphore whose limit can move while tasks hold it.
+AdaptiveConcurrencyController samples the process every few seconds and
+moves that limit AIMD-style:
+- any pressure signal (RSS / free memory, open descriptors, event-loop lag,
+  a jump in timeout/connection-error rate) cuts the limit multiplicatively;
+- a saturated gate with no pressure grows it by a fixed step.
+Every adjustment is logged through the caller's print_status.
+"""
+
+import asyncio
+import contextlib
+import os
+import time
+from collections import deque
+from typing import Callable, Deque, List, Optional
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+
+class AdjustableGate:
+    """Semaphore with a mutable limit; lowering it only delays new entries."""
+
+    def __init__(self, limit: int):
+        self.limit = max(1, int(limit))
+        self.in_use = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiters)
+
+    async def acquire(self):
+        if self.in_use < self.limit and not self._waiters:
+            self.in_use += 1
+            return
+        fut = asyncio.get_running_loop().create_future()
+        self._waiters.append(fut)
+        try:
+            await fut
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                # Granted just before the cancel landed; hand the slot on
+                self.release()
+            else:
+                with contextlib.suppress(ValueError):
+                    self._waiters.remove(fut)
+            raise
+
+    def release(self):
+        self.in_use -= 1
+        self._wake()
+
+    def set_limit(self, limit: int):
+        self.limit = max(1, int(limit))
+        self._wake()
+
+    def _wake(self):
+        while self._waiters and self.in_use < self.limit:
+            fut = self._waiters.popleft()
+            if not fut.done():
+                self.in_use += 1
+                fut.set_result(None)
+
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.release()
+
+
+def open_fd_count() -> Optional[int]:
+    if psutil is not None:
+        with contextlib.suppress(Exception):
+            return psutil.Process().num_fds()
+    with contextlib.suppress(Exception):
+        return len(os.listdir("/proc/self/fd"))
+    return None
+
+
+def fd_soft_limit() -> Optional[int]:
+    try:
+        import resource  # type: ignore
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        infinity = getattr(resource, "RLIM_INFINITY", 2 ** 63 - 1)
+        return None if soft in (0, infinity) else int(soft)
+    except Exception:
+        return None
+
+
+class AdaptiveConcurrencyController:
+    """AIMD loop over an AdjustableGate.
+
+    Callers report each finished unit of work with record(failed); "failed"
+    should mean a transport symptom of overload (timeout, connection error),
+    not a content verdict. The error signal fires when the window's failure
+    rate rises error_slack above its own running baseline, so domain lists
+    that are simply full of dead hosts do not pin the limit at the floor.
+    """
+
+    def __init__(
+        self,
+        gate: AdjustableGate,
+        *,
+        min_limit: int,
+        max_limit: int,
+        log: Callable[[str, str], None],
+        interval: float = 5.0,
+        step: Optional[int] = None,
+        decrease_factor: float = 0.7,
+        rss_limit_mb: Optional[float] = None,
+        min_available_mb: float = 256.0,
+        fd_high_water: float = 0.85,
+        max_loop_lag: float = 0.5,
+        error_slack: float = 0.15,
+        min_samples: int = 50,
+        name: str = "concurrency",
+    ):
+        self.gate = gate
+        self.min_limit = max(1, int(min_limit))
+        self.max_limit = max(self.min_limit, int(max_limit))
+        self.log = log
+        self.interval = max(0.5, interval)
+        self.step = step or max(1, self.max_limit // 20)
+        self.decrease_factor = decrease_factor
+        if rss_limit_mb is None and psutil is not None:
+            with contextlib.suppress(Exception):
+                rss_limit_mb = psutil.virtual_memory().total / (1024 ** 2) * 0.7
+        self.rss_limit_mb = rss_limit_mb
+        self.min_available_mb = min_available_mb
+        self.fd_limit = fd_soft_limit()
+        self.fd_high_water = fd_high_water
+        self.max_loop_lag = max_loop_lag
+        self.error_slack = error_slack
+        self.min_samples = min_samples
+        self.name = name
+        self._proc = psutil.Process() if psutil is not None else None
+        self._ok = 0
+        self._failed = 0
+        self._baseline: Optional[float] = None
+        self._lag = 0.0
+        self._cooldown = False
+        self._tasks: List[asyncio.Task] = []
+        self.adjustments = 0
+        self.low = self.gate.limit
+        self.high = self.gate.limit
+
+    def record(self, failed: bool):
+        if failed:
+            self._failed += 1
+        else:
+            self._ok += 1
+
+    def start(self):
+        self.gate.set_limit(min(max(self.gate.limit, self.min_limit), self.max_limit))
+        self._tasks = [asyncio.create_task(self._lag_probe()), asyncio.create_task(self._run())]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        for task in self._tasks:
+            with contextlib.suppress(asyncio.CancelledError):
+                await task
+        self._tasks = []
+
+    async def _lag_probe(self):
+        # Overshoot of a short sleep = how long callbacks wait for the loop
+        period = 0.25
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(period)
+            self._lag = max(self._lag, time.monotonic() - started - period)
+
+    def _pressure(self) -> Optional[str]:
+        lag, self._lag = self._lag, 0.0
+        if self._proc is not None:
+            with contextlib.suppress(Exception):
+                rss_mb = self._proc.memory_info().rss / (1024 ** 2)
+                if self.rss_limit_mb and rss_mb > self.rss_limit_mb:
+                    return f"RSS {rss_mb:.0f} MiB > {self.rss_limit_mb:.0f} MiB"
+                avail_mb = psutil.virtual_memory().available / (1024 ** 2)
+                if avail_mb < self.min_available_mb:
+                    return f"free memory {avail_mb:.0f} MiB"
+        if self.fd_limit:
+            fds = open_fd_count()
+            if fds is not None and fds > self.fd_limit * self.fd_high_water:
+                return f"{fds} open fds of {self.fd_limit}"
+        if lag > self.max_loop_lag:
+            return f"event-loop lag {lag:.2f}s"
+        total = self._ok + self._failed
+        if total >= self.min_samples:
+            rate = self._failed / total
+            self._ok = self._failed = 0
+            baseline = self._baseline
+            self._baseline = rate if baseline is None else baseline * 0.8 + rate * 0.2
+            if baseline is not None and rate > baseline + self.error_slack:
+                return f"error rate {rate:.0%} vs {baseline:.0%} baseline"
+        return None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            reason = self._pressure()
+            old = self.gate.limit
+            if reason:
+                new = max(self.min_limit, int(old * self.decrease_factor))
+                self._cooldown = True
+            elif self._cooldown:
+                # Let one interval pass at the lower limit before probing upward
+                self._cooldown = False
+                continue
+            elif self.gate.waiting or self.gate.in_use >= old * 0.9:
+                new = min(self.max_limit, old + self.step)
+                reason = "saturated, no pressure"
+            else:
+                continue
+            if new == old:
+                continue
+            self.gate.set_limit(new)
+            self.adjustments += 1
+            self.low = min(self.low, new)
+            self.high = max(self.high, new)
+            arrow = "⬇️" if new < old else "⬆️"
+            self.log(f"{arrow}  {self.name.capitalize()} {old} -> {new} ({reason})", "warning" if new < old else "info")
+
+    def report_line(self) -> str:
+        return (
+            f"🎚️  Adaptive {self.name}: final {self.gate.limit}, range {self.low}-{self.high} "
+            f"(bounds {self.min_limit}-{self.max_limit}), {self.adjustments} adjustments"
+        )
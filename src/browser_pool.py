@@ -0,0 +1,498 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Browser pool for step 3's fallback tier (Selenium on ARM, undetected-chromedriver elsewhere).
+
+The previous pools started N browsers for the whole run and sent every page
+load through asyncio.to_thread. Each page waited for readyState and then a
+fixed 0.8-1.0 s sleep, and browsers were never restarted, so Chrome's
+memory grew for the whole run. BrowserPool instead:
+- drives each browser from a thread of its own executor, so page loads
+  neither queue behind nor block other to_thread work;
+- reuses one tab per browser and parks it on about:blank between pages,
+  which drops the previous page's DOM, timers and sockets;
+- waits for readiness in the page itself: an async script returns once the
+  DOM and resource loading have been quiet for quiet_ms (capped at
+  settle_max), instead of sleeping a fixed time; a page that navigates
+  during the wait (JS redirect, meta refresh, challenge) is waited on again;
+- recycles a browser after max_pages pages, after its process tree passes
+  max_rss_mb (checked with psutil when installed), or after repeated
+  failed loads, swapping in a warm standby browser launched in the background.
+
+Run:
+  python browser_pool.py --bench                    # fake driver against a local HTTP server
+  python browser_pool.py --bench --browsers 4 --pages 400 --max-pages 50
+"""
+
+import argparse
+import asyncio
+import concurrent.futures
+import contextlib
+import random
+import shutil
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+from urllib.request import urlopen
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+RSS_CHECK_PAGES = 10  # pages between RSS checks of a browser's process tree
+MAX_FAILED_LOADS = 3  # consecutive domains whose every load raised before the browser is recycled
+READY_RETRIES = 2  # readiness waits started again when the page navigates away during one
+UNLOADED_MARKER = "document unloaded"  # WebDriver's error when the page unloads under an async script
+
+# Resolves once neither DOM mutations nor resource loads happened for quiet_ms, or after max_ms.
+# Runs through execute_async_script, so the wait costs one driver round trip.
+READY_SCRIPT = """
+const quietMs = arguments[0], maxMs = arguments[1], done = arguments[arguments.length - 1];
+const started = performance.now();
+let last = started, finished = false, resources = null;
+const bump = () => { last = performance.now(); };
+const dom = new MutationObserver(bump);
+dom.observe(document, {subtree: true, childList: true, attributes: true, characterData: true});
+try { resources = new PerformanceObserver(bump); resources.observe({type: "resource"}); } catch (e) {}
+const timer = setInterval(() => {
+  const now = performance.now();
+  const quiet = document.readyState !== "loading" && now - last >= quietMs;
+  if (!finished && (quiet || now - started >= maxMs)) {
+    finished = true;
+    clearInterval(timer);
+    dom.disconnect();
+    if (resources) resources.disconnect();
+    done(quiet ? "quiet" : "busy");
+  }
+}, Math.max(10, Math.min(50, quietMs / 4)));
+"""
+
+
+def candidate_urls(domain: str) -> List[str]:
+    # Same order as the fast pass fallbacks: https, http, then www. for bare registrable names
+    urls = [f"https://{domain}", f"http://{domain}"]
+    if domain.count(".") == 1:
+        urls += [f"https://www.{domain}", f"http://www.{domain}"]
+    return urls
+
+
+def process_rss_mb(driver) -> Optional[float]:
+    """RSS of the browser's process tree (chromedriver or Chrome and all children); None without psutil."""
+    if psutil is None:
+        return None
+    pid = getattr(driver, "browser_pid", None)
+    if not pid:
+        process = getattr(getattr(driver, "service", None), "process", None)
+        pid = getattr(process, "pid", None)
+    if not pid:
+        return None
+    try:
+        root = psutil.Process(pid)
+        total = root.memory_info().rss
+        for child in root.children(recursive=True):
+            with contextlib.suppress(psutil.Error):
+                total += child.memory_info().rss
+    except psutil.Error:
+        return None
+    return total / (1024 * 1024)
+
+
+def remove_profile(profile: Path) -> None:
+    shutil.rmtree(profile, ignore_errors=True)
+
+
+class _Browser:
+    __slots__ = ("driver", "profile", "proxy", "pages", "failed_loads", "rss_mb")
+
+    def __init__(self, driver, profile: Path, proxy: Optional[str]):
+        self.driver = driver
+        self.profile = profile
+        self.proxy = proxy
+        self.pages = 0
+        self.failed_loads = 0
+        self.rss_mb: Optional[float] = None
+
+
+class BrowserPool:
+    """size browsers handed out one page load at a time; launch(profile_dir, proxy) returns a WebDriver."""
+
+    def __init__(
+        self,
+        launch: Callable[[Path, Optional[str]], Any],
+        size: int,
+        proxies: List[str],
+        *,
+        profile_base: Path,
+        profile_prefix: str = "browser",
+        max_pages: int = 200,
+        max_rss_mb: float = 1500,
+        standby: bool = True,
+        page_timeout: float = 15,
+        quiet_ms: int = 300,
+        settle_max: float = 5.0,
+        body_min: int = 100,
+        rss: Callable[[Any], Optional[float]] = process_rss_mb,
+    ):
+        self.launch = launch
+        self.size = max(1, size)
+        self.proxies = proxies
+        self.profile_base = Path(profile_base)
+        self.profile_prefix = profile_prefix
+        self.max_pages = max_pages
+        self.max_rss_mb = max_rss_mb
+        self.standby = standby
+        self.page_timeout = page_timeout
+        self.quiet_ms = quiet_ms
+        self.settle_max = settle_max
+        self.body_min = body_min
+        self.rss = rss
+        self.browsers: List[Optional[_Browser]] = []
+        self._idle: asyncio.Queue = asyncio.Queue()
+        # One thread per browser plus one for the standby launch; driver calls never wait on each other
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=self.size + 1, thread_name_prefix=f"{profile_prefix}-pool"
+        )
+        self._standby: Optional[asyncio.Task] = None
+        self._background: set = set()
+        self._next_proxy = 0
+        self.pages = 0
+        self.launches = 0
+        self.launch_seconds = 0.0
+        self.standby_ready = 0
+        self.recycled: Dict[str, int] = {"pages": 0, "rss": 0, "failures": 0}
+        self.settled: Dict[str, int] = {"quiet": 0, "busy": 0}
+        self.navigated = 0  # readiness waits cut short by a redirect, meta refresh or challenge
+
+    @property
+    def proxy_for_idx(self) -> List[Optional[str]]:
+        return [b.proxy if b is not None else None for b in self.browsers]
+
+    async def _call(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    def _proxy(self) -> Optional[str]:
+        if not self.proxies:
+            return None
+        proxy = self.proxies[self._next_proxy % len(self.proxies)]
+        self._next_proxy += 1
+        return proxy
+
+    async def _launch(self) -> _Browser:
+        proxy = self._proxy()
+        self.profile_base.mkdir(parents=True, exist_ok=True)
+        profile = Path(tempfile.mkdtemp(prefix=f"{self.profile_prefix}_", dir=str(self.profile_base)))
+        started = time.monotonic()
+        try:
+            driver = await self._call(self.launch, profile, proxy)
+        except BaseException:
+            remove_profile(profile)
+            raise
+        with contextlib.suppress(Exception):
+            await self._call(self._configure, driver)
+        self.launches += 1
+        self.launch_seconds += time.monotonic() - started
+        return _Browser(driver, profile, proxy)
+
+    def _configure(self, driver) -> None:
+        driver.set_page_load_timeout(self.page_timeout)
+        driver.set_script_timeout(self.settle_max + 2)
+
+    async def start(self) -> None:
+        # Launches are staggered as before; Chrome start-up is CPU-bound
+        for idx in range(self.size):
+            self.browsers.append(await self._launch())
+            self._idle.put_nowait(idx)
+        self._refill_standby()
+
+    def _refill_standby(self) -> None:
+        if self.standby and self._standby is None:
+            self._standby = asyncio.ensure_future(self._launch())
+
+    async def _replacement(self) -> _Browser:
+        # The standby when it has launched (or is about to), else a fresh launch
+        task, self._standby = self._standby, None
+        browser = None
+        if task is not None:
+            if task.done():
+                self.standby_ready += 1
+            with contextlib.suppress(Exception):
+                browser = await task
+        if browser is None:
+            browser = await self._launch()
+        self._refill_standby()
+        return browser
+
+    def _spawn(self, coro) -> None:
+        task = asyncio.ensure_future(coro)
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    async def _retire(self, browser: _Browser) -> None:
+        with contextlib.suppress(Exception):
+            await self._call(browser.driver.quit)
+        await asyncio.to_thread(remove_profile, browser.profile)
+
+    async def fetch(self, domain: str) -> Tuple[Optional[str], str, Optional[str]]:
+        """(html, "success" or "timeout", proxy the browser used) for the first candidate URL that renders."""
+        idx = await self._idle.get()
+        browser = self.browsers[idx]
+        try:
+            html, label = await self._call(self._load, browser, domain)
+            self.pages += 1
+            browser.pages += 1
+            if browser.pages % RSS_CHECK_PAGES == 0:
+                browser.rss_mb = await self._call(self.rss, browser.driver)
+            reason = self._recycle_reason(browser)
+        except BaseException:
+            self._idle.put_nowait(idx)
+            raise
+        if reason is None:
+            self._idle.put_nowait(idx)
+        else:
+            self._spawn(self._recycle(idx, reason))
+        return html, label, browser.proxy
+
+    def _recycle_reason(self, browser: _Browser) -> Optional[str]:
+        if browser.failed_loads >= MAX_FAILED_LOADS:
+            return "failures"
+        if self.max_pages and browser.pages >= self.max_pages:
+            return "pages"
+        if self.max_rss_mb and browser.rss_mb is not None and browser.rss_mb >= self.max_rss_mb:
+            return "rss"
+        return None
+
+    async def _recycle(self, idx: int, reason: str) -> None:
+        old = self.browsers[idx]
+        try:
+            self.browsers[idx] = await self._replacement()
+            self.recycled[reason] += 1
+        except Exception:
+            # No new browser could start; keep the old one rather than shrink the pool
+            old.pages = old.failed_loads = 0
+            old = None
+        finally:
+            self._idle.put_nowait(idx)
+        if old is not None:
+            await self._retire(old)
+
+    def _load(self, browser: _Browser, domain: str) -> Tuple[Optional[str], str]:
+        # Runs on the browser's executor thread
+        driver = browser.driver
+        errors = 0
+        urls = candidate_urls(domain)
+        result: Tuple[Optional[str], str] = (None, "timeout")
+        for url in urls:
+            try:
+                driver.get(url)
+                self._settle(driver)
+                html = driver.page_source or ""
+            except Exception:
+                errors += 1
+                continue
+            if len(html.strip()) >= self.body_min:
+                result = (html, "success")
+                break
+        browser.failed_loads = browser.failed_loads + 1 if errors == len(urls) else 0
+        with contextlib.suppress(Exception):
+            # Keep the tab, drop the page
+            driver.get("about:blank")
+        return result
+
+    def _settle(self, driver) -> None:
+        # A JS redirect, meta refresh or Cloudflare challenge unloads the page the script runs in;
+        # wait again on the page it went to, and after READY_RETRIES just take whatever is there.
+        for attempt in range(READY_RETRIES + 1):
+            try:
+                settled = driver.execute_async_script(READY_SCRIPT, self.quiet_ms, int(self.settle_max * 1000))
+            except Exception as e:
+                if UNLOADED_MARKER not in str(e):
+                    raise
+                self.navigated += 1
+                continue
+            self.settled[settled if settled in self.settled else "busy"] += 1
+            return
+        self.settled["busy"] += 1
+
+    async def close(self) -> None:
+        for task in list(self._background):
+            with contextlib.suppress(Exception):
+                await task
+        retiring = [b for b in self.browsers if b is not None]
+        if self._standby is not None:
+            with contextlib.suppress(Exception):
+                retiring.append(await self._standby)
+            self._standby = None
+        await asyncio.gather(*(self._retire(b) for b in retiring))
+        self.browsers = []
+        self._executor.shutdown(wait=False)
+
+    def report_line(self) -> str:
+        recycled = sum(self.recycled.values())
+        causes = ", ".join(f"{k} {v}" for k, v in self.recycled.items() if v)
+        mean_launch = self.launch_seconds / self.launches if self.launches else 0.0
+        return (
+            f"🧭 Browser pool: {self.pages:,} pages on {self.size} browsers, {recycled} recycled"
+            + (f" ({causes})" if causes else "")
+            + f", {self.standby_ready} swapped in from a ready standby; {self.launches} launches averaging {mean_launch:.1f}s; "
+            f"{self.settled['quiet']:,} loads settled, {self.settled['busy']:,} still busy at {self.settle_max:.0f}s, "
+            f"{self.navigated:,} waits restarted after the page navigated"
+        )
+
+
+# ---------------------------------------------------------------------------
+# Benchmark: fake driver against a local HTTP server
+# ---------------------------------------------------------------------------
+
+
+class _BenchHandler(BaseHTTPRequestHandler):
+    # /<host>: a page whose size and "script activity" (X-Settle-Ms) depend on the host
+    def do_GET(self):
+        host = self.path.strip("/")
+        rng = random.Random(host)
+        settle = rng.randint(1000, 2500) if rng.random() < 0.1 else rng.randint(20, 300)
+        body = ("<html><head><title>%s</title></head><body>" % host + "<p>lorem ipsum dolor</p>" * rng.randint(50, 800)).encode()
+        time.sleep(rng.uniform(0.005, 0.03))
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("X-Settle-Ms", str(settle))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class FakeDriver:
+    """WebDriver stand-in: pages come from the bench server; start-up, settle time and memory growth are simulated."""
+
+    BASE_MB = 180.0
+    MB_PER_PAGE = 2.5
+    LAUNCH_SEC = 0.6
+
+    def __init__(self, port: int):
+        time.sleep(self.LAUNCH_SEC)
+        self.port = port
+        self.page_source = ""
+        self.rss_mb = self.BASE_MB
+        self.settle_ms = 0
+        self.loaded_at = 0.0
+        self.captured_early = 0
+
+    def set_page_load_timeout(self, seconds):
+        pass
+
+    def set_script_timeout(self, seconds):
+        pass
+
+    def get(self, url: str) -> None:
+        host = urlsplit(url).hostname or ""
+        if host == "" or url == "about:blank":
+            self.page_source, self.settle_ms = "", 0
+            return
+        with urlopen(f"http://127.0.0.1:{self.port}/{host}", timeout=10) as resp:
+            self.page_source = resp.read().decode()
+            self.settle_ms = int(resp.headers.get("X-Settle-Ms", 0))
+        self.loaded_at = time.monotonic()
+        self.rss_mb += self.MB_PER_PAGE
+
+    def execute_script(self, script: str):
+        return "complete"
+
+    def execute_async_script(self, script: str, quiet_ms: int, max_ms: int):
+        # The page goes quiet settle_ms after load; the script notices quiet_ms later
+        wait = min(self.settle_ms + quiet_ms, max_ms) / 1000
+        time.sleep(max(0.0, wait - (time.monotonic() - self.loaded_at)))
+        return "quiet" if self.settle_ms + quiet_ms <= max_ms else "busy"
+
+    def quit(self):
+        pass
+
+
+def _legacy_fetch(driver: FakeDriver, domain: str) -> Tuple[Optional[str], str]:
+    # The previous _selenium_fetch_html: readyState, then a fixed 0.8 s sleep
+    for url in candidate_urls(domain):
+        driver.get(url)
+        driver.execute_script("return document.readyState")
+        time.sleep(0.8)
+        if (time.monotonic() - driver.loaded_at) * 1000 < driver.settle_ms:
+            driver.captured_early += 1
+        if len(driver.page_source.strip()) >= 100:
+            return driver.page_source, "success"
+    return None, "timeout"
+
+
+async def _bench_legacy(port: int, domains: List[str], browsers: int) -> Tuple[float, float, int]:
+    drivers = [await asyncio.to_thread(FakeDriver, port) for _ in range(browsers)]
+    queue: asyncio.Queue = asyncio.Queue()
+    for d in drivers:
+        queue.put_nowait(d)
+
+    async def one(domain):
+        driver = await queue.get()
+        try:
+            await asyncio.to_thread(_legacy_fetch, driver, domain)
+        finally:
+            queue.put_nowait(driver)
+
+    started = time.monotonic()
+    await asyncio.gather(*(one(d) for d in domains))
+    return time.monotonic() - started, max(d.rss_mb for d in drivers), sum(d.captured_early for d in drivers)
+
+
+async def _bench_pool(port: int, domains: List[str], browsers: int, max_pages: int, max_rss_mb: float) -> Tuple[float, float, BrowserPool]:
+    peak = [0.0]
+
+    def rss(driver: FakeDriver) -> float:
+        peak[0] = max(peak[0], driver.rss_mb)
+        return driver.rss_mb
+
+    with tempfile.TemporaryDirectory(prefix="browser_pool_bench_") as base:
+        pool = BrowserPool(
+            lambda profile, proxy: FakeDriver(port), browsers, [], profile_base=Path(base),
+            max_pages=max_pages, max_rss_mb=max_rss_mb, rss=rss,
+        )
+        await pool.start()
+        started = time.monotonic()
+        await asyncio.gather(*(pool.fetch(d) for d in domains))
+        elapsed = time.monotonic() - started
+        for b in pool.browsers:
+            if b is not None:
+                rss(b.driver)
+        await pool.close()
+    return elapsed, peak[0], pool
+
+
+def run_bench(pages: int, browsers: int, max_pages: int, max_rss_mb: float) -> None:
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _BenchHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    port = server.server_address[1]
+    domains = [f"site{i}.test" for i in range(pages)]
+    try:
+        print(f"{pages:,} pages from http://127.0.0.1:{port}, {browsers} fake browsers ({FakeDriver.LAUNCH_SEC}s launch, +{FakeDriver.MB_PER_PAGE} MB/page)")
+        elapsed, peak, early = asyncio.run(_bench_legacy(port, domains, browsers))
+        print(f"  {'previous pools (0.8s sleep, no recycling)':<44} {pages / elapsed:7.1f} pages/s  peak {peak:7.0f} MB/browser  {early:,} captured before the page settled")
+        elapsed, peak, pool = asyncio.run(_bench_pool(port, domains, browsers, max_pages, max_rss_mb))
+        print(f"  {'BrowserPool (DOM-quiet, recycling, standby)':<44} {pages / elapsed:7.1f} pages/s  peak {peak:7.0f} MB/browser")
+        print(f"  {pool.report_line()}")
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Browser pool for the step 3 fallback tier")
+    parser.add_argument("--bench", action="store_true", help="Compare with the previous pools using a fake driver and a local HTTP server")
+    parser.add_argument("--pages", type=int, default=240, help="Pages to load (default 240)")
+    parser.add_argument("--browsers", type=int, default=4, help="Pool size (default 4)")
+    parser.add_argument("--max-pages", type=int, default=40, help="Pages per browser before it is recycled (default 40)")
+    parser.add_argument("--max-rss", type=float, default=1500, help="Browser RSS in MB that triggers recycling (default 1500)")
+    args = parser.parse_args()
+    if args.bench:
+        run_bench(args.pages, args.browsers, args.max_pages, args.max_rss)
+    else:
+        parser.print_help()
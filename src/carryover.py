@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Time-boxed runs for step 2 and step 3 (--deadline).
+
+CI runners and the self-hosted runner kill a job at a hard limit, and a run
+killed mid-way leaves nothing usable. With a Deadline the scripts stop
+taking new domains drain_sec before the limit and let in-flight work
+finish. CarryOver collects every domain that was not processed. It saves
+them, in the order they would have run, to a carry-over file, and the next
+run starts with that file's domains. So that a cut run still publishes
+complete lists, carried-over domains are written with the verdict the
+previous run's outputs gave them (PreviousVerdicts), when there is one.
+"""
+
+import os
+import re
+import time
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Iterator, List, Mapping, Optional, Set
+
+_DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)\s*([dhms]?)", re.IGNORECASE)
+_UNIT_SECONDS = {"d": 86400, "h": 3600, "m": 60, "s": 1, "": 1}
+
+
+def parse_duration(text: str) -> float:
+    """Seconds in "5h30m", "90m", "45s", "1.5h", "7d" or a bare number of seconds; ValueError otherwise."""
+    compact = re.sub(r"\s+", "", str(text)).lower()
+    parts = _DURATION_PART.findall(compact)
+    if not compact or "".join(n + u for n, u in parts) != compact:
+        raise ValueError(f"invalid duration: {text!r}")
+    seconds = sum(float(n) * _UNIT_SECONDS[u] for n, u in parts)
+    if seconds <= 0:
+        raise ValueError(f"duration must be positive: {text!r}")
+    return seconds
+
+
+def format_duration(seconds: float) -> str:
+    minutes = int(round(seconds / 60))
+    return f"{minutes // 60}h{minutes % 60:02d}m" if minutes >= 60 else f"{max(0.0, seconds) / 60:.1f}m"
+
+
+class Deadline:
+    """Wall-clock budget of a run, counted from construction (or started, a time.monotonic() value)."""
+
+    def __init__(self, budget_sec: float, drain_sec: float, started: Optional[float] = None):
+        self.budget = budget_sec
+        # Never spend more than half the budget draining
+        self.drain = min(drain_sec, budget_sec / 2)
+        self.started = time.monotonic() if started is None else started
+        self.cut_at: Optional[float] = None
+
+    def cutoff_reached(self) -> bool:
+        # True once new domains should no longer be started
+        if time.monotonic() - self.started >= self.budget - self.drain:
+            if self.cut_at is None:
+                self.cut_at = time.monotonic()
+            return True
+        return False
+
+    def expired(self) -> bool:
+        # True at the hard end; queued follow-up work (rescue tiers) is skipped from here on
+        return time.monotonic() - self.started >= self.budget
+
+    def remaining(self) -> float:
+        return self.budget - (time.monotonic() - self.started)
+
+    def plan_line(self) -> str:
+        return (
+            f"⌛ Deadline: {format_duration(self.budget)} budget; new domains stop after "
+            f"{format_duration(self.budget - self.drain)}, leaving {format_duration(self.drain)} to drain in-flight work"
+        )
+
+
+def _key(domain: str) -> str:
+    return domain.strip().rstrip(".").lower()
+
+
+def read_domain_file(path: Path) -> Iterator[str]:
+    # Domains as written; blank lines and # comments are skipped
+    with open(path, "r", encoding="utf-8") as f:
+        for ln in f:
+            dom = ln.split("#", 1)[0].strip()
+            if dom:
+                yield dom
+
+
+class CarryOver:
+    """Domains left over by a time-boxed run, saved in the order they would have been processed."""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.loaded: List[str] = []
+        self.stale = 0
+        self.saved = 0
+        self._loaded_keys: Set[str] = set()
+        self._left: List[str] = []
+        self._rest: Optional[Iterator[str]] = None
+
+    def load(self, domains: Optional[Callable[[], Iterable[str]]] = None) -> int:
+        """Read the carry-over file; with domains(), entries no longer in the input are dropped."""
+        if not self.path.exists():
+            return 0
+        wanted: Dict[str, str] = {}
+        for dom in read_domain_file(self.path):
+            wanted.setdefault(_key(dom), dom)
+        if domains is not None:
+            present = {key for key in (_key(dom) for dom in domains()) if key in wanted}
+            self.stale = len(wanted) - len(present)
+            wanted = {key: dom for key, dom in wanted.items() if key in present}
+        self.loaded = list(wanted.values())
+        self._loaded_keys = set(wanted)
+        return len(self.loaded)
+
+    def first(self, domains: Iterable[str]) -> Iterator[str]:
+        # The loaded carry-over, then domains without those entries
+        yield from self.loaded
+        for dom in domains:
+            if _key(dom) not in self._loaded_keys:
+                yield dom
+
+    def until(self, domains: Iterable[str], deadline: Deadline) -> Iterator[str]:
+        """Yield domains until the deadline's cutoff; the rest is kept for save() without being read now."""
+        it = iter(domains)
+        for dom in it:
+            if deadline.cutoff_reached():
+                self._left.append(dom)
+                self._rest = it
+                return
+            yield dom
+
+    def add(self, domain: str) -> None:
+        # A domain taken from the input but not processed (queued or routed when the cutoff came)
+        self._left.append(domain)
+
+    def save(self, each: Optional[Callable[[str], None]] = None) -> int:
+        """Write the leftover domains (or remove the file when there are none); each(domain) sees every one.
+
+        Domains added from inside the pipeline come first: they were taken
+        from the input before the ones still waiting in it.
+        """
+        seen: Set[str] = set()
+        count = 0
+        tmp = Path(f"{self.path}.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            for dom in self._remaining():
+                key = _key(dom)
+                if key in seen:
+                    continue
+                seen.add(key)
+                f.write(dom + "\n")
+                count += 1
+                if each is not None:
+                    each(dom)
+        if count:
+            os.replace(tmp, self.path)
+        else:
+            tmp.unlink()
+            self.discard()
+        self.saved = count
+        self._left = []
+        self._rest = None
+        return count
+
+    def _remaining(self) -> Iterator[str]:
+        yield from self._left
+        if self._rest is not None:
+            yield from self._rest
+
+    def discard(self) -> None:
+        # The carried domains were all processed; the next run starts from the full input again
+        if self.path.exists():
+            self.path.unlink()
+
+
+class PreviousVerdicts:
+    """Verdict per domain from the previous run's output files, read before they are truncated."""
+
+    def __init__(self, files: Mapping[str, Path]):
+        self.labels: List[str] = list(files)
+        self._by_key: Dict[str, int] = {}
+        for index, (label, path) in enumerate(files.items()):
+            if not Path(path).exists():
+                continue
+            for dom in read_domain_file(Path(path)):
+                self._by_key.setdefault(_key(dom), index)
+
+    def __len__(self) -> int:
+        return len(self._by_key)
+
+    def get(self, domain: str) -> Optional[str]:
+        index = self._by_key.get(_key(domain))
+        return self.labels[index] if index is not None else None
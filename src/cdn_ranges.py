@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+CDN / anti-DDoS address ranges for routing domains before they are fetched.
+
+cdn_ranges.txt (next to this module) holds "provider CIDR" lines. CdnRangeIndex
+merges them into sorted, non-overlapping integer intervals per address family,
+so a lookup is one bisect. update_ranges_file() refreshes the providers that
+publish machine-readable lists and keeps the hand-maintained ones as they are.
+"""
+
+import bisect
+import ipaddress
+import json
+import urllib.request
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+DEFAULT_RANGES_FILE = Path(__file__).resolve().with_name("cdn_ranges.txt")
+
+
+def _plain_list(body: str) -> List[str]:
+    return body.split()
+
+
+def _fastly_list(body: str) -> List[str]:
+    data = json.loads(body)
+    return data.get("addresses", []) + data.get("ipv6_addresses", [])
+
+
+def _cloudfront_list(body: str) -> List[str]:
+    data = json.loads(body)
+    return [p["ip_prefix"] for p in data.get("prefixes", []) if p.get("service") == "CLOUDFRONT"] + [
+        p["ipv6_prefix"] for p in data.get("ipv6_prefixes", []) if p.get("service") == "CLOUDFRONT"
+    ]
+
+
+# provider -> [(url, parser of the response body into CIDR strings)]
+PUBLISHED_LISTS: Dict[str, List[Tuple[str, Callable[[str], List[str]]]]] = {
+    "cloudflare": [
+        ("https://www.cloudflare.com/ips-v4", _plain_list),
+        ("https://www.cloudflare.com/ips-v6", _plain_list),
+    ],
+    "fastly": [("https://api.fastly.com/public-ip-list", _fastly_list)],
+    "cloudfront": [("https://ip-ranges.amazonaws.com/ip-ranges.json", _cloudfront_list)],
+}
+
+
+def read_ranges(path: Path = DEFAULT_RANGES_FILE) -> List[Tuple[str, str]]:
+    # [(provider, cidr)] in file order; blank lines and # comments are skipped
+    entries: List[Tuple[str, str]] = []
+    with open(path, "r", encoding="utf-8") as f:
+        for ln in f:
+            ln = ln.split("#", 1)[0].strip()
+            if not ln:
+                continue
+            parts = ln.split()
+            if len(parts) == 2:
+                entries.append((parts[0].lower(), parts[1]))
+    return entries
+
+
+class CdnRangeIndex:
+    """Maps an IP address to the CDN provider whose ranges contain it."""
+
+    def __init__(self, entries: Iterable[Tuple[str, str]]):
+        entries = list(entries)
+        spans: Dict[int, List[Tuple[int, int, str]]] = {4: [], 6: []}
+        self.skipped = 0
+        for provider, cidr in entries:
+            try:
+                net = ipaddress.ip_network(cidr, strict=False)
+            except ValueError:
+                self.skipped += 1
+                continue
+            spans[net.version].append((int(net.network_address), int(net.broadcast_address), provider))
+        self.providers = sorted({provider for provider, _ in entries})
+        self._starts: Dict[int, List[int]] = {}
+        self._spans: Dict[int, List[Tuple[int, int, str]]] = {}
+        for version, items in spans.items():
+            merged: List[Tuple[int, int, str]] = []
+            for start, end, provider in sorted(items):
+                if merged and start <= merged[-1][1] + 1 and provider == merged[-1][2]:
+                    merged[-1] = (merged[-1][0], max(merged[-1][1], end), provider)
+                elif merged and start <= merged[-1][1]:
+                    # Overlap between providers: the earlier range keeps its addresses
+                    if end > merged[-1][1]:
+                        merged.append((merged[-1][1] + 1, end, provider))
+                else:
+                    merged.append((start, end, provider))
+            self._spans[version] = merged
+            self._starts[version] = [span[0] for span in merged]
+        self.size = sum(len(v) for v in self._spans.values())
+
+    @classmethod
+    def load(cls, path: Path = DEFAULT_RANGES_FILE) -> "CdnRangeIndex":
+        return cls(read_ranges(path))
+
+    def lookup(self, ip: Optional[str]) -> Optional[str]:
+        if not ip:
+            return None
+        try:
+            addr = ipaddress.ip_address(ip)
+        except ValueError:
+            return None
+        value = int(addr)
+        starts = self._starts.get(addr.version, [])
+        pos = bisect.bisect_right(starts, value) - 1
+        if pos < 0:
+            return None
+        start, end, provider = self._spans[addr.version][pos]
+        return provider if value <= end else None
+
+
+def _fetch(url: str, timeout: float) -> str:
+    request = urllib.request.Request(url, headers={"User-Agent": "domain-pipeline/cdn-ranges"})
+    with urllib.request.urlopen(request, timeout=timeout) as resp:
+        return resp.read().decode("utf-8", "replace")
+
+
+def update_ranges_file(
+    path: Path = DEFAULT_RANGES_FILE,
+    timeout: float = 20.0,
+    log: Optional[Callable[[str, str], None]] = None,
+) -> Dict[str, int]:
+    """Rewrite the published providers' sections of path; returns CIDR counts per refreshed provider.
+
+    A provider whose download or parse fails keeps its previous lines, so a
+    flaky source never empties the file.
+    """
+    existing = read_ranges(path) if Path(path).exists() else []
+    fresh: Dict[str, List[str]] = {}
+    for provider, sources in PUBLISHED_LISTS.items():
+        cidrs: List[str] = []
+        try:
+            for url, parse in sources:
+                for cidr in parse(_fetch(url, timeout)):
+                    ipaddress.ip_network(cidr, strict=False)
+                    cidrs.append(cidr)
+        except Exception as e:
+            if log:
+                log(f"CDN ranges: keeping previous {provider} list ({e})", "warning")
+            continue
+        if cidrs:
+            fresh[provider] = list(dict.fromkeys(cidrs))
+    kept: Dict[str, List[str]] = {}
+    for provider, cidr in existing:
+        if provider not in fresh:
+            kept.setdefault(provider, []).append(cidr)
+    stamp = datetime.now(timezone.utc).strftime("%Y-%m-%d")
+    lines = [
+        "# provider CIDR -- CDN / anti-DDoS ranges used by step 3 to route domains before fetching",
+        f"# refreshed {stamp} with --update-cdn-ranges ({', '.join(sorted(fresh)) or 'no providers reachable'});",
+        "# providers without a published list are maintained by hand and kept as they are",
+    ]
+    for provider in sorted(set(fresh) | set(kept)):
+        lines.append("")
+        lines.extend(f"{provider} {cidr}" for cidr in fresh.get(provider) or kept[provider])
+    tmp = Path(f"{path}.tmp")
+    tmp.write_text("\n".join(lines) + "\n", encoding="utf-8")
+    tmp.replace(path)
+    return {provider: len(cidrs) for provider, cidrs in fresh.items()}
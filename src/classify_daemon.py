@@ -0,0 +1,441 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Long-running step 2 + step 3 classifier for single domains and small batches.
+
+Checking a community submission by running the batch pipeline pays for
+everything a run sets up: step 2's DNS resolvers and HTTP sessions, step 3's
+per-proxy Fetcher sessions, proxy health, redirect-verdict cache, shared DNS
+cache and the compiled scoring rules. ClassifyService sets all of that up
+once and keeps it warm. It answers over a local HTTP port and/or a Unix
+socket, both with the same small HTTP/1.1 protocol as metrics_exporter.py.
+
+Verdicts come from the same functions the batch runs call: step 2's
+check_domain() and step 3's process_domain(), including CDN range routing
+and the timeout/CDN rescue tiers. Only their output is redirected:
+verdicts go to the waiting request instead of the output files, and every
+status line printed for a domain (and its connection-error detail, which
+would otherwise go to the batch detail log) is returned as its trail. Step 3 only sees
+domains step 2 calls good, as in the pipeline, unless step 2 is left out
+of the request. The browser fallback tier stays off, because its verdict
+would arrive after the answer.
+
+Run from src/ like the batch scripts (proxies.txt and the cache files are
+read from the working directory):
+  python classify_daemon.py                              # http://127.0.0.1:9104
+  python classify_daemon.py --unix /tmp/classify.sock --port 0
+  curl 'http://127.0.0.1:9104/check?domain=example.com&domain=example.org'
+  curl -d '{"domains": ["example.com"], "steps": [3]}' http://127.0.0.1:9104/check
+  curl --unix-socket /tmp/classify.sock http://localhost/health
+"""
+
+import argparse
+import asyncio
+import contextlib
+import importlib.util
+import json
+import os
+import signal
+import sys
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+SCRIPT_DIR = Path(__file__).resolve().parent
+DEFAULT_PORT = int(os.environ.get("CLASSIFY_PORT", 9104))
+MAX_BATCH = 50  # domains per request; larger lists belong in a batch run
+MAX_BODY_BYTES = 64 * 1024
+CHECK_TIMEOUT_SEC = float(os.environ.get("CLASSIFY_CHECK_TIMEOUT", 180))  # per domain and step, rescue tiers included
+STEP3_CONCURRENCY = 64  # step 3 domains fetched at once across all requests
+
+
+def load_script(filename: str, name: str):
+    # The step scripts are not importable by name (hyphens); their __main__ blocks do not run
+    spec = importlib.util.spec_from_file_location(name, SCRIPT_DIR / filename)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def normalize_domain(text: str) -> Optional[str]:
+    domain = text.strip().rstrip(".").lower()
+    if domain.startswith(("http://", "https://")):
+        domain = urlsplit(domain).hostname or ""
+    if not domain or len(domain) > 253 or "." not in domain or any(c.isspace() or c in "/?#@:" for c in domain):
+        return None
+    return domain
+
+
+class _Lines:
+    # Stands in for an output file handle in step 2's check_domain()
+    def __init__(self):
+        self.lines: List[str] = []
+
+    def write(self, text: str) -> None:
+        self.lines.append(text.rstrip("\n"))
+
+
+class _NoProgress:
+    def update(self, n: int = 1) -> None:
+        pass
+
+
+class VerdictSink:
+    """Takes the place of step 3's Writer: final verdicts resolve the checks waiting for them."""
+
+    def __init__(self):
+        self.on_verdict = None
+        self._waiting: Dict[str, asyncio.Future] = {}
+
+    def expect(self, domain: str) -> asyncio.Future:
+        future = asyncio.get_running_loop().create_future()
+        self._waiting[domain] = future
+        return future
+
+    def forget(self, domain: str) -> None:
+        self._waiting.pop(domain, None)
+
+    async def write_line(self, key: str, line: str) -> None:
+        future = self._waiting.pop(line.strip(), None)
+        if future is not None and not future.done():
+            future.set_result(key)
+
+
+class ClassifyService:
+    """Warm step 2 / step 3 state shared by every request."""
+
+    def __init__(self, steps: Tuple[int, ...] = (2, 3)):
+        self.steps = steps
+        self.s2 = load_script("step2-availability-check.py", "step2_availability_check") if 2 in steps else None
+        self.s3 = load_script("step3-content-check.py", "step3_content_check") if 3 in steps else None
+        self.started = time.monotonic()
+        self.requests = 0
+        self.checked: Dict[str, int] = {}
+        # domain -> status lines printed while a check of it is in flight, per step
+        self._trails: Dict[int, Dict[str, List[Dict[str, Any]]]] = {2: {}, 3: {}}
+        self._inflight: Dict[Tuple[int, str], asyncio.Task] = {}
+        self.sessions: List[Any] = []
+        self.fetchers: Dict[str, Any] = {}
+        self.proxy_pool = None
+        self.cdn_index = None
+
+    async def start(self) -> None:
+        if self.s2 is not None:
+            s2 = self.s2
+            s2.STATUS_LISTENER = lambda domain, status, details: self._note(2, domain, status=status, details=details)
+            self.sessions = s2.create_sessions()
+            for server in s2.DNS_SERVERS:
+                s2.get_resolver(server)
+            self._pbar_lock = asyncio.Lock()
+        if self.s3 is not None:
+            s3 = self.s3
+            s3.STATUS_LISTENER = lambda domain, status, score, details: self._note(
+                3, domain, status=status, score=score, details=details
+            )
+            # No connection-error detail log next to the batch outputs; the detail goes into the trail
+            s3.CONN_ERR_DETAIL_LISTENER = lambda domain, reason, detail: self._note(
+                3, domain, connection_error=reason, details=detail
+            )
+            proxies = s3.load_proxies(s3.PROXY_FILE)
+            if not proxies:
+                raise RuntimeError(f"no proxies found in {s3.PROXY_FILE}")
+            self.proxy_pool = s3.ProxyPool(proxies)
+            _, per_proxy = s3.compute_concurrency_limits(len(proxies))
+            for proxy in proxies:
+                try:
+                    self.fetchers[proxy] = s3.Fetcher(concurrency=per_proxy, proxy_url=proxy, ttl_dns_cache=120)
+                except Exception as e:
+                    s3.print_status(f"? Skipping proxy {s3.mask_proxy(proxy)}: {e}", "warning")
+            if not self.fetchers:
+                raise RuntimeError("no valid proxies after initialization")
+            self.sink = VerdictSink()
+            self.limiter = s3.PolitenessLimiter(s3.PROXY_RATE_PER_SEC, s3.PROXY_BURST, s3.HOST_RATE_PER_SEC, s3.HOST_BURST)
+            tiers = s3.build_rescue_tiers(proxies)
+            for spec in tiers:
+                if spec["kind"] == "browser":
+                    spec["enabled"] = False
+            self.router = s3.RescueRouter(tiers, proxies, self.sink, self.limiter, self.proxy_pool)
+            self.breaker = s3.HostBreaker()
+            self.gate = asyncio.Semaphore(STEP3_CONCURRENCY)
+            if s3.CDN_RANGE_ROUTING:
+                try:
+                    self.cdn_index = s3.CdnRangeIndex.load()
+                except OSError as e:
+                    s3.print_status(f"🛰️  CDN ranges unavailable: {e}", "warning")
+            s3.get_redirect_cache()
+            s3.get_shared_dns()
+
+    async def close(self) -> None:
+        for task in list(self._inflight.values()):
+            task.cancel()
+        if self.s2 is not None:
+            for session in self.sessions:
+                await session.close()
+        if self.s3 is not None:
+            s3 = self.s3
+            await self.router.close()
+            await asyncio.gather(*(f.close() for f in self.fetchers.values()))
+            self.proxy_pool.save()
+            redirect_cache = s3.get_redirect_cache()
+            if redirect_cache is not None:
+                redirect_cache.flush()
+                redirect_cache.save()
+            if s3._shared_dns is not None:
+                await s3._shared_dns.close()
+
+    def _note(self, step: int, domain: str, **line) -> None:
+        trail = self._trails[step].get(domain)
+        if trail is not None:
+            trail.append(line)
+
+    async def check(self, domain: str, steps: Tuple[int, ...]) -> Dict[str, Any]:
+        result: Dict[str, Any] = {"domain": domain}
+        ips: List[str] = []
+        if 2 in steps:
+            result["step2"] = await self._once(2, domain, self._step2(domain))
+            ips = result["step2"].get("ips", [])
+            if result["step2"]["verdict"] != "good" and 3 in steps:
+                result["step3"] = {"verdict": None, "skipped": f"step 2 verdict is {result['step2']['verdict']}"}
+                return result
+        if 3 in steps:
+            result["step3"] = await self._once(3, domain, self._step3(domain, ips))
+        return result
+
+    async def _once(self, step: int, domain: str, work) -> Dict[str, Any]:
+        # Concurrent requests for the same domain share one check
+        key = (step, domain)
+        task = self._inflight.get(key)
+        if task is None:
+            task = self._inflight[key] = asyncio.ensure_future(self._timed(step, domain, work))
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        else:
+            work.close()
+        return await asyncio.shield(task)
+
+    async def _timed(self, step: int, domain: str, work) -> Dict[str, Any]:
+        trail = self._trails[step][domain] = []
+        started = time.monotonic()
+        try:
+            answer = await asyncio.wait_for(work, CHECK_TIMEOUT_SEC)
+        except asyncio.TimeoutError:
+            answer = {"verdict": None, "error": f"no verdict within {CHECK_TIMEOUT_SEC:.0f}s"}
+        except Exception as e:
+            answer = {"verdict": "error", "error": str(e)[:200]}
+        finally:
+            self._trails[step].pop(domain, None)
+        answer["seconds"] = round(time.monotonic() - started, 3)
+        answer["trail"] = trail
+        label = f"step{step}_{answer['verdict']}"
+        self.checked[label] = self.checked.get(label, 0) + 1
+        return answer
+
+    async def _step2(self, domain: str) -> Dict[str, Any]:
+        s2 = self.s2
+        files = {key: _Lines() for key in s2.OUTCOME_KEYS}
+        ips_file = _Lines()
+        outcome = await s2.check_domain(
+            domain, self.sessions, _NoProgress(), self._pbar_lock,
+            files['good'], files['non_existent'], files['parked'], files['redirect'], files['incorrect'],
+            ips_file,
+        )
+        written = next((key for key, lines in files.items() if lines.lines), None)
+        answer: Dict[str, Any] = {"verdict": written or "error", "conclusive": outcome is not None}
+        if ips_file.lines:
+            answer["ips"] = ips_file.lines[0].partition("\t")[2].split()
+        return answer
+
+    async def _step3(self, domain: str, ips: List[str]) -> Dict[str, Any]:
+        s3 = self.s3
+        verdict = self.sink.expect(domain)
+        try:
+            async with self.gate:
+                provider = self.cdn_index.lookup(s3.pick_group_ip(ips)) if self.cdn_index is not None and ips else None
+                # Same dispatch as the fast pass: CDN-fronted addresses go straight to the CDN direct tier
+                if provider is None or not self.router.route(s3.CDN_RANGE_LABEL, domain):
+                    try:
+                        await s3.process_domain(
+                            domain, self.proxy_pool, None, self.fetchers, self.sink, self.router, self.limiter, self.breaker
+                        )
+                    except Exception as e:
+                        await self.sink.write_line("error", domain)
+                        s3.print_domain_status(domain, "error", details=f"Exception: {str(e)[:50]}")
+            # Fast-pass verdicts are already set; rescue hand-offs resolve when their tier finishes
+            label = await verdict
+        finally:
+            self.sink.forget(domain)
+            # Let the next request for this domain be routed to the tiers again
+            for tier in self.router.tiers:
+                tier.seen.discard(domain)
+        answer: Dict[str, Any] = {"verdict": label}
+        if provider is not None:
+            answer["cdn"] = provider
+        return answer
+
+    def health(self) -> Dict[str, Any]:
+        info: Dict[str, Any] = {
+            "uptime_seconds": round(time.monotonic() - self.started, 1),
+            "steps": list(self.steps),
+            "requests": self.requests,
+            "in_flight": len(self._inflight),
+            "verdicts": self.checked,
+        }
+        if self.s2 is not None:
+            info["step2"] = {"sessions": len(self.sessions), "resolvers": len(self.s2._RESOLVERS)}
+        if self.s3 is not None:
+            info["step3"] = {
+                "fetchers": len(self.fetchers),
+                "rescue_pending": self.router.pending(),
+                "cdn_ranges": self.cdn_index.size if self.cdn_index is not None else 0,
+            }
+        return info
+
+
+def _parse_steps(values: List[str], allowed: Tuple[int, ...]) -> Tuple[int, ...]:
+    steps = set()
+    for value in values:
+        for part in str(value).split(","):
+            if part.strip():
+                steps.add(int(part))
+    if not steps:
+        return allowed
+    if not steps <= set(allowed):
+        raise ValueError(f"steps must be among {', '.join(map(str, allowed))}")
+    return tuple(sorted(steps))
+
+
+class ClassifyServer:
+    """Minimal HTTP front end: GET/POST /check and GET /health."""
+
+    def __init__(self, service: ClassifyService):
+        self.service = service
+        self._servers: List[asyncio.AbstractServer] = []
+
+    async def listen_tcp(self, host: str, port: int) -> None:
+        self._servers.append(await asyncio.start_server(self._handle, host, port))
+
+    async def listen_unix(self, path: str) -> None:
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(path)
+        self._servers.append(await asyncio.start_unix_server(self._handle, path=path))
+
+    async def close(self) -> None:
+        for server in self._servers:
+            server.close()
+            with contextlib.suppress(Exception):
+                await server.wait_closed()
+        self._servers = []
+
+    async def _request(self, method: str, target: str, body: bytes) -> Tuple[int, Dict[str, Any]]:
+        url = urlsplit(target)
+        if url.path == "/health":
+            return 200, self.service.health()
+        if url.path != "/check":
+            return 404, {"error": "not found"}
+        query = parse_qs(url.query)
+        names: List[str] = list(query.get("domain", []))
+        steps_raw: List[str] = list(query.get("steps", []))
+        if method == "POST" and body:
+            try:
+                payload = json.loads(body)
+            except ValueError:
+                return 400, {"error": "body is not JSON"}
+            if not isinstance(payload, dict):
+                return 400, {"error": 'expected {"domains": [...]}'}
+            names += [str(d) for d in payload.get("domains", [])]
+            steps_raw += [str(s) for s in payload.get("steps", [])]
+        try:
+            steps = _parse_steps(steps_raw, self.service.steps)
+        except ValueError as e:
+            return 400, {"error": str(e)}
+        domains = list(dict.fromkeys(d for d in map(normalize_domain, names) if d))
+        invalid = [n for n in names if not normalize_domain(n)]
+        if not domains:
+            return 400, {"error": "no valid domain given", "invalid": invalid}
+        if len(domains) > MAX_BATCH:
+            return 413, {"error": f"at most {MAX_BATCH} domains per request"}
+        self.service.requests += 1
+        started = time.monotonic()
+        results = await asyncio.gather(*(self.service.check(d, steps) for d in domains))
+        answer: Dict[str, Any] = {"results": results, "seconds": round(time.monotonic() - started, 3)}
+        if invalid:
+            answer["invalid"] = invalid
+        return 200, answer
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            request = await asyncio.wait_for(reader.readline(), timeout=10)
+            length = 0
+            while True:
+                line = await asyncio.wait_for(reader.readline(), timeout=10)
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                name, _, value = line.decode("latin-1").partition(":")
+                if name.strip().lower() == "content-length":
+                    length = int(value.strip() or 0)
+            parts = request.decode("latin-1").split()
+            if len(parts) < 2 or parts[0] not in ("GET", "POST"):
+                status, answer = 405, {"error": "use GET or POST"}
+            elif length > MAX_BODY_BYTES:
+                status, answer = 413, {"error": f"body over {MAX_BODY_BYTES} bytes"}
+            else:
+                body = await asyncio.wait_for(reader.readexactly(length), timeout=10) if length else b""
+                status, answer = await self._request(parts[0], parts[1], body)
+            payload = json.dumps(answer, ensure_ascii=False).encode("utf-8") + b"\n"
+            reason = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 413: "Payload Too Large"}[status]
+            writer.write(
+                f"HTTP/1.1 {status} {reason}\r\nContent-Type: application/json; charset=utf-8\r\n"
+                f"Content-Length: {len(payload)}\r\nConnection: close\r\n\r\n".encode("latin-1")
+                + payload
+            )
+            await writer.drain()
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+            with contextlib.suppress(Exception):
+                await writer.wait_closed()
+
+
+async def serve(host: str, port: int, unix_path: Optional[str], steps: Tuple[int, ...]) -> None:
+    service = ClassifyService(steps)
+    log = (service.s3 or service.s2).print_status
+    await service.start()
+    server = ClassifyServer(service)
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        with contextlib.suppress(NotImplementedError):
+            loop.add_signal_handler(sig, stop.set)
+    try:
+        if port:
+            await server.listen_tcp(host, port)
+            log(f"🛎️  Classifier listening on http://{host}:{port} (steps {', '.join(map(str, steps))})", "success")
+        if unix_path:
+            await server.listen_unix(unix_path)
+            log(f"🛎️  Classifier listening on unix:{unix_path} (steps {', '.join(map(str, steps))})", "success")
+        await stop.wait()
+    finally:
+        log("🧹 Shutting down classifier...", "progress")
+        await server.close()
+        await service.close()
+        if unix_path:
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(unix_path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Warm step 2 + step 3 classifier over a local HTTP port or Unix socket")
+    parser.add_argument("--host", default="127.0.0.1", help="Address to listen on (default 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help=f"TCP port, 0 to disable (default {DEFAULT_PORT})")
+    parser.add_argument("--unix", metavar="PATH", help="Also (or only, with --port 0) listen on this Unix socket")
+    parser.add_argument("--steps", default="2,3", help="Steps to serve: 2, 3 or 2,3 (default)")
+    args = parser.parse_args()
+    try:
+        served = _parse_steps([args.steps], (2, 3))
+    except ValueError as e:
+        parser.error(f"--steps: {e}")
+    if not args.port and not args.unix:
+        parser.error("nothing to listen on: give --port or --unix")
+    asyncio.run(serve(args.host, args.port, args.unix, served))
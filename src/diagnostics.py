@@ -0,0 +1,292 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+On-demand diagnostics for long-running step 2 / step 3 / step 4 jobs.
+
+`kill -USR1 <pid>` writes diagnostics_<name>_<timestamp>.txt next to the
+job's outputs with:
+- asyncio tasks, grouped by identical stack (asyncio scripts only);
+- every thread's stack;
+- the top tracemalloc allocation sites (growth since the previous dump when
+  tracing is always on, else over a short window traced by the dump);
+- whatever pool / queue sizes the script registered with add_probe().
+
+The signal handler only snapshots task stacks and probes (cheap, and they
+must be read on the loop thread); formatting, the tracemalloc snapshot and
+the file write happen on a short-lived daemon thread, and a second signal
+while a dump is still running is ignored. Unless PYTHONTRACEMALLOC already
+enabled tracemalloc, the dump thread traces for trace_window seconds and
+stops again, so the job only pays the tracing overhead while it dumps.
+"""
+
+import asyncio
+import contextlib
+import gc
+import linecache
+import os
+import signal
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Mapping, Optional, Tuple
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+Frame = Tuple[str, int, str]
+
+
+def _frames(frame_list) -> Tuple[Frame, ...]:
+    return tuple((f.f_code.co_filename, f.f_lineno, f.f_code.co_name) for f in frame_list)
+
+
+def _format_frames(frames: Tuple[Frame, ...], indent: str = "    ") -> List[str]:
+    lines = []
+    for filename, lineno, name in frames:
+        lines.append(f'{indent}File "{filename}", line {lineno}, in {name}')
+        source = linecache.getline(filename, lineno).strip()
+        if source:
+            lines.append(f"{indent}  {source}")
+    return lines
+
+
+class DiagnosticsDumper:
+    """Writes a diagnostics file whenever the process receives SIGUSR1."""
+
+    def __init__(
+        self,
+        name: str,
+        *,
+        directory: str = ".",
+        log: Optional[Callable[[str, str], None]] = None,
+        top: int = 25,
+        stack_limit: int = 12,
+        trace_frames: int = 5,
+        trace_window: float = 10.0,
+    ):
+        self.name = name
+        self.directory = directory
+        self.log = log
+        self.top = top
+        self.stack_limit = stack_limit
+        self.trace_frames = trace_frames
+        self.trace_window = trace_window
+        self.dumps = 0
+        self._probes: List[Tuple[str, Callable[[], Mapping[str, Any]]]] = []
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._signal = getattr(signal, "SIGUSR1", None)
+        self._previous_handler = None
+        self._busy = threading.Lock()
+        self._snapshot: Optional[tracemalloc.Snapshot] = None
+        self._snapshot_at: Optional[float] = None
+        self._started = time.monotonic()
+
+    def add_probe(self, title: str, probe: Callable[[], Mapping[str, Any]]) -> None:
+        # probe() returns {label: value}; it runs on the loop thread in asyncio scripts
+        self._probes.append((title, probe))
+
+    def install(self, loop: Optional[asyncio.AbstractEventLoop] = None) -> bool:
+        """Register the handler; pass the running loop from asyncio scripts.
+
+        Returns False where SIGUSR1 does not exist (Windows) or the handler
+        cannot be registered from this thread.
+        """
+        if self._signal is None:
+            return False
+        try:
+            if loop is not None:
+                loop.add_signal_handler(self._signal, self._on_signal_loop)
+                self._loop = loop
+            else:
+                self._previous_handler = signal.signal(self._signal, self._on_signal_sync)
+        except (ValueError, RuntimeError, NotImplementedError):
+            return False
+        if self.log:
+            self.log(f"🩺 Diagnostics on demand: kill -USR1 {os.getpid()}", "info")
+        return True
+
+    def uninstall(self) -> None:
+        if self._signal is None:
+            return
+        with contextlib.suppress(Exception):
+            if self._loop is not None:
+                self._loop.remove_signal_handler(self._signal)
+                self._loop = None
+            elif self._previous_handler is not None:
+                signal.signal(self._signal, self._previous_handler)
+                self._previous_handler = None
+
+    def _on_signal_loop(self) -> None:
+        if not self._busy.acquire(blocking=False):
+            return
+        try:
+            tasks = self._task_stacks()
+            probes = self._run_probes()
+        except Exception:
+            self._busy.release()
+            raise
+        self._spawn(tasks, probes)
+
+    def _on_signal_sync(self, signum, frame) -> None:
+        if not self._busy.acquire(blocking=False):
+            return
+        # No loop to protect here: probes run on the dump thread with everything else
+        self._spawn(None, None)
+
+    def _spawn(self, tasks, probes) -> None:
+        thread = threading.Thread(target=self._dump, args=(tasks, probes), name=f"{self.name}-diagnostics", daemon=True)
+        thread.start()
+
+    def _task_stacks(self) -> Counter:
+        # (coroutine, stack) -> task count; thousands of workers collapse to a few entries
+        stacks: Counter = Counter()
+        current = asyncio.current_task()
+        for task in asyncio.all_tasks(self._loop):
+            if task is current:
+                continue
+            coro = task.get_coro()
+            coro_name = getattr(coro, "__qualname__", None) or repr(coro)
+            stacks[(coro_name, _frames(task.get_stack(limit=self.stack_limit)))] += 1
+        return stacks
+
+    def _run_probes(self) -> List[Tuple[str, Any]]:
+        results = []
+        for title, probe in self._probes:
+            try:
+                results.append((title, dict(probe())))
+            except Exception as e:
+                results.append((title, e))
+        return results
+
+    def _dump(self, tasks: Optional[Counter], probes: Optional[List[Tuple[str, Any]]]) -> None:
+        try:
+            if probes is None:
+                probes = self._run_probes()
+            stamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            path = os.path.join(self.directory, f"diagnostics_{self.name}_{stamp}.txt")
+            if os.path.exists(path):
+                path = os.path.join(self.directory, f"diagnostics_{self.name}_{stamp}_{self.dumps + 1}.txt")
+            lines = self._header()
+            lines += self._probe_section(probes)
+            if tasks is not None:
+                lines += self._task_section(tasks)
+            lines += self._thread_section()
+            lines += self._memory_section()
+            with open(path, "w", encoding="utf-8") as f:
+                f.write("\n".join(lines) + "\n")
+            self.dumps += 1
+            self._notify(f"🩺 Diagnostics written to {path}", "info")
+        except Exception as e:
+            self._notify(f"🩺 Diagnostics dump failed: {e}", "warning")
+        finally:
+            self._busy.release()
+
+    def _notify(self, message: str, kind: str) -> None:
+        if not self.log:
+            return
+        if self._loop is not None and not self._loop.is_closed():
+            with contextlib.suppress(RuntimeError):
+                self._loop.call_soon_threadsafe(self.log, message, kind)
+                return
+        self.log(message, kind)
+
+    def _header(self) -> List[str]:
+        lines = [
+            f"# {self.name} diagnostics, pid {os.getpid()}, {datetime.now().isoformat(timespec='seconds')}",
+            f"uptime_sec = {time.monotonic() - self._started:.0f}",
+            f"threads = {threading.active_count()}",
+            f"gc_counts = {gc.get_count()}",
+        ]
+        if psutil is not None:
+            with contextlib.suppress(Exception):
+                proc = psutil.Process()
+                lines.append(f"rss_mb = {proc.memory_info().rss / (1024 ** 2):.1f}")
+                lines.append(f"open_fds = {proc.num_fds()}")
+        return lines + [""]
+
+    def _probe_section(self, probes: List[Tuple[str, Any]]) -> List[str]:
+        lines = ["## Pools and queues"]
+        for title, values in probes:
+            if isinstance(values, Exception):
+                lines.append(f"{title}: probe failed: {values}")
+                continue
+            for label, value in values.items():
+                lines.append(f"{title}.{label} = {value}")
+        if not probes:
+            lines.append("(none registered)")
+        return lines + [""]
+
+    def _task_section(self, tasks: Counter) -> List[str]:
+        lines = [f"## asyncio tasks: {sum(tasks.values())} pending, {len(tasks)} distinct stacks"]
+        for (coro_name, frames), count in tasks.most_common():
+            lines.append(f"- {count} x {coro_name}")
+            lines += _format_frames(frames)
+        return lines + [""]
+
+    def _thread_section(self) -> List[str]:
+        names = {t.ident: t.name for t in threading.enumerate()}
+        me = threading.get_ident()
+        frames = sys._current_frames()
+        lines = [f"## Threads: {len(frames)}"]
+        for ident, frame in frames.items():
+            if ident == me:
+                continue
+            stack = []
+            while frame is not None and len(stack) < self.stack_limit:
+                stack.append(frame)
+                frame = frame.f_back
+            lines.append(f"- {names.get(ident, '?')} ({ident})")
+            lines += _format_frames(_frames(reversed(stack)))
+        return lines + [""]
+
+    def _memory_section(self) -> List[str]:
+        lines = ["## tracemalloc"]
+        if not tracemalloc.is_tracing():
+            # Trace only for the window: leaving it on would slow every allocation for the rest of the run
+            tracemalloc.start(self.trace_frames)
+            try:
+                time.sleep(self.trace_window)
+                snapshot = self._take_snapshot()
+                current, peak = tracemalloc.get_traced_memory()
+            finally:
+                tracemalloc.stop()
+            lines.append(f"traced_mb = {current / (1024 ** 2):.1f} (peak {peak / (1024 ** 2):.1f})")
+            lines.append(f"Top {self.top} sites of allocations made during a {self.trace_window:g}s window and still alive (tracing stopped again):")
+            for stat in snapshot.statistics("lineno")[: self.top]:
+                lines.append(f"  {stat}")
+            return lines + [""]
+        snapshot = self._take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        lines.append(f"traced_mb = {current / (1024 ** 2):.1f} (peak {peak / (1024 ** 2):.1f})")
+        if self._snapshot is None:
+            lines.append(f"Top {self.top} allocation sites (no previous dump to compare with):")
+            for stat in snapshot.statistics("lineno")[: self.top]:
+                lines.append(f"  {stat}")
+        else:
+            since = time.monotonic() - (self._snapshot_at or self._started)
+            lines.append(f"Top {self.top} allocation changes over the last {since:.0f}s:")
+            for stat in snapshot.compare_to(self._snapshot, "lineno")[: self.top]:
+                lines.append(f"  {stat}")
+        self._snapshot = snapshot
+        self._snapshot_at = time.monotonic()
+        return lines + [""]
+
+    @staticmethod
+    def _take_snapshot() -> tracemalloc.Snapshot:
+        return tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, linecache.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        ))
+
+
+def queue_probe(**queues: Any) -> Callable[[], Dict[str, int]]:
+    # Probe over named queue.Queue / asyncio.Queue objects; None entries are skipped
+    def probe() -> Dict[str, int]:
+        return {name: q.qsize() for name, q in queues.items() if q is not None}
+    return probe
@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Registrable-domain families for step 2 and step 3.
+
+Inputs often hold both example.com and www.example.com, or hundreds of
+random subdomains of one registrable domain. FamilySampler groups them
+before any network work:
+- www.<name> waits for <name> when both are listed and takes its verdict;
+- a family of at least min_family members probes sample_size of them
+  (the apex first when it is listed) and holds the rest back.
+Once every sampled member has a verdict, an agreed verdict from the
+propagate set is spread to the held members; disagreement, or a verdict
+outside that set (timeouts, errors), releases them to be probed as usual.
+Families follow the Public Suffix List (public_suffix.py), private section
+included, so user sites under github.io or blogspot.com are not lumped together.
+"""
+
+import asyncio
+import random
+from collections import Counter
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from public_suffix import registrable_domain
+
+
+class _Family:
+    __slots__ = ("key", "sample", "held", "verdicts", "outcome")
+
+    def __init__(self, key: str):
+        self.key = key
+        self.sample: Set[str] = set()
+        self.held: List[str] = []
+        self.verdicts: Dict[str, str] = {}
+        self.outcome: Optional[str] = None  # agreed verdict, or "released"
+
+
+class FamilySampler:
+    """Decides which domains are probed and spreads sampled verdicts to the rest."""
+
+    def __init__(
+        self,
+        propagate: Iterable[str],
+        *,
+        sample_size: int = 4,
+        min_family: int = 10,
+        key: Callable[[str], str] = registrable_domain,
+        seed: int = 0,
+    ):
+        self.propagate = frozenset(propagate)
+        self.sample_size = max(1, sample_size)
+        self.min_family = max(2, min_family)
+        self.key = key
+        self.seed = seed
+        self.families: Dict[str, _Family] = {}
+        self._sample_of: Dict[str, _Family] = {}
+        self._held: Set[str] = set()
+        self._released: List[str] = []
+        self._inferred: List[Tuple[str, str, str]] = []
+        self._changed: Optional[asyncio.Event] = None
+        self.total = 0
+        self.inferred = 0
+        self.released = 0
+        self.sampled_families = 0
+        self.www_pairs = 0
+
+    def plan(self, domains: Callable[[], Iterable[str]]) -> None:
+        """Group the input; domains() is called twice so only large families are kept in memory.
+
+        Domains must already be normalized (lowercase, no trailing dot) and unique.
+        """
+        sizes: Counter = Counter()
+        www_twins: Set[str] = set()
+        for dom in domains():
+            sizes[self.key(dom)] += 1
+            if dom.startswith("www."):
+                www_twins.add(dom[4:])
+            self.total += 1
+        members: Dict[str, List[str]] = {}
+        pairs: List[str] = []
+        for dom in domains():
+            family_key = self.key(dom)
+            if sizes[family_key] >= self.min_family:
+                members.setdefault(family_key, []).append(dom)
+            elif dom in www_twins:
+                pairs.append(dom)
+        del sizes, www_twins
+        for family_key, listed in members.items():
+            family = self._family(family_key)
+            apex_first = sorted(listed, key=lambda d: (d != family_key, d))
+            rng = random.Random(f"{self.seed}:{family_key}")
+            sample = apex_first[:1] if apex_first[0] == family_key else []
+            # With the apex sampled, www.<apex> would only repeat its answer
+            rest = [d for d in apex_first[len(sample):] if not (sample and d == "www." + family_key)]
+            sample += rng.sample(rest, min(len(rest), self.sample_size - len(sample)))
+            family.sample.update(sample)
+            family.held = [d for d in listed if d not in family.sample]
+            self.sampled_families += 1
+        for apex in pairs:
+            family = self._family(apex)
+            family.sample.add(apex)
+            family.held = ["www." + apex]
+            self.www_pairs += 1
+        for family in self.families.values():
+            for dom in family.sample:
+                self._sample_of[dom] = family
+            self._held.update(family.held)
+
+    def _family(self, family_key: str) -> _Family:
+        family = self.families.get(family_key)
+        if family is None:
+            family = self.families[family_key] = _Family(family_key)
+        return family
+
+    def admit(self, domain: str) -> bool:
+        # False for members held back behind their family's sample; they come out of take_released()/take_inferred()
+        return domain not in self._held
+
+    @property
+    def pending(self) -> int:
+        # Held members whose family has no outcome yet
+        return sum(len(f.held) for f in self.families.values() if f.outcome is None)
+
+    def observe(self, domain: str, verdict: str) -> None:
+        family = self._sample_of.get(domain)
+        if family is None or family.outcome is not None or domain in family.verdicts:
+            return
+        family.verdicts[domain] = verdict
+        if len(family.verdicts) < len(family.sample):
+            return
+        outcomes = set(family.verdicts.values())
+        agreed = outcomes.pop() if len(outcomes) == 1 else None
+        if agreed in self.propagate:
+            family.outcome = agreed
+            self._inferred.extend((dom, agreed, family.key) for dom in family.held)
+            self.inferred += len(family.held)
+        else:
+            family.outcome = "released"
+            self._released.extend(family.held)
+            self.released += len(family.held)
+        if self._changed is not None:
+            self._changed.set()
+
+    def release_all(self) -> int:
+        # Give up on families still waiting (a sampled domain never reported back); returns the count released
+        count = 0
+        for family in self.families.values():
+            if family.outcome is None:
+                family.outcome = "released"
+                self._released.extend(family.held)
+                count += len(family.held)
+        self.released += count
+        return count
+
+    def take_released(self) -> List[str]:
+        released, self._released = self._released, []
+        return released
+
+    def take_inferred(self) -> List[Tuple[str, str, str]]:
+        # [(domain, verdict, family key)]
+        inferred, self._inferred = self._inferred, []
+        return inferred
+
+    async def wait(self, timeout: float) -> bool:
+        """Wait for the next family outcome; False if none arrived within timeout."""
+        if self._released or self._inferred:
+            return True
+        if self._changed is None:
+            self._changed = asyncio.Event()
+        self._changed.clear()
+        try:
+            await asyncio.wait_for(self._changed.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    def plan_line(self) -> str:
+        held = len(self._held)
+        return (
+            f"👪 Domain families: {self.sampled_families:,} families of {self.min_family}+ sampled "
+            f"{self.sample_size} each, {self.www_pairs:,} www/apex pairs; {held:,} of {self.total:,} domains held back"
+        )
+
+    def report_line(self) -> str:
+        share = self.inferred / self.total * 100 if self.total else 0.0
+        return (
+            f"👪 Domain families: {self.inferred:,} verdicts spread from samples ({share:.1f}% of probes avoided), "
+            f"{self.released:,} held domains probed after their sample disagreed"
+        )
@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Per-domain processing time and verdict carried across runs, for
+longest-processing-time-first scheduling and incremental runs.
+
+With a fixed number of workers, the run ends when the last worker goes
+idle; a lone 30-second timeout picked up near the end stretches the whole
+run by that much. DomainHistory keeps, per domain, a smoothed processing
+time and the last outcome in a TSV file, and schedule() streams an input so
+the domains predicted to be slowest start first while domains without
+history are spread evenly through the run, so new slow ones are not all
+left for last either.
+
+IncrementalPlan uses the same history to check only new domains and a
+rolling slice of verdicts older than their outcome's max age, copying the
+rest forward. Each step keeps its own history file.
+
+File format (domain_history.tsv by default), one domain per line:
+  domain <TAB> seconds ("-" if not timed) <TAB> outcome <TAB> checked at (unix time) <TAB> runs
+"""
+
+import os
+import time
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Iterator, List, Mapping, Optional, Set, Tuple
+
+DEFAULT_HISTORY_FILE = "domain_history.tsv"
+HISTORY_MAX_AGE_SEC = 30 * 86400  # entries not checked for this long are dropped on load
+HISTORY_MAX_ENTRIES = 2_000_000  # most recently seen entries are kept when the file is saved
+HISTORY_SMOOTHING = 0.5  # weight of the newest observation in the smoothed time
+
+
+class DomainHistory:
+    """Smoothed processing seconds and last verdict per domain."""
+
+    def __init__(
+        self,
+        path: Optional[str] = DEFAULT_HISTORY_FILE,
+        *,
+        max_age: float = HISTORY_MAX_AGE_SEC,
+        max_entries: int = HISTORY_MAX_ENTRIES,
+        smoothing: float = HISTORY_SMOOTHING,
+    ):
+        self.path = path
+        self.max_age = max_age
+        self.max_entries = max_entries
+        self.smoothing = smoothing
+        self.entries: Dict[str, List] = {}  # domain -> [seconds or None, outcome, checked at, runs]
+        self.loaded = 0
+        self.recorded = 0
+        self.scheduled_known = 0
+        self.scheduled_new = 0
+        if path:
+            self.load()
+
+    def load(self) -> int:
+        cutoff = time.time() - self.max_age
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                for ln in f:
+                    parts = ln.rstrip("\n").split("\t")
+                    if len(parts) != 5:
+                        continue
+                    try:
+                        seconds = None if parts[1] == "-" else float(parts[1])
+                        entry = [seconds, parts[2], int(parts[3]), int(parts[4])]
+                    except ValueError:
+                        continue
+                    if entry[2] >= cutoff:
+                        self.entries[parts[0]] = entry
+        except OSError:
+            pass
+        self.loaded = len(self.entries)
+        return self.loaded
+
+    def save(self) -> None:
+        if not self.path:
+            return
+        items: Iterable[Tuple[str, List]] = self.entries.items()
+        if len(self.entries) > self.max_entries:
+            items = sorted(items, key=lambda kv: kv[1][2], reverse=True)[: self.max_entries]
+        tmp = Path(f"{self.path}.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            for domain, (seconds, outcome, seen, runs) in items:
+                timed = "-" if seconds is None else f"{seconds:.3f}"
+                f.write(f"{domain}\t{timed}\t{outcome}\t{seen}\t{runs}\n")
+        os.replace(tmp, self.path)
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def predict(self, domain: str) -> Optional[float]:
+        entry = self.entries.get(domain)
+        return entry[0] if entry is not None else None
+
+    def outcome(self, domain: str) -> Optional[str]:
+        entry = self.entries.get(domain)
+        return entry[1] if entry is not None else None
+
+    def record(self, domain: str, seconds: float, outcome: Optional[str] = None) -> None:
+        # A timed check; pass outcome when the verdict is already final, or report it with note_verdict()
+        entry = self._entry(domain)
+        entry[0] = seconds if entry[0] is None else self.smoothing * seconds + (1 - self.smoothing) * entry[0]
+        entry[3] += 1
+        if outcome is not None:
+            self.note_verdict(domain, outcome)
+        self.recorded += 1
+
+    def note_verdict(self, domain: str, outcome: str) -> None:
+        # The verdict a check of this run ended with; copied-forward verdicts must not come through here.
+        # Only a verdict moves "checked at": a timed attempt that ended in a retry or hand-off doesn't.
+        entry = self._entry(domain)
+        entry[1] = outcome
+        entry[2] = int(time.time())
+
+    def _entry(self, domain: str) -> List:
+        entry = self.entries.get(domain)
+        if entry is None:
+            entry = self.entries[domain] = [None, "", int(time.time()), 0]
+        return entry
+
+    def schedule(self, domains: Callable[[], Iterable[str]]) -> Iterator[str]:
+        """Order domains with known ones slowest first and new ones spread evenly among them.
+
+        domains() is called twice: once here to pick out the known domains,
+        which are sorted in memory (they are already held in the history),
+        and once while the returned iterator streams the new ones in input order.
+        """
+        known: List[Tuple[float, int, str]] = []
+        new = 0
+        for pos, dom in enumerate(domains()):
+            seconds = self.predict(dom)
+            if seconds is None:
+                new += 1
+            else:
+                known.append((-seconds, pos, dom))
+        known.sort()
+        self.scheduled_known = len(known)
+        self.scheduled_new = new
+        return self._interleave([dom for _, _, dom in known], new, domains)
+
+    def _interleave(self, known: List[str], new: int, domains: Callable[[], Iterable[str]]) -> Iterator[str]:
+        total = len(known) + new
+        # record() adds entries while this streams, so test against the planned set, not the history
+        planned = set(known)
+        fresh = (dom for dom in domains() if dom not in planned)
+        emitted_new = 0
+        next_known = 0
+        for emitted in range(total):
+            # Keep the share of new domains emitted so far at new / total
+            if next_known >= len(known) or (emitted_new + 1) * total <= (emitted + 1) * new:
+                dom = next(fresh, None)
+                if dom is not None:
+                    emitted_new += 1
+                    yield dom
+                    continue
+            if next_known < len(known):
+                yield known[next_known]
+                next_known += 1
+
+    def plan_line(self) -> str:
+        return (
+            f"⏳ Domain history: {self.scheduled_known:,} known domains scheduled slowest first, "
+            f"{self.scheduled_new:,} new ones interleaved ({self.loaded:,} entries in {self.path})"
+        )
+
+    def report_line(self) -> str:
+        return f"⏳ Domain history: {self.recorded:,} timings recorded, {len(self.entries):,} entries saved to {self.path}"
+
+
+class IncrementalPlan:
+    """Splits an input into domains to check and verdicts copied forward from a DomainHistory.
+
+    New domains are always checked, as are domains whose recorded outcome
+    is not in copyable (errors and transient labels). A known
+    verdict is due once it is older than max_age for its outcome; the oldest
+    due verdicts are rechecked, at most recheck_share of the known domains
+    per run, so a large backlog spreads over several runs instead of
+    arriving all at once.
+    """
+
+    def __init__(
+        self,
+        history: DomainHistory,
+        copyable: Iterable[str],
+        max_age: Mapping[str, float],
+        default_max_age: float,
+        recheck_share: float,
+    ):
+        self.history = history
+        self.copyable = frozenset(copyable)
+        self.max_age = dict(max_age)
+        self.default_max_age = default_max_age
+        self.recheck_share = recheck_share
+        self._copy: Set[str] = set()  # domains copied forward, fixed by plan()
+        self.rechecks = 0
+        self.new = 0
+        self.carried = 0
+        self.known = 0
+        self.due = 0
+        self.copied = 0
+
+    def plan(self, domains: Callable[[], Iterable[str]], force: Iterable[str] = ()) -> None:
+        """Pick this run's rechecks; force lists domains checked regardless (a carry-over).
+
+        Call it before the run records anything: the split is fixed here, so
+        wants() keeps its answer while this run's checks update the history.
+        """
+        forced = set(force)
+        now = time.time()
+        due: List[Tuple[int, str]] = []
+        for dom in domains():
+            if dom in forced:
+                self.carried += 1
+                continue
+            entry = self.history.entries.get(dom)
+            if entry is None or entry[1] not in self.copyable:
+                self.new += 1
+                continue
+            self.known += 1
+            self._copy.add(dom)
+            if now - entry[2] > self.max_age.get(entry[1], self.default_max_age):
+                due.append((entry[2], dom))
+        self.due = len(due)
+        due.sort()
+        limit = max(1, int(self.known * self.recheck_share)) if due else 0
+        self.rechecks = min(limit, len(due))
+        self._copy.difference_update(dom for _, dom in due[:limit])
+
+    def wants(self, domain: str) -> bool:
+        return domain not in self._copy
+
+    def copy_forward(self, domain: str) -> Optional[str]:
+        # The recorded outcome to write for a domain that is not checked this run
+        if self.wants(domain):
+            return None
+        self.copied += 1
+        return self.history.entries[domain][1]
+
+    def select(self, domains: Iterable[str]) -> Iterator[str]:
+        return (dom for dom in domains if self.wants(dom))
+
+    def plan_line(self) -> str:
+        deferred = self.due - self.rechecks
+        return (
+            f"♻️  Incremental: checking {self.new:,} new domains, "
+            + (f"{self.carried:,} carried over, " if self.carried else "")
+            + f"{self.rechecks:,} of {self.due:,} stale verdicts"
+            + (f" ({deferred:,} left for later runs)" if deferred else "")
+            + f"; {self.known - self.rechecks:,} verdicts copied forward"
+        )
@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Prometheus text-format metrics endpoint for long-running step 2 / step 3 jobs.
+
+MetricsExporter serves GET /metrics on localhost from a plain asyncio server
+(no extra dependencies). Scripts register collectors: callables returning a
+list of MetricFamily, evaluated on every scrape, so nothing is sampled when
+nobody is scraping. The exporter itself adds process RSS, event-loop lag,
+uptime and a domains-per-second gauge derived from the processed counter.
+"""
+
+import asyncio
+import contextlib
+import time
+from collections import deque
+from typing import Callable, Deque, Dict, Iterable, List, Optional, Sequence, Tuple
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, int) or float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class MetricFamily:
+    # One metric name with its samples; kind is "counter", "gauge" or "histogram"
+    def __init__(self, name: str, kind: str, help_text: str):
+        self.name = name
+        self.kind = kind
+        self.help = help_text
+        self.samples: List[Tuple[str, Dict[str, str], float]] = []
+
+    def add(self, value: float, **labels) -> "MetricFamily":
+        self.samples.append((self.name, labels, value))
+        return self
+
+    def add_histogram(self, bounds: Sequence[float], counts: Sequence[int], total_sum: float, **labels) -> "MetricFamily":
+        # counts are per bucket (last one is the overflow bucket); Prometheus wants them cumulative
+        running = 0
+        for bound, count in zip(list(bounds) + [float("inf")], counts):
+            running += count
+            self.samples.append((f"{self.name}_bucket", dict(labels, le=_format_value(bound)), running))
+        self.samples.append((f"{self.name}_sum", labels, total_sum))
+        self.samples.append((f"{self.name}_count", labels, running))
+        return self
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for name, labels, value in self.samples:
+            if labels:
+                rendered = ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items())
+                lines.append(f"{name}{{{rendered}}} {_format_value(value)}")
+            else:
+                lines.append(f"{name} {_format_value(value)}")
+        return "\n".join(lines)
+
+
+class MetricsExporter:
+    """Serves registered collectors at http://host:port/metrics."""
+
+    RATE_WINDOW_SEC = 60.0
+
+    def __init__(
+        self,
+        namespace: str,
+        port: int,
+        host: str = "127.0.0.1",
+        processed: Optional[Callable[[], int]] = None,
+        log: Optional[Callable[[str, str], None]] = None,
+    ):
+        self.namespace = namespace
+        self.port = port
+        self.host = host
+        self.processed = processed
+        self.log = log
+        self._collectors: List[Callable[[], Iterable[MetricFamily]]] = []
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._lag_task: Optional[asyncio.Task] = None
+        self._lag = 0.0
+        self._started = time.monotonic()
+        self._rate_samples: Deque[Tuple[float, int]] = deque()
+        self.scrapes = 0
+
+    def add_collector(self, collector: Callable[[], Iterable[MetricFamily]]) -> None:
+        self._collectors.append(collector)
+
+    def family(self, name: str, kind: str, help_text: str) -> MetricFamily:
+        return MetricFamily(f"{self.namespace}_{name}", kind, help_text)
+
+    async def start(self) -> None:
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self._lag_task = asyncio.create_task(self._lag_probe())
+        if self.log:
+            self.log(f"📡 Metrics at http://{self.host}:{self.port}/metrics", "info")
+
+    async def stop(self) -> None:
+        if self._lag_task is not None:
+            self._lag_task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._lag_task
+            self._lag_task = None
+        if self._server is not None:
+            self._server.close()
+            with contextlib.suppress(Exception):
+                await self._server.wait_closed()
+            self._server = None
+
+    async def _lag_probe(self) -> None:
+        # Overshoot of a short sleep; reported as the latest value and kept until the next probe
+        period = 0.5
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(period)
+            self._lag = max(0.0, time.monotonic() - started - period)
+
+    def _builtin(self) -> List[MetricFamily]:
+        families = [
+            self.family("uptime_seconds", "gauge", "Seconds since the exporter started").add(round(time.monotonic() - self._started, 3)),
+            self.family("event_loop_lag_seconds", "gauge", "Latest event-loop scheduling delay").add(round(self._lag, 4)),
+        ]
+        if psutil is not None:
+            with contextlib.suppress(Exception):
+                proc = psutil.Process()
+                families.append(self.family("process_rss_bytes", "gauge", "Resident set size").add(proc.memory_info().rss))
+                with contextlib.suppress(Exception):
+                    families.append(self.family("process_open_fds", "gauge", "Open file descriptors").add(proc.num_fds()))
+        if self.processed is not None:
+            now, done = time.monotonic(), int(self.processed())
+            self._rate_samples.append((now, done))
+            while len(self._rate_samples) > 2 and now - self._rate_samples[0][0] > self.RATE_WINDOW_SEC:
+                self._rate_samples.popleft()
+            first_t, first_n = self._rate_samples[0]
+            rate = (done - first_n) / (now - first_t) if now > first_t else 0.0
+            families.append(self.family("domains_processed_total", "counter", "Domains with a final verdict").add(done))
+            families.append(self.family("domains_per_second", "gauge", f"Verdict rate over the last {self.RATE_WINDOW_SEC:.0f}s of scrapes").add(round(rate, 3)))
+        return families
+
+    def render(self) -> str:
+        families = self._builtin()
+        for collector in self._collectors:
+            try:
+                families.extend(collector())
+            except Exception as e:
+                if self.log:
+                    self.log(f"Metrics collector failed: {e}", "warning")
+        return "\n".join(f.render() for f in families) + "\n"
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            request = await asyncio.wait_for(reader.readline(), timeout=5)
+            # Drain the headers; the request line is all we route on
+            while True:
+                line = await asyncio.wait_for(reader.readline(), timeout=5)
+                if line in (b"\r\n", b"\n", b""):
+                    break
+            parts = request.decode("latin-1").split()
+            path = parts[1].split("?", 1)[0] if len(parts) > 1 else ""
+            if path in ("/metrics", "/"):
+                self.scrapes += 1
+                body = self.render().encode("utf-8")
+                status = "200 OK"
+                ctype = "text/plain; version=0.0.4; charset=utf-8"
+            else:
+                body, status, ctype = b"not found\n", "404 Not Found", "text/plain"
+            writer.write(
+                f"HTTP/1.1 {status}\r\nContent-Type: {ctype}\r\nContent-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode("latin-1")
+                + body
+            )
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+            with contextlib.suppress(Exception):
+                await writer.wait_closed()
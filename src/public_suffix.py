@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Public Suffix List lookups and suffix membership shared by the pipeline scripts.
+
+public_suffix_list.dat (next to this module) is a snapshot of
+https://publicsuffix.org/list/public_suffix_list.dat; replace the file to
+refresh it. PublicSuffixList compiles the rules, ICANN and private sections
+alike, into a trie keyed by labels from the right, so a lookup walks at most
+as many nodes as the host has labels. registrable_domain() and
+public_suffix() use the bundled list behind an LRU cache.
+
+SuffixIndex answers "which listed suffix covers this host" for allowlists
+and trust tables by probing the host's label suffixes in a dict. Lists can
+be kept in data files of "suffix [value ...]" lines (read_suffix_file()),
+so they can grow to thousands of entries without slowing the lookups.
+
+Run:
+  python public_suffix.py --bench                  # synthetic hosts
+  python public_suffix.py --bench domains_new_2.lst
+"""
+
+import argparse
+import functools
+import random
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Mapping, Optional, Tuple, Union
+
+DEFAULT_LIST_FILE = Path(__file__).resolve().with_name("public_suffix_list.dat")
+LOOKUP_CACHE_SIZE = 262_144
+
+_RULE = "\x00"  # node key marking the end of a rule
+_EXCEPTION = "\x01"  # node key marking the end of a "!" exception rule
+
+
+def _ascii_labels(rule: str) -> List[str]:
+    # Rules are listed in Unicode; hosts arrive as punycode, so index the A-label form too
+    forms = [rule]
+    try:
+        ascii_rule = rule.encode("idna").decode("ascii")
+    except UnicodeError:
+        ascii_rule = rule
+    if ascii_rule != rule:
+        forms.append(ascii_rule)
+    return forms
+
+
+class PublicSuffixList:
+    """Compiled Public Suffix List rules (normal, wildcard and exception)."""
+
+    def __init__(self, rules: Iterable[str]):
+        self._root: Dict[str, Any] = {}
+        self.rules = 0
+        for raw in rules:
+            rule = raw.strip().lower()
+            if not rule or rule.startswith("//"):
+                continue
+            rule = rule.split()[0]
+            exception = rule.startswith("!")
+            for form in _ascii_labels(rule.lstrip("!")):
+                node = self._root
+                for label in reversed(form.split(".")):
+                    node = node.setdefault(label, {})
+                node[_EXCEPTION if exception else _RULE] = True
+            self.rules += 1
+
+    @classmethod
+    def load(cls, path: Path = DEFAULT_LIST_FILE) -> "PublicSuffixList":
+        with open(path, "r", encoding="utf-8") as f:
+            return cls(f)
+
+    def suffix_labels(self, labels: List[str]) -> int:
+        """Number of rightmost labels forming the public suffix (the implicit "*" rule makes it at least 1)."""
+        matched = 1
+        node = self._root
+        depth = 0
+        for label in reversed(labels):
+            depth += 1
+            child = node.get(label)
+            if child is not None and _EXCEPTION in child:
+                # An exception rule's suffix is the rule minus its leftmost label
+                return depth - 1
+            wildcard = node.get("*")
+            if (child is not None and _RULE in child) or (wildcard is not None and _RULE in wildcard):
+                matched = depth
+            node = child if child is not None else wildcard
+            if node is None:
+                break
+        return matched
+
+    def public_suffix(self, host: str) -> str:
+        labels = _normalize(host).split(".")
+        return ".".join(labels[-self.suffix_labels(labels):])
+
+    def registrable_domain(self, host: str) -> str:
+        """Public suffix plus one label; the host itself when it is a public suffix or a bare label."""
+        host = _normalize(host)
+        labels = host.split(".")
+        keep = self.suffix_labels(labels) + 1
+        return host if keep >= len(labels) else ".".join(labels[-keep:])
+
+
+def _normalize(host: Optional[str]) -> str:
+    return (host or "").strip().strip(".").lower()
+
+
+_default: Optional[PublicSuffixList] = None
+
+
+def get_default() -> PublicSuffixList:
+    global _default
+    if _default is None:
+        _default = PublicSuffixList.load()
+    return _default
+
+
+@functools.lru_cache(maxsize=LOOKUP_CACHE_SIZE)
+def registrable_domain(host: str) -> str:
+    return get_default().registrable_domain(host)
+
+
+@functools.lru_cache(maxsize=LOOKUP_CACHE_SIZE)
+def public_suffix(host: str) -> str:
+    return get_default().public_suffix(host)
+
+
+def read_suffix_file(path: Path) -> List[Tuple[str, List[str]]]:
+    # [(suffix, extra fields)] in file order; blank lines and # comments are skipped
+    entries: List[Tuple[str, List[str]]] = []
+    with open(path, "r", encoding="utf-8") as f:
+        for ln in f:
+            parts = ln.split("#", 1)[0].split()
+            if parts:
+                entries.append((parts[0], parts[1:]))
+    return entries
+
+
+class SuffixIndex:
+    """Suffixes (optionally mapped to values) matched against hosts label by label.
+
+    A suffix covers a host equal to it or ending in "." + suffix. match()
+    returns the most specific covering suffix; lookups cost one dict probe
+    per label of the host, whatever the number of suffixes.
+    """
+
+    def __init__(self, suffixes: Union[Iterable[str], Mapping[str, Any]]):
+        self._entries: Dict[str, Any] = {}
+        self.update(suffixes)
+
+    def add(self, suffix: str, value: Any = True) -> None:
+        suffix = _normalize(suffix)
+        if suffix:
+            self._entries[suffix] = value
+
+    def update(self, suffixes: Union[Iterable[str], Mapping[str, Any]]) -> None:
+        items = suffixes.items() if isinstance(suffixes, Mapping) else ((s, True) for s in suffixes)
+        for suffix, value in items:
+            self.add(suffix, value)
+
+    def load_file(self, path: Path, parse: Optional[Callable[[List[str]], Any]] = None) -> int:
+        """Add the entries of a suffix file; returns how many were read (0 when the file does not exist).
+
+        parse turns a line's extra fields into the suffix's value; without
+        it every suffix maps to True. Lines parse rejects with ValueError
+        are skipped. Later entries override earlier ones for the same suffix.
+        """
+        if not Path(path).exists():
+            return 0
+        added = 0
+        for suffix, fields in read_suffix_file(path):
+            try:
+                value = parse(fields) if parse is not None else True
+            except ValueError:
+                continue
+            self.add(suffix, value)
+            added += 1
+        return added
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._entries)
+
+    def __contains__(self, host: str) -> bool:
+        return self.match(host) is not None
+
+    def covering(self, host: Optional[str]) -> Iterator[Tuple[str, Any]]:
+        """(suffix, value) for every listed suffix covering host, most specific first."""
+        host = _normalize(host)
+        start = 0 if host else -1
+        while start >= 0:
+            candidate = host[start:] if start else host
+            if candidate in self._entries:
+                yield candidate, self._entries[candidate]
+            start = host.find(".", start) + 1 or -1
+
+    def match(self, host: Optional[str]) -> Optional[str]:
+        for suffix, _ in self.covering(host):
+            return suffix
+        return None
+
+    def get(self, host: Optional[str], default: Any = None) -> Any:
+        suffix = self.match(host)
+        return self._entries[suffix] if suffix is not None else default
+
+
+def _legacy_registrable(host: str) -> str:
+    # step 2's former heuristic, kept only as the benchmark baseline
+    parts = _normalize(host).split(".")
+    if len(parts) >= 3 and len(parts[-1]) == 2 and parts[-2] in {"co", "com", "org", "net", "gov", "ac", "edu", "mil"}:
+        return ".".join(parts[-3:])
+    return ".".join(parts[-2:])
+
+
+def _legacy_suffix_match(host: str, suffixes: Iterable[str]) -> bool:
+    # step 3's former host_matches_suffix, kept only as the benchmark baseline
+    host = _normalize(host)
+    for suffix in suffixes:
+        suffix = _normalize(suffix)
+        if suffix and (host == suffix or host.endswith("." + suffix)):
+            return True
+    return False
+
+
+def _timed(fn, hosts: List[str]) -> Tuple[float, int]:
+    started = time.perf_counter()
+    hits = sum(1 for host in hosts if fn(host))
+    return time.perf_counter() - started, hits
+
+
+def run_bench(domains_file: Optional[Path], count: int, suffix_count: int) -> None:
+    psl = get_default()
+    rng = random.Random(1)
+    with open(DEFAULT_LIST_FILE, "r", encoding="utf-8") as f:
+        rules = [ln.strip().lstrip("*.!") for ln in f if ln.strip() and not ln.startswith("//")]
+    if domains_file:
+        with open(domains_file, "r", encoding="utf-8") as f:
+            hosts = [ln.strip().lower() for ln in f if ln.strip()][:count]
+    else:
+        words = ["shop", "news", "mail", "cdn", "app", "blog", "www", "static", "api"]
+        hosts = [
+            ".".join(rng.sample(words, rng.randint(0, 2)) + [f"site{rng.randrange(count // 4 + 1)}", rng.choice(rules)])
+            for _ in range(count)
+        ]
+    suffixes = rng.sample(rules, min(suffix_count, len(rules)))
+    # Half the hosts are made to hit a listed suffix so both paths do real work
+    probe = [h if i % 2 else f"{h.split('.')[0]}.{rng.choice(suffixes)}" for i, h in enumerate(hosts)]
+    index = SuffixIndex(suffixes)
+    print(f"PSL: {psl.rules:,} rules; {len(hosts):,} hosts; {len(suffixes):,} listed suffixes")
+    results = [
+        ("registrable, legacy heuristic", _timed(_legacy_registrable, hosts)),
+        ("registrable, PSL trie (uncached)", _timed(psl.registrable_domain, hosts)),
+        ("registrable, PSL + LRU (cold)", _timed(registrable_domain, hosts)),
+        ("registrable, PSL + LRU (warm)", _timed(registrable_domain, hosts)),
+        ("suffix match, linear scan", _timed(lambda h: _legacy_suffix_match(h, suffixes), probe)),
+        ("suffix match, SuffixIndex", _timed(index.__contains__, probe)),
+    ]
+    for name, (elapsed, hits) in results:
+        print(f"  {name:<34} {elapsed * 1000:9.1f} ms  {elapsed / len(hosts) * 1e6:8.2f} us/host  ({hits:,} truthy)")
+    differ = sum(1 for h in hosts if _legacy_registrable(h) != registrable_domain(h))
+    print(f"  registrable domain differs from the legacy heuristic for {differ:,} hosts ({differ / len(hosts):.1%})")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Public Suffix List helpers")
+    parser.add_argument("--bench", nargs="?", const="", metavar="DOMAINS_FILE", help="Compare lookups with the previous per-script functions")
+    parser.add_argument("--count", type=int, default=50_000, help="Hosts to benchmark (default 50000)")
+    parser.add_argument("--suffixes", type=int, default=200, help="Listed suffixes for the membership benchmark (default 200)")
+    parser.add_argument("hosts", nargs="*", help="Print public suffix and registrable domain for these hosts")
+    args = parser.parse_args()
+    if args.bench is not None:
+        run_bench(Path(args.bench) if args.bench else None, args.count, args.suffixes)
+    for host in args.hosts:
+        print(f"{host}\t{public_suffix(host)}\t{registrable_domain(host)}")
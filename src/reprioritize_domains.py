@@ -1,7 +1,11 @@
 import argparse
 import fnmatch
+import re
 from pathlib import Path
-from typing import Iterable, List, Tuple
+from typing import Callable, Dict, Iterable, List, Tuple
+
+from domain_history import DomainHistory
+from public_suffix import SuffixIndex
 
 PRIORITY_RULES: List[Tuple[str, str]] = [
     ("suffix", ".media"),
@@ -39,47 +43,38 @@ def write_domains(path: Path, domains: Iterable[str]) -> None:
 
 def reprioritize(domains: List[str]) -> List[str]:
     """Reorder domains so preferred rules appear first followed by the remainder."""
-    remaining = domains[:]
-    prioritized: List[str] = []
-
-    for rule_type, rule_value in PRIORITY_RULES:
-        if rule_type == "suffix":
-            predicate = lambda value, suffix=rule_value: value.lower().endswith(suffix)
+    # Each domain lands in the bucket of the first rule it matches, the same
+    # result as partitioning the list rule by rule, in a single pass. Dotted
+    # suffix rules are looked up per label instead of being tested one by one.
+    suffix_ranks: Dict[str, int] = {}
+    predicates: List[Tuple[int, Callable[[str], bool]]] = []
+    for rank, (rule_type, rule_value) in enumerate(PRIORITY_RULES):
+        lowered = rule_value.lower()
+        if rule_type == "suffix" and lowered.startswith("."):
+            suffix_ranks.setdefault(lowered[1:], rank)
+        elif rule_type == "suffix":
+            predicates.append((rank, lambda value, suffix=lowered: value.endswith(suffix)))
         elif rule_type == "pattern":
-            lowered = rule_value.lower()
-            predicate = lambda value, expected=lowered: fnmatch.fnmatch(
-                value.lower(), expected
-            )
+            predicates.append((rank, re.compile(fnmatch.translate(lowered)).match))
         elif rule_type == "prefix":
-            lowered = rule_value.lower()
-            predicate = lambda value, expected=lowered: value.lower().startswith(
-                expected
-            )
-        else:
-            # Unknown rule types are ignored.
-            continue
-
-        selected, remaining = _extract_matching(remaining, predicate)
-        prioritized.extend(selected)
-    prioritized.extend(remaining)
-
-    return prioritized
-
-
-def _extract_matching(
-    values: Iterable[str], predicate
-) -> tuple[List[str], List[str]]:
-    """Partition values based on predicate, preserving order."""
-    matching: List[str] = []
-    remainder: List[str] = []
-
-    for value in values:
-        if predicate(value):
-            matching.append(value)
-        else:
-            remainder.append(value)
-
-    return matching, remainder
+            predicates.append((rank, lambda value, expected=lowered: value.startswith(expected)))
+        # Unknown rule types are ignored.
+    suffix_index = SuffixIndex(suffix_ranks)
+
+    buckets: List[List[str]] = [[] for _ in range(len(PRIORITY_RULES) + 1)]
+    for domain in domains:
+        value = domain.lower()
+        # ".com" needs a label in front of it, so a bare "com" is not covered
+        best = min((rank for suffix, rank in suffix_index.covering(value) if suffix != value), default=len(PRIORITY_RULES))
+        for rank, predicate in predicates:
+            if rank >= best:
+                break
+            if predicate(value):
+                best = rank
+                break
+        buckets[best].append(domain)
+
+    return [domain for bucket in buckets for domain in bucket]
 
 
 def parse_arguments() -> argparse.Namespace:
@@ -103,6 +98,15 @@ def parse_arguments() -> argparse.Namespace:
             "printed to stdout."
         ),
     )
+    parser.add_argument(
+        "--history",
+        type=Path,
+        help=(
+            "Optional step 3 domain history (domain_history.tsv). Domains with "
+            "a recorded time are placed slowest first and the rest, in rule "
+            "order, are interleaved evenly among them."
+        ),
+    )
     return parser.parse_args()
 
 
@@ -110,6 +114,9 @@ def main() -> None:
     args = parse_arguments()
     domains = read_domains(args.file)
     reordered = reprioritize(domains)
+    if args.history:
+        history = DomainHistory(str(args.history))
+        reordered = list(history.schedule(lambda: reordered))
 
     if args.output:
         write_domains(args.output, reordered)
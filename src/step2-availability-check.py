@@ -8,21 +8,36 @@ Step 2 - NS + quick HTTPS probe with Enhanced Progress Tracking
 
 Run:
   python step2-availability-check.py
+  python step2-availability-check.py --metrics-port 9102   # Prometheus metrics at http://127.0.0.1:9102/metrics
+  python step2-availability-check.py --no-family-sampling  # probe every subdomain / www. twin on its own
+  python step2-availability-check.py --deadline 2h         # stop in time, carry the rest over to the next run
+  python step2-availability-check.py --incremental         # probe new domains and stale verdicts, copy the rest forward
 """
 
+import argparse
 import asyncio
 import dns.asyncresolver
 import logging
 import aiohttp
 import gc
+import os
 import sys
 import time
 import ipaddress
 import random
+from collections import deque
 from pathlib import Path
 from tqdm import tqdm
 from colorama import init, Fore, Style, Back
 
+from adaptive_concurrency import AdjustableGate, AdaptiveConcurrencyController
+from metrics_exporter import MetricsExporter
+from diagnostics import DiagnosticsDumper
+from domain_families import FamilySampler
+from carryover import CarryOver, Deadline, PreviousVerdicts, format_duration, parse_duration
+from domain_history import DomainHistory, IncrementalPlan
+from public_suffix import registrable_domain
+
 # Configure logging
 SCRIPT_DIR = Path(__file__).resolve().parent
 LOG_FILE = SCRIPT_DIR / 'step2_availability.log'
@@ -93,6 +108,52 @@ DNS_TIMEOUT = 3.2
 HTTP_TIMEOUT = 3.2
 SESSION_COUNT = 8
 DNS_CONCURRENCY = 400
+
+# Adaptive concurrency: CONCURRENCY is the ceiling, the controller starts at
+# ADAPTIVE_START and moves with RSS, open fds, event-loop lag and DNS/HTTP timeouts
+ADAPTIVE_CONCURRENCY = True
+ADAPTIVE_START = CONCURRENCY // 2
+ADAPTIVE_MIN = 100
+ADAPTIVE_INTERVAL = 5.0
+
+# Prometheus text-format endpoint on localhost (0 = off); see --metrics-port
+METRICS_PORT = int(os.environ.get("STEP2_METRICS_PORT", 0))
+
+# A/AAAA records of good domains, "domain<TAB>ip ip ..."; step 3 groups its fast pass by origin IP with it
+A_RECORDS_FILE = 'domains_new_2_ips.tsv'
+
+# Registrable-domain families: www.<name> follows <name>, and families of FAMILY_MIN_SIZE+
+# subdomains probe FAMILY_SAMPLE_SIZE of them; an agreed verdict is spread to the rest
+FAMILY_SAMPLING = True
+FAMILY_MIN_SIZE = 10
+FAMILY_SAMPLE_SIZE = 4
+# redirect and incorrect depend on each subdomain's own server config, so those members are always probed
+FAMILY_PROPAGATE = ('good', 'non_existent', 'parked')
+
+# Time-boxed runs (--deadline): no new batch starts in the last DEADLINE_DRAIN_SEC of the budget;
+# the rest is saved to CARRYOVER_FILE and goes first next run, and this run writes those domains
+# with their verdict from the previous run's outputs so the lists stay complete
+DEADLINE_SEC = None
+DEADLINE_DRAIN_SEC = 5 * 60
+CARRYOVER_FILE = 'domains_new_2_carryover.lst'
+
+# Verdict and check time per domain (domain_history.py), kept on every run; step 3 keeps its own file
+HISTORY_FILE = 'domains_new_2_history.tsv'
+
+# Incremental runs (--incremental): only new domains and a rolling slice of stale verdicts are probed;
+# every other domain is written with its verdict from HISTORY_FILE (good ones with their previous
+# A_RECORDS_FILE line). A verdict is stale once older than the max age for its outcome, and at most
+# INCREMENTAL_RECHECK_SHARE of the known domains are rechecked per run, oldest first
+INCREMENTAL = False
+INCREMENTAL_MAX_AGE_SEC = {
+    'good': 7 * 86400,
+    'non_existent': 21 * 86400,
+    'parked': 14 * 86400,
+    'redirect': 14 * 86400,
+    'incorrect': 3 * 86400,
+}
+INCREMENTAL_DEFAULT_MAX_AGE_SEC = 86400
+INCREMENTAL_RECHECK_SHARE = 0.1
 
 # Statistics tracking
 stats = {
@@ -106,7 +167,6 @@ stats = {
 }
 
 BANNED_REDIRECT_PREFIXES = ("ww25.", "ww38.")
-COMMON_SECOND_LEVEL_TLDS = {"co", "com", "org", "net", "gov", "ac", "edu", "mil"}
 WELL_KNOWN_DNS_IP_ALLOWLIST = {
     "1.1.1.1": {"one.one.one.one"},
     "1.0.0.1": {"one.one.one.one", "cloudflare-dns.com"},
@@ -122,18 +182,10 @@ WELL_KNOWN_DNS_IP_ALLOWLIST = {
 
 
 def get_registrable_domain(host: str) -> str:
-    """Return a best-effort registrable domain for host."""
-    if not host:
+    """Return the registrable domain for host per the Public Suffix List."""
+    if not host or not host.strip("."):
         return ""
-    trimmed = host.strip(".")
-    if not trimmed:
-        return ""
-    parts = trimmed.split(".")
-    if len(parts) < 2:
-        return trimmed
-    if len(parts) >= 3 and len(parts[-1]) == 2 and parts[-2] in COMMON_SECOND_LEVEL_TLDS:
-        return ".".join(parts[-3:])
-    return ".".join(parts[-2:])
+    return registrable_domain(host)
 
 
 def is_same_registered_domain(host: str, reference: str) -> bool:
@@ -183,8 +235,13 @@ def print_status(message, status_type="info"):
     print(f"{colors.get(status_type, Fore.WHITE)}{message}{Style.RESET_ALL}")
     logger.log(log_level, message)
 
+# Called as (domain, status, details) for every printed domain status; classify_daemon.py collects them per request
+STATUS_LISTENER = None
+
 def print_domain_status(domain, status, details=""):
     """Print domain status with appropriate colors."""
+    if STATUS_LISTENER is not None:
+        STATUS_LISTENER(domain, status, details)
     colors = {
         "good": Fore.GREEN,
         "non_existent": Fore.RED,
@@ -262,13 +319,53 @@ def run_qc_check(script_dir: Path, output_files):
     )
 
 DNS_SEMAPHORE = asyncio.Semaphore(DNS_CONCURRENCY)
+CONCURRENCY_GATE = AdjustableGate(ADAPTIVE_START if ADAPTIVE_CONCURRENCY else CONCURRENCY)
+concurrency_controller = None
+
+# Per-resolver and HTTP probe counters for the metrics endpoint
+DNS_SERVER_STATS: dict[str, dict[str, float]] = {}
+HTTP_PROBE_STATS = {'probes': 0, 'failures': 0, 'seconds': 0.0}
+
+
+# One resolver per DNS server, kept for the life of the process
+_RESOLVERS: dict[str, dns.asyncresolver.Resolver] = {}
+
+
+def get_resolver(server: str) -> dns.asyncresolver.Resolver:
+    resolver = _RESOLVERS.get(server)
+    if resolver is None:
+        resolver = _RESOLVERS[server] = dns.asyncresolver.Resolver(configure=False)
+        resolver.nameservers = [server]
+    return resolver
+
+
+def _server_stats(server: str) -> dict[str, float]:
+    entry = DNS_SERVER_STATS.get(server)
+    if entry is None:
+        entry = DNS_SERVER_STATS[server] = {'queries': 0, 'timeouts': 0, 'errors': 0, 'seconds': 0.0}
+    return entry
+
 
 async def _dns_query(server: str, qname: str, record_type: str):
-    """Run a single DNS query using a dedicated resolver."""
+    """Run a single DNS query using the resolver dedicated to server."""
     async with DNS_SEMAPHORE:
-        resolver = dns.asyncresolver.Resolver(configure=False)
-        resolver.nameservers = [server]
-        return await resolver.resolve(qname, record_type, lifetime=DNS_TIMEOUT)
+        resolver = get_resolver(server)
+        entry = _server_stats(server)
+        entry['queries'] += 1
+        started = time.monotonic()
+        try:
+            return await resolver.resolve(qname, record_type, lifetime=DNS_TIMEOUT)
+        except dns.resolver.Timeout:
+            entry['timeouts'] += 1
+            raise
+        except (dns.resolver.NXDOMAIN, dns.resolver.NoAnswer, dns.resolver.YXDOMAIN):
+            # A definite answer, not a resolver failure
+            raise
+        except Exception:
+            entry['errors'] += 1
+            raise
+        finally:
+            entry['seconds'] += time.monotonic() - started
 
 
 async def _resolve_ns_single(label: str):
@@ -422,21 +519,28 @@ def is_well_known_dns_ip_mismatch(domain: str, ip_records: list[str]) -> tuple[b
 
 
 async def check_domain(domain, sessions, pbar, pbar_lock: asyncio.Lock, 
-                      good_file, non_existent_file, parked_file, redirect_file, incorrect_file):
-    """Check a single domain for DNS, NS, and redirect status."""
-    async with asyncio.Semaphore(CONCURRENCY):
+                      good_file, non_existent_file, parked_file, redirect_file, incorrect_file,
+                      ips_file=None):
+    """Check a single domain for DNS, NS, and redirect status.
+
+    Returns the outcome key for family sampling, or None when the result is
+    inconclusive (exceptions, non-existence only seen through DNS timeouts).
+    """
+    async with CONCURRENCY_GATE:
+        transport_failure = False
         try:
             # DNS Resolution
             ns_records, ns_authority, ns_server, ns_error = await resolve_ns(domain)
             if not ns_records:
                 stats['non_existent'] += 1
                 reason = ns_error or "No NS response"
+                transport_failure = "Timeout" in reason
                 detail = f"[DNS {ns_server}] {reason}" if ns_server else reason
                 print_domain_status(domain, "non_existent", detail)
                 non_existent_file.write(domain + "\n")
                 async with pbar_lock:
                     pbar.update(1)
-                return
+                return None if transport_failure else 'non_existent'
 
             ns_note = ''
             if ns_authority and ns_authority.lower() != domain.lower():
@@ -454,7 +558,7 @@ async def check_domain(domain, sessions, pbar, pbar_lock: asyncio.Lock,
                 parked_file.write(domain + "\n")
                 async with pbar_lock:
                     pbar.update(1)
-                return
+                return 'parked'
 
             # A/AAAA sanity check
             ip_records, ip_servers = await resolve_ip_records(domain)
@@ -470,7 +574,7 @@ async def check_domain(domain, sessions, pbar, pbar_lock: asyncio.Lock,
                     incorrect_file.write(domain + "\n")
                     async with pbar_lock:
                         pbar.update(1)
-                    return
+                    return 'incorrect'
                 mismatch, mismatch_details = is_well_known_dns_ip_mismatch(domain, ip_records)
                 if mismatch:
                     stats['incorrect'] += 1
@@ -482,10 +586,12 @@ async def check_domain(domain, sessions, pbar, pbar_lock: asyncio.Lock,
                     incorrect_file.write(domain + "\n")
                     async with pbar_lock:
                         pbar.update(1)
-                    return
+                    return 'incorrect'
 
             # HTTPS Redirect Check
             session = sessions[hash(domain) % len(sessions)]
+            HTTP_PROBE_STATS['probes'] += 1
+            probe_started = time.monotonic()
             try:
                 url = f"https://{domain}"
                 async with session.get(url, allow_redirects=True, timeout=HTTP_TIMEOUT) as resp:
@@ -523,28 +629,107 @@ async def check_domain(domain, sessions, pbar, pbar_lock: asyncio.Lock,
                         redirect_file.write(domain + "\n")
                         async with pbar_lock:
                             pbar.update(1)
-                        return
+                        return 'redirect'
+            except (asyncio.TimeoutError, aiohttp.ClientConnectionError):
+                # Still good (step 3 handles content), but counts towards the overload signal
+                transport_failure = True
+                HTTP_PROBE_STATS['failures'] += 1
             except Exception:
                 # Continue to mark as good - step 3 will handle content analysis
-                pass
+                HTTP_PROBE_STATS['failures'] += 1
+            finally:
+                HTTP_PROBE_STATS['seconds'] += time.monotonic() - probe_started
 
             # Domain passed all checks
             stats['good'] += 1
             print_domain_status(domain, "good", ns_note)
             good_file.write(domain + "\n")
+            if ips_file is not None and ip_records:
+                ips_file.write(f"{domain}\t{' '.join(dict.fromkeys(ip_records))}\n")
             async with pbar_lock:
                 pbar.update(1)
+            return 'good'
 
         except Exception as e:
+            transport_failure = True
             stats['errors'] += 1
             print_domain_status(domain, "error", f"Exception: {str(e)[:50]}")
             async with pbar_lock:
                 pbar.update(1)
+        finally:
+            if concurrency_controller is not None:
+                concurrency_controller.record(transport_failure)
+
+
+OUTCOME_KEYS = ('good', 'non_existent', 'parked', 'redirect', 'incorrect')
 
 
+def collect_metrics(exporter: MetricsExporter):
+    """Metric families for --metrics-port; evaluated on every scrape."""
+    fam = exporter.family
+    outcomes = fam("outcomes_total", "counter", "Domains by outcome")
+    for key in OUTCOME_KEYS:
+        outcomes.add(stats[key], outcome=key)
+    families = [
+        outcomes,
+        fam("errors_total", "counter", "Exceptions during DNS lookups and checks").add(stats['errors']),
+        fam("domains_input", "gauge", "Domains in the input file").add(stats['total']),
+        fam("inflight_domains", "gauge", "Domains being checked").add(CONCURRENCY_GATE.in_use),
+        fam("queue_depth", "gauge", "Domains of the current batch waiting for a slot").add(CONCURRENCY_GATE.waiting),
+        fam("concurrency_limit", "gauge", "Current concurrency limit").add(CONCURRENCY_GATE.limit),
+    ]
+    queries = fam("dns_queries_total", "counter", "DNS queries per resolver")
+    failures = fam("dns_failures_total", "counter", "Failed DNS queries per resolver and kind")
+    seconds = fam("dns_query_seconds_total", "counter", "Time spent in DNS queries per resolver")
+    for server, entry in sorted(DNS_SERVER_STATS.items()):
+        queries.add(entry['queries'], resolver=server)
+        failures.add(entry['timeouts'], resolver=server, kind="timeout")
+        failures.add(entry['errors'], resolver=server, kind="error")
+        seconds.add(round(entry['seconds'], 3), resolver=server)
+    families += [
+        queries,
+        failures,
+        seconds,
+        fam("http_probes_total", "counter", "HTTPS redirect probes").add(HTTP_PROBE_STATS['probes']),
+        fam("http_probe_failures_total", "counter", "HTTPS probes that failed to connect or timed out").add(HTTP_PROBE_STATS['failures']),
+        fam("http_probe_seconds_total", "counter", "Time spent in HTTPS probes").add(round(HTTP_PROBE_STATS['seconds'], 3)),
+    ]
+    return families
+
+
+def diagnostic_sizes(sessions):
+    """Gate, DNS semaphore and connection counts for the SIGUSR1 diagnostics dump."""
+    return {
+        'gate': f"{CONCURRENCY_GATE.in_use} in use / {CONCURRENCY_GATE.limit} limit, {CONCURRENCY_GATE.waiting} waiting",
+        'dns_semaphore': f"{DNS_CONCURRENCY - DNS_SEMAPHORE._value} in use / {DNS_CONCURRENCY}, {len(DNS_SEMAPHORE._waiters or ())} waiting",
+        'http_connections': sum(len(getattr(s.connector, '_acquired', ())) for s in sessions),
+        'processed': sum(stats[k] for k in OUTCOME_KEYS),
+    }
+
+
+def create_sessions():
+    """The HTTP probe sessions check_domain() spreads domains over."""
+    session_timeout = aiohttp.ClientTimeout(total=8)
+    default_headers = {
+        "User-Agent": "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/123 Safari/537.36",
+        "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
+        "Accept-Language": "en-US,en;q=0.9,ru;q=0.8",
+        "Connection": "close",
+    }
+    return [
+        aiohttp.ClientSession(
+            timeout=session_timeout,
+            headers=default_headers,
+            connector=aiohttp.TCPConnector(limit=600, enable_cleanup_closed=True)
+        )
+        for _ in range(SESSION_COUNT)
+    ]
+
 async def main():
     """Main execution function."""
+    global concurrency_controller
     start_time = time.time()
+    deadline = Deadline(DEADLINE_SEC, DEADLINE_DRAIN_SEC) if DEADLINE_SEC else None
     print_header()
     
     script_dir = Path(__file__).parent
@@ -564,9 +749,48 @@ async def main():
             if line:
                 domains.append(line)
     
+    carry = CarryOver(script_dir / CARRYOVER_FILE)
+    if carry.load(lambda: domains):
+        print_status(
+            f"⏭️  Carry-over: {len(carry.loaded):,} domains left by the previous time-boxed run go first"
+            + (f" ({carry.stale:,} no longer in the input)" if carry.stale else ""),
+            "info",
+        )
+        domains = list(carry.first(domains))
+
     stats['total'] = len(domains)
     print_status(f"📊 Total domains to process: {stats['total']:,}", "info")
-    print_status(f"🔧 Configuration: {CONCURRENCY} concurrent, {SESSION_COUNT} sessions, {DNS_TIMEOUT}s DNS timeout", "info")
+
+    history = DomainHistory(str(script_dir / HISTORY_FILE))
+    copies = []
+    if INCREMENTAL:
+        incremental = IncrementalPlan(
+            history, OUTCOME_KEYS, INCREMENTAL_MAX_AGE_SEC, INCREMENTAL_DEFAULT_MAX_AGE_SEC, INCREMENTAL_RECHECK_SHARE
+        )
+        incremental.plan(
+            lambda: dict.fromkeys(d.lower().rstrip('.') for d in domains),
+            force=(d.lower().rstrip('.') for d in carry.loaded),
+        )
+        print_status(incremental.plan_line(), "info")
+        to_check = []
+        for domain in domains:
+            outcome = incremental.copy_forward(domain.lower().rstrip('.'))
+            if outcome is None:
+                to_check.append(domain)
+            else:
+                copies.append((domain, outcome))
+        domains = to_check
+
+    sampler = None
+    if FAMILY_SAMPLING:
+        sampler = FamilySampler(FAMILY_PROPAGATE, sample_size=FAMILY_SAMPLE_SIZE, min_family=FAMILY_MIN_SIZE)
+        sampler.plan(lambda: dict.fromkeys(d.lower().rstrip('.') for d in domains))
+        print_status(sampler.plan_line(), "info")
+    if ADAPTIVE_CONCURRENCY:
+        concurrency_note = f"{CONCURRENCY_GATE.limit}-{CONCURRENCY} concurrent (adaptive)"
+    else:
+        concurrency_note = f"{CONCURRENCY} concurrent"
+    print_status(f"🔧 Configuration: {concurrency_note}, {SESSION_COUNT} sessions, {DNS_TIMEOUT}s DNS timeout", "info")
     print()
     
     # Setup output files
@@ -578,6 +802,24 @@ async def main():
         'incorrect': script_dir / 'domains_incorrect.lst'
     }
     
+    previous = None
+    if deadline is not None:
+        print_status(deadline.plan_line(), "info")
+        # Read before the files are truncated below; a cut run writes these for the domains it carries over
+        previous = PreviousVerdicts(output_files)
+        if len(previous):
+            print_status(f"⌛ {len(previous):,} verdicts from the previous run kept for domains that get carried over", "info")
+
+    copied_ips = []
+    if copies:
+        # Read before the file is truncated below, like the previous verdicts
+        copied_good = {d.lower().rstrip('.') for d, outcome in copies if outcome == 'good'}
+        try:
+            with open(script_dir / A_RECORDS_FILE, "r", encoding="utf-8") as f:
+                copied_ips = [ln for ln in f if ln.split("\t", 1)[0].lower().rstrip('.') in copied_good]
+        except OSError:
+            pass
+
     print_status("📁 Output files:", "info")
     for category, path_obj in output_files.items():
         print_status(f"   {category}: {path_obj}", "info")
@@ -587,26 +829,44 @@ async def main():
     file_handles = {}
     for category, path_obj in output_files.items():
         file_handles[category] = open(path_obj, "w", encoding="utf-8")
+    ips_handle = open(script_dir / A_RECORDS_FILE, "w", encoding="utf-8")
+    for domain, outcome in copies:
+        stats[outcome] += 1
+        file_handles[outcome].write(domain + "\n")
+    ips_handle.writelines(copied_ips)
+    if copies:
+        print_status(f"♻️  Incremental: {len(copies):,} verdicts copied forward, {len(copied_ips):,} with their A records", "info")
+    del copies, copied_ips
     
     # Setup HTTP sessions
     print_status("🌐 Setting up HTTP sessions...", "progress")
-    session_timeout = aiohttp.ClientTimeout(total=8)
-    default_headers = {
-        "User-Agent": "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/123 Safari/537.36",
-        "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
-        "Accept-Language": "en-US,en;q=0.9,ru;q=0.8",
-        "Connection": "close",
-    }
+    sessions = create_sessions()
     
-    sessions = [
-        aiohttp.ClientSession(
-            timeout=session_timeout,
-            headers=default_headers,
-            connector=aiohttp.TCPConnector(limit=600, enable_cleanup_closed=True)
+    if ADAPTIVE_CONCURRENCY:
+        concurrency_controller = AdaptiveConcurrencyController(
+            CONCURRENCY_GATE,
+            min_limit=ADAPTIVE_MIN,
+            max_limit=CONCURRENCY,
+            log=print_status,
+            interval=ADAPTIVE_INTERVAL,
         )
-        for _ in range(SESSION_COUNT)
-    ]
-    
+        concurrency_controller.start()
+
+    exporter = None
+    if METRICS_PORT:
+        exporter = MetricsExporter(
+            "step2", METRICS_PORT, processed=lambda: sum(stats[k] for k in OUTCOME_KEYS), log=print_status
+        )
+        exporter.add_collector(lambda: collect_metrics(exporter))
+        try:
+            await exporter.start()
+        except OSError as e:
+            print_status(f"📡 Metrics endpoint disabled: {e}", "warning")
+            exporter = None
+    diagnostics = DiagnosticsDumper("step2", directory=str(script_dir), log=print_status)
+    diagnostics.add_probe("step2", lambda: diagnostic_sizes(sessions))
+    diagnostics.install(asyncio.get_running_loop())
+
     print_status("🚀 Starting domain processing...", "success")
     print()
     
@@ -624,33 +884,85 @@ async def main():
     ) as pbar:
         pbar.set_description(format_progress_description())
         
-        for i in range(0, len(domains), BATCH_SIZE):
-            batch = domains[i:i+BATCH_SIZE]
-            
+        # Held-back family members join the queue once their family's sample disagrees
+        queue = deque(d for d in domains if sampler is None or sampler.admit(d.lower().rstrip('.')))
+        batches = 0
+        while queue:
+            if deadline is not None and deadline.cutoff_reached():
+                break
+            batch = [queue.popleft() for _ in range(min(BATCH_SIZE, len(queue)))]
             # Process batch
             tasks = [
                 asyncio.create_task(
                     check_domain(
                         domain, sessions, pbar, pbar_lock,
                         file_handles['good'], file_handles['non_existent'],
-                        file_handles['parked'], file_handles['redirect'], file_handles['incorrect']
+                        file_handles['parked'], file_handles['redirect'], file_handles['incorrect'],
+                        ips_handle
                     )
                 ) for domain in batch
             ]
-            await asyncio.gather(*tasks)
+            verdicts = await asyncio.gather(*tasks)
+            for domain, verdict in zip(batch, verdicts):
+                if verdict:
+                    history.note_verdict(domain.lower().rstrip('.'), verdict)
+            if sampler is not None:
+                for domain, verdict in zip(batch, verdicts):
+                    sampler.observe(domain.lower().rstrip('.'), verdict or 'inconclusive')
+                queue.extend(sampler.take_released())
+                for domain, verdict, family in sampler.take_inferred():
+                    history.note_verdict(domain.lower().rstrip('.'), verdict)
+                    stats[verdict] += 1
+                    print_domain_status(domain, verdict, f"(family {family}: sample agreed)")
+                    file_handles[verdict].write(domain + "\n")
+                    pbar.update(1)
             pbar.set_description(format_progress_description())
             
             # Periodic garbage collection
-            if i % (BATCH_SIZE * 5) == 0:
+            batches += 1
+            if batches % 5 == 1:
                 gc.collect()
     
+        if deadline is not None:
+            if sampler is not None:
+                # Families still waiting for their sample are carried over whole
+                sampler.release_all()
+                queue.extend(sampler.take_released())
+            for domain in queue:
+                carry.add(domain)
+
+    reused = 0
+    if deadline is not None:
+        def _reuse(domain):
+            nonlocal reused
+            label = previous.get(domain)
+            if label is not None:
+                file_handles[label].write(domain + "\n")
+                reused += 1
+        try:
+            carry.save(_reuse)
+        except OSError as e:
+            print_status(f"⚠️ Could not save {carry.path}: {e}", "warning")
+    else:
+        carry.discard()
+    try:
+        history.save()
+    except OSError as e:
+        print_status(f"⚠️ Could not save {history.path}: {e}", "warning")
+
     # Cleanup
     print_status("🧹 Cleaning up resources...", "progress")
+    if concurrency_controller is not None:
+        await concurrency_controller.stop()
+    if exporter is not None:
+        await exporter.stop()
+    diagnostics.uninstall()
     for session in sessions:
         await session.close()
     
     for file_handle in file_handles.values():
         file_handle.close()
+    ips_handle.close()
     
     # Calculate final statistics
     elapsed_time = time.time() - start_time
@@ -668,6 +980,19 @@ async def main():
     print_status(f"↗️  Redirect domains: {stats['redirect']:,}", "warning")
     print_status(f"?? Incorrect IP domains: {stats['incorrect']:,}", "warning")
     print_status(f"⚠️  Errors: {stats['errors']:,}", "warning")
+    if concurrency_controller is not None:
+        print_status(concurrency_controller.report_line(), "info")
+    if sampler is not None and (sampler.sampled_families or sampler.www_pairs):
+        print_status(sampler.report_line(), "info")
+    if deadline is not None:
+        if deadline.cut_at is not None:
+            print_status(
+                f"⌛ Deadline: stopped taking domains after {format_duration(deadline.cut_at - deadline.started)}; "
+                f"{carry.saved:,} carried over to {carry.path.name}, {reused:,} of them written with their previous verdict",
+                "warning",
+            )
+        else:
+            print_status(f"⌛ Deadline: finished with {format_duration(deadline.remaining())} of the budget left", "info")
     print_status(f"📁 Files created:", "info")
     for category, path_obj in output_files.items():
         print_status(f"   • {category}: {path_obj}", "info")
@@ -679,6 +1004,43 @@ async def main():
     run_qc_check(script_dir, output_files)
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Step 2 - NS + quick HTTPS probe")
+    parser.add_argument("--metrics-port", type=int, help="Serve Prometheus metrics on 127.0.0.1:PORT/metrics while running")
+    parser.add_argument("--no-family-sampling", action="store_true", help="Probe every domain even when its registrable-domain family was sampled")
+    parser.add_argument("--family-min-size", type=int, help=f"Smallest family that is sampled instead of probed in full (default {FAMILY_MIN_SIZE})")
+    parser.add_argument("--family-sample", type=int, help=f"Members probed per sampled family (default {FAMILY_SAMPLE_SIZE})")
+    parser.add_argument("--deadline", type=parse_duration, metavar="DURATION", help=f"Time budget such as 2h: stop taking domains in time to drain, carry the rest over to {CARRYOVER_FILE}")
+    parser.add_argument("--deadline-drain", type=parse_duration, metavar="DURATION", help=f"Part of the --deadline budget kept for draining in-flight work (default {DEADLINE_DRAIN_SEC // 60}m)")
+    parser.add_argument("--incremental", action="store_true", help=f"Probe only new domains and the oldest stale verdicts; copy the rest forward from {HISTORY_FILE}")
+    parser.add_argument("--max-age", action="append", metavar="OUTCOME=DURATION", help="Age after which a verdict is rechecked by --incremental, e.g. good=7d (repeatable)")
+    parser.add_argument("--recheck-share", type=float, help=f"Largest share of known domains rechecked per --incremental run (default {INCREMENTAL_RECHECK_SHARE})")
+    args = parser.parse_args()
+    if args.metrics_port is not None:
+        METRICS_PORT = args.metrics_port
+    if args.no_family_sampling:
+        FAMILY_SAMPLING = False
+    if args.family_min_size:
+        FAMILY_MIN_SIZE = args.family_min_size
+    if args.family_sample:
+        FAMILY_SAMPLE_SIZE = args.family_sample
+    if args.deadline:
+        DEADLINE_SEC = args.deadline
+    if args.deadline_drain:
+        DEADLINE_DRAIN_SEC = args.deadline_drain
+    if args.incremental:
+        INCREMENTAL = True
+    for item in args.max_age or ():
+        outcome, _, age = item.partition('=')
+        try:
+            seconds = parse_duration(age)
+        except ValueError as e:
+            parser.error(f"--max-age {item}: {e}")
+        if outcome not in OUTCOME_KEYS:
+            parser.error(f"--max-age {item}: unknown outcome (one of {', '.join(OUTCOME_KEYS)})")
+        INCREMENTAL_MAX_AGE_SEC[outcome] = seconds
+    if args.recheck_share is not None:
+        INCREMENTAL_RECHECK_SHARE = min(1.0, max(0.0, args.recheck_share))
+
     # Check system resources
     try:
         import resource
@@ -54,6 +54,20 @@ Run:
 
 
 
+  python step3-content-check.py --record-corpus             # also store responses for offline re-scoring
+  python step3-content-check.py --replay domains_new_3_corpus.zst   # re-score stored responses, no network
+  python step3-content-check.py --check-prefilter           # random pages: streamed/prefiltered verdicts vs full-page verdicts
+  python step3-content-check.py --record-timings            # per-domain request phase timings next to the verdict files
+  python step3-content-check.py --metrics-port 9103         # Prometheus metrics at http://127.0.0.1:9103/metrics
+  python step3-content-check.py --no-ip-grouping            # input order, no per-IP caps (A/B timeouts, 429s, wall time)
+  python step3-content-check.py --update-cdn-ranges         # refresh cdn_ranges.txt (Cloudflare, Fastly, CloudFront) and exit
+  python step3-content-check.py --cdn-routing               # CDN-hosted domains go straight to the (proxied) CDN direct tier
+  python step3-content-check.py --no-redirect-cache         # score every redirect target again, ignore redirect_verdicts.json
+  python step3-content-check.py --no-family-sampling        # fetch every subdomain / www. twin instead of sampling families
+  python step3-content-check.py --no-history                # PRIORITY_TLDS order, don't read or update domain_history.tsv
+  python step3-content-check.py --incremental               # fetch new and stale domains only, copy other verdicts forward
+  python step3-content-check.py --incremental --max-age clean=3d --max-age inactive=2d
+  python step3-content-check.py --deadline 5h30m            # stop in time, carry the rest over to the next run
 """
 
 
@@ -64,7 +78,7 @@ import sys
 import re
 import time
 
-from typing import Dict, Tuple, Optional, List, Set, Iterable
+from typing import Dict, Tuple, Optional, List, Set, Iterable, Iterator, Callable, Awaitable, Any
 
 
 
@@ -74,7 +88,15 @@ import os
 import shutil
 import argparse
 import random
-from itertools import cycle
+import bisect
+import heapq
+import functools
+import codecs
+try:
+    import re._parser as sre_parse
+except ImportError:  # Python < 3.11
+    import sre_parse
+from collections import deque
 import subprocess
 import socket
 import tempfile
@@ -82,6 +104,11 @@ from pathlib import Path
 import platform
 import contextlib
 import gc
+import json
+import hashlib
+import zlib
+import multiprocessing
+import concurrent.futures
 from urllib.parse import urlparse
 
 try:
@@ -104,7 +131,7 @@ import aiohttp
 
 
 
-from aiohttp import ClientTimeout, ClientConnectorError, ClientSSLError
+from aiohttp import ClientTimeout, ClientConnectorError, ClientSSLError, ClientProxyConnectionError, ClientHttpProxyError
 
 
 
@@ -114,6 +141,16 @@ from tqdm import tqdm
 
 from colorama import init, Fore, Style
 
+from adaptive_concurrency import AdjustableGate, AdaptiveConcurrencyController
+from metrics_exporter import MetricsExporter, MetricFamily
+from diagnostics import DiagnosticsDumper
+from cdn_ranges import CdnRangeIndex, update_ranges_file
+from domain_families import FamilySampler
+from domain_history import DomainHistory, IncrementalPlan
+from carryover import CarryOver, Deadline, PreviousVerdicts, format_duration, parse_duration
+from browser_pool import BrowserPool
+from public_suffix import SuffixIndex
+
 
 
 try:
@@ -132,6 +169,15 @@ except ImportError:
 
     HAVE_SOCKS = False
 
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+try:
+    import aiodns
+except ImportError:
+    aiodns = None
+
 
 # =========================
 
@@ -159,7 +205,41 @@ PROXY_PARALLEL_PER_HOST = int(os.environ.get("PROXY_PARALLEL_PER_HOST", DEFAULT_
 
 PROXY_PARALLEL_ONLY = os.environ.get("PROXY_PARALLEL_ONLY", "0").lower() in {"1", "true", "yes"}
 
-REQUEST_DELAY_RANGE = (0.6, 1.6)
+# Politeness: token buckets per proxy and per target host (requests/sec, burst); rate <= 0 disables a bucket
+PROXY_RATE_PER_SEC = float(os.environ.get("STEP3_PROXY_RATE", 10.0))
+PROXY_BURST = 10
+HOST_RATE_PER_SEC = float(os.environ.get("STEP3_HOST_RATE", 0.5))
+HOST_BURST = 2
+HOST_BUCKET_IDLE_SEC = 300
+
+# Proxy health: scores persist across runs; broken proxies are ejected with exponential backoff
+PROXY_HEALTH_FILE = "proxy_health.json"
+PROXY_HEALTH_EWMA_ALPHA = 0.05  # weight of the newest outcome in the success-rate average
+PROXY_LATENCY_WINDOW = 200  # latency samples kept per proxy for percentiles
+PROXY_LATENCY_REF_SEC = 3.0  # p50 latency at which a proxy's weight is halved
+PROXY_MIN_WEIGHT = 0.02
+PROXY_EJECT_PROXY_ERRORS = 3  # consecutive proxy-level errors before ejection
+PROXY_EJECT_FAILURES = 15  # consecutive failures before ejection; a target timeout counts only if another proxy reached the target
+PROXY_EJECT_BASE_SEC = 30
+PROXY_EJECT_MAX_SEC = 1800
+PROXY_PROBE_TIMEOUT_SEC = 120  # a half-open probe that never reports back is retried after this
+PROXY_RECOVERY_SUCCESSES = 20  # consecutive successes that reset the ejection backoff
+
+# Per-domain limits in the fast pass: wall-clock deadline and attempts shared by all schemes, retries and proxies
+DOMAIN_DEADLINE_SEC = float(os.environ.get("STEP3_DOMAIN_DEADLINE", 60))
+DOMAIN_ATTEMPT_BUDGET = int(os.environ.get("STEP3_ATTEMPT_BUDGET", 6))
+DOMAIN_MIN_ATTEMPT_SEC = 2.0  # don't start a request with less time than this left
+HOST_BREAKER_FAILURES = 2  # unreachable results (each after its own retries) before a host's breaker opens
+HOST_BREAKER_OPEN_SEC = 900
+DOMAIN_TIME_BUCKETS = (1, 2, 5, 10, 20, 30, 60, 120)  # upper bounds (seconds) of the wall-time histogram
+DOMAIN_TIME_SAMPLES = 20000  # reservoir size for wall-time percentiles
+
+# Hedging: after the delay without a usable answer, start the next candidate in parallel (0 disables).
+# Candidates are https/www./http inside Fetcher.fetch and the proxy chain in process_domain; the
+# per-domain attempt budget still caps the total number of requests.
+HEDGE_DELAY_SEC = float(os.environ.get("STEP3_HEDGE_DELAY", 4.0))
+HEDGE_PROXY_DELAY_SEC = float(os.environ.get("STEP3_HEDGE_PROXY_DELAY", 10.0))
+HEDGE_MAX_PARALLEL = 2  # in-flight candidates per domain at each level
 
 USE_RESCUE_STAGE = False
 
@@ -194,6 +274,26 @@ PASS_OUTPUT_FILE = OUT_FILES["clean"]
 
 CONN_ERR_DETAIL_FILE = "domains_new_3_connection_error_detail.log"
 
+# Response corpus: --record-corpus stores every classified page, --replay re-scores it offline
+CORPUS_FILE = "domains_new_3_corpus.zst"
+CORPUS_INDEX_SUFFIX = ".idx"
+CORPUS_ZSTD_LEVEL = 6
+CORPUS_FLUSH_EVERY = 200
+REPLAY_CHUNK = 400
+REPLAY_CHANGES_FILE = "domains_new_3_replay_changes.log"
+CHECK_PREFILTER_SAMPLES = 500  # random pages generated by --check-prefilter
+
+# Request phase tracing (aiohttp TraceConfig): histograms per proxy and per outcome label go to
+# PHASE_REPORT_FILE at the end of the run; --record-timings also writes one TSV line per domain
+PHASE_TRACING = os.environ.get("STEP3_PHASE_TRACING", "1").lower() in {"1", "true", "yes"}
+PHASE_TIME_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 30)  # upper bounds (seconds) per phase
+PHASE_TIME_SAMPLES = 2000  # reservoir size per histogram for percentiles
+PHASE_REPORT_FILE = "domains_new_3_phase_timings.json"
+TIMINGS_FILE = "domains_new_3_timings.tsv"
+
+# Prometheus text-format endpoint on localhost (0 = off); see --metrics-port
+METRICS_PORT = int(os.environ.get("STEP3_METRICS_PORT", 0))
+
 # Fast pass - Enhanced timeouts for better success rates
 
 DEFAULT_CONCURRENCY = 120
@@ -212,6 +312,34 @@ READ_TIMEOUT = 20       # Increased from 7s for content loading
 
 CHUNK_SIZE = 8192
 
+# Streaming analysis: score the body while it downloads and stop once the verdict is settled
+STREAM_ANALYSIS = os.environ.get("STEP3_STREAM_ANALYSIS", "1").lower() in {"1", "true", "yes"}
+STREAM_TAIL_CHARS = 512  # visible text carried over so phrases split across segments still match
+STREAM_HEAD_CHARS = 65536  # how far into the page <title>/<meta description> are looked for
+BODYLESS_INACTIVE_STATUSES = (404, 410, 451)  # detect_inactive decides these on status alone
+
+# Receive buffers and bytes prefilter
+PREFILTER = os.environ.get("STEP3_PREFILTER", "1").lower() in {"1", "true", "yes"}  # off: every body is decoded in full
+BUFFER_POOL_MAX_FREE = 128  # idle receive buffers kept for reuse
+PREFILTER_MIN_LITERAL = 3  # shorter required literals make the prefilter useless, so it is disabled
+PREFILTER_HEAD_BYTES = 16384  # decoded for pages without candidates (title/heading summary)
+
+# One DNS cache for every Fetcher connector in the process
+SHARED_DNS_CACHE = os.environ.get("STEP3_SHARED_DNS", "1").lower() in {"1", "true", "yes"}
+DNS_CACHE_TTL = 300  # used when the backend doesn't report record TTLs (no aiodns)
+DNS_MIN_TTL = 30
+DNS_MAX_TTL = 3600
+DNS_NEGATIVE_TTL = 60  # failed lookups are cached briefly so retries across proxies don't re-query
+
+# Redirect-target verdicts: many domains redirect to the same parking / aggregator page, so a verdict is
+# kept per normalized final URL (host + path) and reused without reading the body when a later fetch
+# ends on that target. Entries persist across runs until the scoring rules change or they age out.
+REDIRECT_CACHE = os.environ.get("STEP3_REDIRECT_CACHE", "1").lower() in {"1", "true", "yes"}
+REDIRECT_CACHE_FILE = "redirect_verdicts.json"
+REDIRECT_CACHE_MAX_AGE_SEC = 7 * 86400
+REDIRECT_CACHE_MAX_ENTRIES = 200_000  # newest entries are kept when the file is saved
+REDIRECT_AUDIT_FILE = "domains_new_3_redirects.tsv"  # domain, verdict, target, cached|scored
+
 # Timeout Rescue (before fallback) - Even more generous timeouts
 
 DEFAULT_RESCUE_CONCURRENCY = 120
@@ -268,6 +396,13 @@ CDN_TOTAL_TIMEOUT = 75
 CDN_CONNECT_TIMEOUT = 20
 
 CDN_READ_TIMEOUT = 50
+# CDN / anti-DDoS address ranges (cdn_ranges.txt, refreshed with --update-cdn-ranges): a domain whose
+# address falls inside one skips the fast pass and goes straight to the CDN direct tier, which still
+# fetches through the proxies. Off by default: refresh the bundled snapshot before turning it on.
+CDN_RANGE_ROUTING = os.environ.get("STEP3_CDN_ROUTING", "0").lower() in {"1", "true", "yes"}
+CDN_RANGE_LABEL = 'cdn_range'
+CDN_DIRECT_CONCURRENCY = int(os.environ.get('STEP3_CDN_DIRECT_CONCURRENCY', 100))
+CDN_DIRECT_PROXY_TRIES = 2  # proxies from the fast-pass rotation tried per domain in the CDN direct tier
 
 # Writer buffers
 
@@ -279,6 +414,64 @@ MAX_BUFFERED_LINES = 50_000
 
 # Runtime tuning helpers
 
+# Fast-pass scheduler: bounded queue depth per worker (domains are streamed from INPUT_FILE)
+FAST_QUEUE_FACTOR = 2
+# Shared-hosting grouping: domains on one origin IP run at most IP_MAX_PARALLEL at a time, their starts
+# IP_MIN_INTERVAL_SEC apart; the rest of the queue keeps flowing meanwhile. IPs come from step 2's
+# A records (IP_SIDECAR_FILE) or are resolved ahead through the shared DNS cache.
+IP_GROUPING = os.environ.get("STEP3_IP_GROUPING", "1").lower() in {"1", "true", "yes"}
+IP_SIDECAR_FILE = "domains_new_2_ips.tsv"
+IP_MAX_PARALLEL = int(os.environ.get("STEP3_IP_MAX_PARALLEL", 6))
+IP_MIN_INTERVAL_SEC = float(os.environ.get("STEP3_IP_MIN_INTERVAL", 0.1))
+IP_PARK_LIMIT = 20_000  # extra domains the scheduler may hold while their IPs are busy
+IP_PRERESOLVE_CONCURRENCY = 256
+IP_PRERESOLVE_TIMEOUT_SEC = 5.0
+
+# Registrable-domain families (domain_families.py): www.<name> waits for <name>, families of FAMILY_MIN_SIZE+
+# subdomains probe FAMILY_SAMPLE_SIZE members first; an agreed verdict from FAMILY_PROPAGATE is spread
+# to the held members, anything else sends them through the fast pass.
+FAMILY_SAMPLING = os.environ.get("STEP3_FAMILY_SAMPLING", "1").lower() in {"1", "true", "yes"}
+FAMILY_MIN_SIZE = int(os.environ.get("STEP3_FAMILY_MIN_SIZE", 10))
+FAMILY_SAMPLE_SIZE = int(os.environ.get("STEP3_FAMILY_SAMPLE", 4))
+FAMILY_PROPAGATE = ("clean", "filtered", "inactive", "non_html")  # not cloudflare: the browser tier rechecks it per domain
+FAMILY_STALL_SEC = 600  # held members are released if no sampled verdict arrives for this long
+
+# Longest-processing-time-first order (domain_history.py): each domain's fast-pass time and label are kept
+# in HISTORY_FILE across runs; known domains start slowest first and new ones are interleaved evenly, so
+# a few 30s timeouts no longer trail at the end of the run. Without it, input follows PRIORITY_TLDS.
+LPT_SCHEDULING = os.environ.get("STEP3_LPT", "1").lower() in {"1", "true", "yes"}
+HISTORY_FILE = "domain_history.tsv"
+
+# Incremental runs (--incremental): only new domains and a rolling slice of stale verdicts are fetched; every
+# other domain is written with its verdict from HISTORY_FILE. A verdict is stale once it is older than the
+# max age for its label, and at most INCREMENTAL_RECHECK_SHARE of the known domains are rechecked per run,
+# oldest first. Entries unchecked for 30 days drop out of the history, so keep the ages below that.
+INCREMENTAL = os.environ.get("STEP3_INCREMENTAL", "0").lower() in {"1", "true", "yes"}
+INCREMENTAL_COPYABLE = ("clean", "filtered", "inactive", "non_html")  # definitive verdicts; everything else is rechecked
+INCREMENTAL_MAX_AGE_SEC = {
+    "clean": 7 * 86400,
+    "filtered": 14 * 86400,
+    "inactive": 7 * 86400,
+    "non_html": 14 * 86400,
+}
+INCREMENTAL_DEFAULT_MAX_AGE_SEC = 86400
+INCREMENTAL_RECHECK_SHARE = 0.1
+
+# Time-boxed runs (carryover.py, --deadline): no new domains are started in the last DEADLINE_DRAIN_SEC of the
+# budget; domains left over are saved to CARRYOVER_FILE in scheduling order and go first in the next run,
+# and this run writes them with their verdict from the previous run's outputs so the lists stay complete.
+DEADLINE_SEC: Optional[float] = None
+DEADLINE_DRAIN_SEC = 20 * 60
+CARRYOVER_FILE = "domains_new_3_carryover.lst"
+
+# Adaptive fast-pass concurrency: AIMD on RSS, open fds, event-loop lag and transport error rate
+ADAPTIVE_CONCURRENCY = os.environ.get("STEP3_ADAPTIVE", "1").lower() in {"1", "true", "yes"}
+ADAPTIVE_MAX_FACTOR = 4  # ceiling = startup limit x factor, capped by the fd budget
+ADAPTIVE_MIN_CONCURRENCY = 10
+ADAPTIVE_INTERVAL_SEC = 5.0
+ADAPTIVE_MAX_LOOP_LAG_SEC = 0.5
+ADAPTIVE_FAILURE_LABELS = ("timeout", CDN_TIMEOUT_LABEL, "connection_error")
+
 LOW_MEM_PROFILE = {
 
     "max_concurrency": 160,
@@ -342,6 +535,42 @@ def prioritize_domains(domains: List[str]) -> List[str]:
     return ordered
 
 
+def count_input_domains(path: str) -> int:
+    """Count unique non-empty lines; only the distinct domains are kept, not the lines."""
+    seen: Set[str] = set()
+    with open(path, "r", encoding="utf-8") as f:
+        for ln in f:
+            dom = ln.strip().lower()
+            if dom:
+                seen.add(dom)
+    return len(seen)
+
+
+def iter_input_domains(path: str) -> Iterator[str]:
+    """Stream unique domains from path in prioritize_domains() order.
+
+    The file is re-read once per PRIORITY_TLDS bucket plus once for the rest,
+    so only the already-emitted domains are kept (as strings: a hash collision
+    must not drop a distinct domain).
+    """
+    priority = set(PRIORITY_TLDS)
+    seen: Set[str] = set()
+    for wanted in list(PRIORITY_TLDS) + [None]:
+        with open(path, "r", encoding="utf-8") as f:
+            for ln in f:
+                dom = ln.strip().lower()
+                if not dom:
+                    continue
+                parts = dom.rsplit('.', 1)
+                tld = parts[1] if len(parts) == 2 else ''
+                if (tld != wanted) if wanted is not None else (tld in priority):
+                    continue
+                if dom in seen:
+                    continue
+                seen.add(dom)
+                yield dom
+
+
 
 def configure_runtime(
 
@@ -1370,6 +1599,15 @@ FALLBACK_BODY_MIN = 100
 
 FALLBACK_HTTP_TIMEOUT = 15
 
+# Browser pool (browser_pool.py): a browser is replaced by a warm standby after FALLBACK_PAGES_PER_BROWSER
+# pages or once its process tree passes FALLBACK_MAX_RSS_MB; a page counts as rendered once the DOM and
+# resource loads were quiet for FALLBACK_QUIET_MS (at most FALLBACK_SETTLE_MAX_SEC)
+FALLBACK_PAGES_PER_BROWSER = int(os.environ.get("STEP3_FALLBACK_PAGES", 200))
+FALLBACK_MAX_RSS_MB = float(os.environ.get("STEP3_FALLBACK_MAX_RSS_MB", 1500))
+FALLBACK_STANDBY = os.environ.get("STEP3_FALLBACK_STANDBY", "1").lower() in {"1", "true", "yes"}
+FALLBACK_QUIET_MS = 300
+FALLBACK_SETTLE_MAX_SEC = 5.0
+
 
 
 # Use OS temp dir for cross-platform profile storage (more reliable on Linux servers and Windows)
@@ -1594,10 +1832,30 @@ stats = {
 
 
 
-    'fallback_processed': 0
-
-
+    'fallback_processed': 0,
+    'budget_exhausted': 0,
+    'hedges_launched': 0,
+    'hedge_wins': 0,
+    'http_429': 0,
+    'cdn_range_routed': 0,
+    'cdn_late_domains': 0,
+    'cdn_late_attempts': 0,
+    'family_inferred': 0,
+    'family_released': 0,
+    'deadline_carried': 0,
+    'deadline_reused': 0,
+    'incremental_copied': 0
+}
 
+# Body download counters for the streaming analyzer
+stream_stats = {
+    'responses': 0,
+    'bytes': 0,
+    'early_inactive': 0,
+    'settled_filtered': 0,  # read on to the end after settling as filtered, for inactive markers
+    'skipped_body': 0,
+    'prefilter_skips': 0,
+    'redirect_cached': 0,  # bodies not read because the redirect target's verdict was cached
 }
 
 
@@ -1714,54 +1972,24 @@ def normalize_host(host: Optional[str]) -> str:
 
 
 def host_matches_suffix(host: str, suffixes: Iterable[str]) -> bool:
+    # Pass a prebuilt SuffixIndex on hot paths; a plain iterable is indexed on every call
+    if not isinstance(suffixes, SuffixIndex):
+        suffixes = SuffixIndex(suffixes)
+    return normalize_host(host) in suffixes
 
 
+# Extra CDN-throttled suffixes, one per line; optional, extends CDN_THROTTLE_DOMAINS
+CDN_THROTTLE_FILE = Path(__file__).resolve().with_name("cdn_throttle_domains.txt")
 
-    host = normalize_host(host)
-
-
-
-    if not host:
-
-
-
-        return False
-
-
-
-    for suffix in suffixes:
-
-
-
-        suffix_norm = normalize_host(suffix)
-
-
-
-        if not suffix_norm:
-
-
-
-            continue
-
-
-
-        if host == suffix_norm or host.endswith('.' + suffix_norm):
-
-
-
-            return True
-
-
-
-    return False
-
+CDN_THROTTLE_INDEX = SuffixIndex(CDN_THROTTLE_DOMAINS)
+CDN_THROTTLE_INDEX.load_file(CDN_THROTTLE_FILE)
 
 
 def is_cdn_throttled_host(host: Optional[str]) -> bool:
 
 
 
-    return host_matches_suffix(host or '', CDN_THROTTLE_DOMAINS)
+    return host_matches_suffix(host or '', CDN_THROTTLE_INDEX)
 
 
 
@@ -1893,11 +2121,32 @@ def is_cdn_candidate(domain: str, headers: Optional[Dict[str, str]] = None, fina
 
 
 
+# Called as (domain, status, score, details) for every printed domain status; classify_daemon.py collects them per request
+STATUS_LISTENER: Optional[Callable[[str, str, Optional[float], str], None]] = None
+# Called as (domain, reason, err_detail) instead of appending to CONN_ERR_DETAIL_FILE; classify_daemon.py
+# adds them to the request's trail
+CONN_ERR_DETAIL_LISTENER: Optional[Callable[[str, str, str], None]] = None
+
+
+def log_connection_error_detail(domain: str, reason: str, err_detail: str) -> None:
+    if CONN_ERR_DETAIL_LISTENER is not None:
+        CONN_ERR_DETAIL_LISTENER(domain, reason, err_detail)
+        return
+    try:
+        with open(CONN_ERR_DETAIL_FILE, "a", encoding="utf-8") as f:
+            f.write(f"{domain} | {reason} | {err_detail}\n")
+    except Exception:
+        pass
+
+
+
 def print_domain_status(domain, status, score=None, details=""):
 
 
 
     """Print domain status with appropriate colors."""
+    if STATUS_LISTENER is not None:
+        STATUS_LISTENER(domain, status, score, details)
 
 
 
@@ -2498,6 +2747,8 @@ def short_reason(msg: str) -> str:
 
 
     m = (msg or "").lower()
+    if m.startswith("proxy:"):
+        return "proxy"
 
 
 
@@ -2939,21 +3190,23 @@ LEGITIMATE_DOMAINS = {
 
 }
 
+# Extra allowlisted suffixes, one per line; the file is optional and extends LEGITIMATE_DOMAINS
+LEGITIMATE_DOMAINS_FILE = Path(__file__).resolve().with_name("legitimate_domains.txt")
 
-
-def is_legitimate_domain(domain: str) -> bool:
+LEGITIMATE_INDEX = SuffixIndex(LEGITIMATE_DOMAINS)
+LEGITIMATE_INDEX.load_file(LEGITIMATE_DOMAINS_FILE)
 
 
 
-    """Check if domain is a major legitimate platform."""
+def is_legitimate_domain(domain: str) -> bool:
 
 
 
-    domain_lower = domain.lower().strip()
+    """Check if domain is a major legitimate platform."""
 
 
 
-    return domain_lower in LEGITIMATE_DOMAINS or any(domain_lower.endswith(f'.{leg_domain}') for leg_domain in LEGITIMATE_DOMAINS)
+    return domain in LEGITIMATE_INDEX
 
 
 
@@ -3172,237 +3425,1694 @@ def detect_inactive(html: str, status: int) -> Optional[str]:
     return None
 
 
+def classify_page(html: str, http_status: int, domain: str) -> Tuple[str, float, str, Dict[str, int]]:
+    """Return (label, score, inactive_reason, hits_by_cat); shared by live runs and --replay."""
+    inactive_reason = detect_inactive(html, http_status)
+    if inactive_reason:
+        return "inactive", 0.0, inactive_reason, {}
+    total_score, hits_by_cat, _ = score_content(html, domain)
+    if total_score >= THRESHOLD_SCORE:
+        return "filtered", total_score, "", hits_by_cat
+    return "clean", total_score, "", hits_by_cat
+
+
+def scoring_fingerprint() -> str:
+    # Changes whenever anything classify_page depends on changes, so stale cached verdicts are dropped
+    parts = [repr(THRESHOLD_SCORE), repr(TITLE_BOOST), repr(sorted(WEIGHTS.items()))]
+    parts += [cre.pattern for cre in CRITICAL_RE]
+    parts += [cre.pattern for cre in INACTIVE_RE]
+    parts += [f"{cat}={cre.pattern}" for cat, cre in CATEGORY_RES]
+    parts += [f"{cat}~{sub}" for cat, subs in sorted(CATEGORY_SUBSTRINGS.items()) for sub in subs]
+    parts += [repr(DENSITY_THRESHOLD), repr(MIN_KEYWORD_HITS)]
+    parts += sorted(LEGITIMATE_INDEX)
+    return hashlib.sha1("\n".join(parts).encode("utf-8")).hexdigest()
+
+
+def redirect_target_key(domain: str, final_url: Optional[str]) -> Optional[str]:
+    # "host/path" of a redirect that left the domain; None for same-site redirects and for legitimate
+    # domains, whose scores are discounted and so can't share a verdict with other domains.
+    if not final_url:
+        return None
+    try:
+        parsed = urlparse(final_url)
+    except ValueError:
+        return None
+    target = re.sub(r"^www\.", "", normalize_host(parsed.hostname))
+    source = re.sub(r"^www\.", "", normalize_host(domain))
+    if not target or target == source or is_legitimate_domain(source):
+        return None
+    return target + parsed.path.rstrip("/")
 
-# =========================
 
+class RedirectVerdictCache:
+    """Verdicts per redirect target, shared by the fast pass and the HTTP rescue tiers.
 
+    Only clean / filtered / inactive verdicts from pages below HTTP 400 are stored. Entries are
+    aged out when the file is loaded, never during a run, so a target the fetcher skipped the
+    body for is still there when process_domain looks it up.
+    """
 
-# Fetcher (fast pass) with configurable rescue
+    def __init__(self, path: Optional[str] = REDIRECT_CACHE_FILE, max_age: float = REDIRECT_CACHE_MAX_AGE_SEC):
+        self.path = path
+        self.max_age = max_age
+        self.fingerprint = scoring_fingerprint()
+        self.entries: Dict[str, List[Any]] = {}  # key -> [verdict, score, saved_at]
+        self.skip_bodies = True
+        self.loaded = 0
+        self.hits = 0
+        self.stores = 0
+        self._audit_path: Optional[Path] = None
+        self._audit_lines: List[str] = []
+        if path:
+            self._load()
+
+    def _load(self) -> None:
+        try:
+            data = json.loads(Path(self.path).read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return
+        if not isinstance(data, dict) or data.get("fingerprint") != self.fingerprint:
+            print_status(f"↪️  Scoring rules changed since {self.path} was saved; redirect verdicts start empty", "info")
+            return
+        cutoff = time.time() - self.max_age
+        for key, entry in (data.get("entries") or {}).items():
+            if isinstance(entry, list) and len(entry) == 3 and entry[0] in ("clean", "filtered", "inactive") and entry[2] >= cutoff:
+                self.entries[key] = entry
+        self.loaded = len(self.entries)
+        if self.loaded:
+            print_status(f"↪️  Restored {self.loaded:,} redirect-target verdicts from {self.path}", "info")
+
+    def save(self) -> None:
+        if not self.path:
+            return
+        entries = self.entries
+        if len(entries) > REDIRECT_CACHE_MAX_ENTRIES:
+            newest = sorted(entries.items(), key=lambda kv: kv[1][2], reverse=True)[:REDIRECT_CACHE_MAX_ENTRIES]
+            entries = dict(newest)
+        tmp = Path(self.path + ".tmp")
+        try:
+            tmp.write_text(json.dumps({"fingerprint": self.fingerprint, "entries": entries}), encoding="utf-8")
+            os.replace(tmp, self.path)
+        except OSError as e:
+            print_status(f"⚠️ Could not save redirect verdicts: {e}", "warning")
 
+    def known(self, key: Optional[str]) -> bool:
+        return key is not None and key in self.entries
 
+    def get(self, key: Optional[str]) -> Optional[Tuple[str, float]]:
+        entry = self.entries.get(key) if key is not None else None
+        if entry is None:
+            return None
+        self.hits += 1
+        return entry[0], entry[1]
 
-# =========================
+    def put(self, key: Optional[str], verdict: str, score: float, http_status: Optional[int]) -> None:
+        if key is None or verdict not in ("clean", "filtered", "inactive") or (http_status or 200) >= 400:
+            return
+        self.entries[key] = [verdict, round(min(score, 1e6), 2), int(time.time())]
+        self.stores += 1
 
+    def open_audit_file(self, path: str) -> None:
+        self._audit_path = Path(path)
+        self._audit_path.write_text("domain\tverdict\ttarget\tsource\n", encoding="utf-8")
 
+    def audit(self, domain: str, verdict: str, key: str, cached: bool) -> None:
+        if self._audit_path is None:
+            return
+        self._audit_lines.append(f"{domain}\t{verdict}\t{key}\t{'cached' if cached else 'scored'}")
+        if len(self._audit_lines) >= BATCH_LINES:
+            self.flush()
 
-class ProxyPool:
+    def flush(self) -> None:
+        if self._audit_path is None or not self._audit_lines:
+            return
+        with open(self._audit_path, "a", encoding="utf-8") as f:
+            f.write("\n".join(self._audit_lines) + "\n")
+        self._audit_lines.clear()
+
+    def summary_line(self) -> str:
+        return (
+            f"↪️  Redirect targets: {self.hits:,} verdicts reused ({stream_stats['redirect_cached']:,} bodies not downloaded), "
+            f"{self.stores:,} scored and stored, {len(self.entries):,} known ({self.loaded:,} from earlier runs); "
+            f"audit: {self._audit_path or 'off'}"
+        )
+
+
+_redirect_cache: Optional[RedirectVerdictCache] = None
+
+
+def get_redirect_cache() -> Optional[RedirectVerdictCache]:
+    global _redirect_cache
+    if _redirect_cache is None and REDIRECT_CACHE:
+        _redirect_cache = RedirectVerdictCache()
+    return _redirect_cache
+
+
+def lookup_redirect_verdict(
+    domain: str, final_url: Optional[str], http_status: Optional[int]
+) -> Tuple[Optional[str], Optional[Tuple[str, float]]]:
+    # (target key, cached (verdict, score)) for a fetch result; the key is None where the cache doesn't apply
+    cache = get_redirect_cache()
+    if cache is None or (http_status or 200) >= 400:
+        return None, None
+    key = redirect_target_key(domain, final_url)
+    if key is None or not cache.skip_bodies:
+        return key, None
+    cached = cache.get(key)
+    if cached is not None:
+        cache.audit(domain, cached[0], key, cached=True)
+    return key, cached
+
+
+def remember_redirect_verdict(domain: str, key: Optional[str], verdict: str, score: float, http_status: Optional[int]) -> None:
+    cache = get_redirect_cache()
+    if cache is None or key is None:
+        return
+    cache.put(key, verdict, score, http_status)
+    cache.audit(domain, verdict, key, cached=False)
 
 
+# Anchored patterns can't be decided on a prefix: "$" would match at the end of the downloaded part.
+STREAM_INACTIVE_RE = [cre for cre in INACTIVE_RE if "^" not in cre.pattern and "$" not in cre.pattern]
 
-    def __init__(self, proxies: List[str]):
 
+class StreamingAnalyzer:
+    """Incremental version of the classify_page checks, fed one body chunk at a time.
 
+    Decoded text is only analysed up to a settled cut: the last ``>`` outside an unfinished
+    <script>/<style>, so stripped text and keyword matches on the prefix are the same as on the
+    full page. feed() returns "inactive" once an inactive marker shows up, and the caller stops
+    downloading and classifies the prefix with classify_page() as usual. A CRITICAL_RE hit or a
+    lower bound on score_content() at THRESHOLD_SCORE only sets ``filtered``: an inactive marker
+    further down would still win in classify_page(), so the rest of the body is read and only
+    scanned for inactive markers.
+    """
 
-        if not proxies:
+    def __init__(self, domain: str, charset: str):
+        try:
+            self._decoder = codecs.getincrementaldecoder(charset)(errors="ignore")
+        except LookupError:
+            self._decoder = codecs.getincrementaldecoder("utf-8")(errors="ignore")
+        self._parts: List[str] = []
+        self._pending = ""
+        self._tail = ""
+        self._head = ""
+        self._title_hits: Optional[Dict[str, int]] = None
+        self._meta_hits: Optional[Dict[str, int]] = None
+        self._body_hits: Dict[str, int] = {}
+        self._legitimate = bool(domain and is_legitimate_domain(domain))
+        self.filtered = False
+        self.verdict: Optional[str] = None
 
+    @staticmethod
+    def _settled_cut(text: str) -> int:
+        cut = text.rfind(">") + 1
+        if not cut:
+            return 0
+        lowered = text[:cut].lower()
+        for tag in ("script", "style"):
+            opened = lowered.rfind("<" + tag)
+            if opened != -1 and lowered.rfind("</" + tag) < opened:
+                cut = min(cut, opened)
+        return cut
 
+    @staticmethod
+    def _count_hits(text: str) -> Dict[str, int]:
+        hits: Dict[str, int] = {}
+        for cat, cre in CATEGORY_RES:
+            n = sum(1 for _ in cre.finditer(text))
+            if n:
+                hits[cat] = n
+        return hits
+
+    def _score_lower_bound(self) -> float:
+        # Regex hits only ever grow as more of the page arrives; substring bonuses are left out.
+        total = 0.0
+        keyword_hits = 0
+        for hits, boost in ((self._body_hits, 1), (self._title_hits or {}, TITLE_BOOST), (self._meta_hits or {}, TITLE_BOOST)):
+            for cat, n in hits.items():
+                total += WEIGHTS.get(cat, 1.0) * boost * n
+                keyword_hits += n
+        if keyword_hits < MIN_KEYWORD_HITS:
+            return 0.0
+        return total * 0.5 if self._legitimate else total
+
+    def _analyze(self, segment: str) -> Optional[str]:
+        window = self._tail + strip_tags(segment)
+        for cre in STREAM_INACTIVE_RE:
+            if cre.search(window):
+                return "inactive"
+        if not self.filtered:
+            self.filtered = self._settles_filtered(window, segment)
+        self._carry_tail(window)
+        return None
 
-            raise ValueError("No proxies provided")
+    def _settles_filtered(self, window: str, segment: str) -> bool:
+        for cre in CRITICAL_RE:
+            if cre.search(window):
+                return True
+        for cat, n in self._count_hits(segment.lower()).items():
+            self._body_hits[cat] = self._body_hits.get(cat, 0) + n
+        if (self._title_hits is None or self._meta_hits is None) and len(self._head) < STREAM_HEAD_CHARS:
+            self._head += segment
+            if self._title_hits is None:
+                m = TITLE_RE.search(self._head)
+                if m:
+                    self._title_hits = self._count_hits(m.group(1).strip().lower())
+            if self._meta_hits is None:
+                m = META_DESC_RE.search(self._head)
+                if m:
+                    self._meta_hits = self._count_hits(m.group(1).strip().lower())
+        return self._score_lower_bound() >= THRESHOLD_SCORE
+
+    def _carry_tail(self, window: str) -> None:
+        tail = window[-STREAM_TAIL_CHARS:]
+        if len(window) > STREAM_TAIL_CHARS:
+            # Start the carried text on a word boundary so \b patterns can't match a word fragment.
+            m = WHITESPACE_RE.search(tail)
+            tail = tail[m.start():] if m else ""
+        self._tail = tail
+
+    def feed(self, chunk: bytes) -> Optional[str]:
+        text = self._decoder.decode(chunk)
+        self._parts.append(text)
+        if self.verdict is not None:
+            return self.verdict
+        self._pending += text
+        cut = self._settled_cut(self._pending)
+        if cut:
+            segment, self._pending = self._pending[:cut], self._pending[cut:]
+            self.verdict = self._analyze(segment)
+        return self.verdict
+
+    def text(self) -> str:
+        self._parts.append(self._decoder.decode(b"", final=True))
+        return "".join(self._parts)
+
+
+def _required_literals(items) -> Optional[Set[str]]:
+    """Strings of which every match of a parsed regex must contain one; None if none can be derived."""
+    best: Optional[Set[str]] = None
+
+    def consider(candidates: Optional[Set[str]]) -> None:
+        nonlocal best
+        if candidates and (best is None or min(map(len, candidates)) > min(map(len, best))):
+            best = candidates
+
+    run: List[str] = []
+
+    def flush() -> None:
+        # strip_tags() turns tags into spaces, so only whitespace-free pieces are contiguous in the raw page.
+        words = "".join(run).split()
+        if words:
+            consider({max(words, key=len)})
+        run.clear()
+
+    for op, av in items:
+        name = str(op)
+        if name == "LITERAL":
+            run.append(chr(av))
+            continue
+        flush()
+        if name == "SUBPATTERN":
+            consider(_required_literals(av[-1]))
+        elif name == "ATOMIC_GROUP":
+            consider(_required_literals(av))
+        elif name == "BRANCH":
+            alternatives = [_required_literals(alt) for alt in av[1]]
+            if all(alternatives):
+                consider(set().union(*alternatives))
+        elif name in ("MAX_REPEAT", "MIN_REPEAT", "POSSESSIVE_REPEAT") and av[0] >= 1:
+            consider(_required_literals(av[2]))
+    flush()
+    return best
+
+
+def collect_prefilter_literals() -> Optional[List[str]]:
+    # A page can only score or look inactive if it contains one of these (case-insensitively).
+    literals: Set[str] = set()
+    for cre in [cre for _, cre in CATEGORY_RES] + CRITICAL_RE + INACTIVE_RE:
+        required = _required_literals(sre_parse.parse(cre.pattern, cre.flags))
+        if not required or min(map(len, required)) < PREFILTER_MIN_LITERAL:
+            return None
+        literals.update(lit.lower() for lit in required)
+    for substrings in CATEGORY_SUBSTRINGS.values():
+        for sub in substrings:
+            words = sub.lower().split()
+            if words:
+                literals.add(max(words, key=len))
+    return sorted(literals)
 
 
+PREFILTER_LITERALS = collect_prefilter_literals()
 
-        self.proxies = proxies
 
+class BodyPrefilter:
+    """Bytes-level check for whether a body can match any classification pattern.
 
+    Bytes are case-folded with a translate table and searched for the encoded required literals.
+    Single-byte charsets fold exactly; for UTF-8 the table lowercases ASCII and folds the second
+    byte of Cyrillic/Latin-1 capitals onto their lowercase forms (folding only merges, so it can
+    produce false candidates but never miss one). Literals whose case pair doesn't fold together
+    are cut down to the longest piece that does. Other multi-byte charsets get no prefilter.
+    """
 
-        self._cycle = cycle(proxies)
+    _cache: Dict[str, Optional["BodyPrefilter"]] = {}
 
+    def __init__(self, encoding: str, table: bytes, literals: List[bytes]):
+        self.encoding = encoding
+        self.table = table
+        self.literals = literals
+        self.overlap = max(len(lit) for lit in literals) - 1
 
+    @staticmethod
+    def _utf8_table() -> bytes:
+        table = bytearray(range(256))
+        for b in range(ord("A"), ord("Z") + 1):
+            table[b] = b + 32
+        for b in range(0x80, 0xA0):
+            table[b] = b + 0x20
+        table[0xD1] = 0xD0
+        return bytes(table)
 
-    def next_proxy(self) -> str:
+    @staticmethod
+    def _is_single_byte(encoding: str) -> bool:
+        # Every byte pair decoding to two characters rules out lead/trail byte schemes (SJIS, EUC, GBK, UTF-16).
+        try:
+            return all(len(bytes([b, trail]).decode(encoding, errors="replace")) == 2 for b in range(256) for trail in (0x41, 0xA1))
+        except Exception:
+            return False
 
+    @staticmethod
+    def _single_byte_table(encoding: str) -> bytes:
+        table = bytearray(range(256))
+        for b in range(256):
+            ch = bytes([b]).decode(encoding, errors="ignore")
+            if len(ch) != 1:
+                continue
+            with contextlib.suppress(UnicodeEncodeError):
+                lower = ch.lower().encode(encoding)
+                if len(lower) == 1:
+                    table[b] = lower[0]
+        return bytes(table)
+
+    @classmethod
+    def for_charset(cls, charset: str) -> Optional["BodyPrefilter"]:
+        try:
+            encoding = codecs.lookup(charset).name
+        except LookupError:
+            encoding = "utf-8"  # _fetch_once decodes unknown charsets as UTF-8
+        key = encoding
+        if key in cls._cache:
+            return cls._cache[key]
+        prefilter = None
+        if PREFILTER_LITERALS:
+            if encoding in ("utf-8", "ascii"):
+                encoding, table = "utf-8", cls._utf8_table()
+            elif cls._is_single_byte(encoding):
+                table = cls._single_byte_table(encoding)
+            else:
+                table = None
+            if table is not None:
+                literals = cls._fold_literals(encoding, table)
+                if literals is not None:
+                    prefilter = cls(encoding, table, literals)
+        cls._cache[key] = prefilter
+        return prefilter
 
+    @staticmethod
+    def _fold_literals(encoding: str, table: bytes) -> Optional[List[bytes]]:
+        def folds(ch: str) -> bool:
+            forms = set()
+            for variant in {ch, ch.lower(), ch.upper()}:
+                if len(variant) == 1:
+                    forms.add(variant.encode(encoding).translate(table))
+            return len(forms) == 1
+
+        out: Set[bytes] = set()
+        for lit in PREFILTER_LITERALS:
+            try:
+                lit.encode(encoding)
+            except UnicodeEncodeError:
+                continue  # can't occur in text decoded from this charset
+            pieces, current = [], ""
+            for ch in lit:
+                if folds(ch):
+                    current += ch
+                else:
+                    pieces.append(current)
+                    current = ""
+            pieces.append(current)
+            piece = max(pieces, key=len)
+            if len(piece) < PREFILTER_MIN_LITERAL:
+                return None
+            out.add(piece.encode(encoding).translate(table))
+        return sorted(out, key=len)
+
+    def scan(self, buf: bytearray, start: int, end: int) -> bool:
+        # Re-reads `overlap` bytes before start so literals split across chunks are found.
+        folded = buf[max(0, start - self.overlap):end].translate(self.table)
+        return any(lit in folded for lit in self.literals)
+
+
+class BufferPool:
+    # Fixed-size receive buffers reused across requests instead of growing a new bytearray per body.
+    def __init__(self, size: int, max_free: int = BUFFER_POOL_MAX_FREE):
+        self.size = size
+        self.max_free = max_free
+        self._free: List[bytearray] = []
+        self.allocated = 0
+        self.reused = 0
+        self.in_use = 0
+        self.peak_in_use = 0
+
+    def acquire(self) -> bytearray:
+        if self._free:
+            buf = self._free.pop()
+            self.reused += 1
+        else:
+            buf = bytearray(self.size)
+            self.allocated += 1
+        self.in_use += 1
+        self.peak_in_use = max(self.peak_in_use, self.in_use)
+        return buf
 
-        return next(self._cycle)
+    def release(self, buf: bytearray) -> None:
+        self.in_use -= 1
+        if len(buf) == self.size and len(self._free) < self.max_free:
+            self._free.append(buf)
 
 
+_buffer_pool: Optional[BufferPool] = None
 
-    def order_from(self, first: str) -> List[str]:
 
+def get_buffer_pool() -> BufferPool:
+    # Created on first use so --max-bytes overrides are already applied.
+    global _buffer_pool
+    if _buffer_pool is None:
+        _buffer_pool = BufferPool(MAX_BYTES + CHUNK_SIZE)
+    return _buffer_pool
 
 
-        if first not in self.proxies:
+def decode_body(data, charset: str) -> str:
+    try:
+        return str(data, charset, "ignore")
+    except LookupError:
+        return str(data, "utf-8", "ignore")
 
 
 
-            return list(self.proxies)
+# =========================
 
 
 
-        idx = self.proxies.index(first)
+# Fetcher (fast pass) with configurable rescue
 
 
 
-        return self.proxies[idx:] + self.proxies[:idx]
+# =========================
 
 
 
-def load_proxies(proxy_file: str) -> List[str]:
+class TokenBucket:
+    # Debt-based bucket: reserve() always takes a token and returns the wait until it is covered,
+    # so concurrent callers queue up in FIFO order without a lock.
+    __slots__ = ("rate", "capacity", "tokens", "updated")
 
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = max(1.0, capacity)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
 
+    def reserve(self) -> float:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1.0
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
 
-    path = Path(proxy_file)
 
+class PolitenessLimiter:
+    """Per-proxy and per-target-host rate limits; callers only sleep when a bucket is empty."""
 
+    def __init__(
+        self,
+        proxy_rate: float = PROXY_RATE_PER_SEC,
+        proxy_burst: float = PROXY_BURST,
+        host_rate: float = HOST_RATE_PER_SEC,
+        host_burst: float = HOST_BURST,
+    ):
+        self.proxy_rate = proxy_rate
+        self.proxy_burst = proxy_burst
+        self.host_rate = host_rate
+        self.host_burst = host_burst
+        self._proxy_buckets: Dict[str, TokenBucket] = {}
+        self._host_buckets: Dict[str, TokenBucket] = {}
+        self._acquires = 0
+        self.waits = 0
+        self.wait_seconds = 0.0
+
+    def _prune_hosts(self) -> None:
+        # Buckets idle long enough to be full again carry no state worth keeping.
+        cutoff = time.monotonic() - HOST_BUCKET_IDLE_SEC
+        stale = [host for host, bucket in self._host_buckets.items() if bucket.updated < cutoff]
+        for host in stale:
+            del self._host_buckets[host]
+
+    async def acquire(self, proxy: Optional[str], host: Optional[str]) -> None:
+        delay = 0.0
+        if proxy and self.proxy_rate > 0:
+            bucket = self._proxy_buckets.get(proxy)
+            if bucket is None:
+                bucket = self._proxy_buckets[proxy] = TokenBucket(self.proxy_rate, self.proxy_burst)
+            delay = bucket.reserve()
+        host = normalize_host(host)
+        if host and self.host_rate > 0:
+            bucket = self._host_buckets.get(host)
+            if bucket is None:
+                bucket = self._host_buckets[host] = TokenBucket(self.host_rate, self.host_burst)
+            delay = max(delay, bucket.reserve())
+        self._acquires += 1
+        if self._acquires % 5000 == 0:
+            self._prune_hosts()
+        if delay > 0:
+            self.waits += 1
+            self.wait_seconds += delay
+            await asyncio.sleep(delay)
+
+
+class DomainBudget:
+    # Deadline and attempt allowance for one domain, shared across schemes, retries and proxies.
+    __slots__ = ("deadline", "attempts_left")
+
+    def __init__(self, seconds: float, attempts: int):
+        self.deadline = time.monotonic() + seconds
+        self.attempts_left = attempts
+
+    def remaining(self) -> float:
+        return self.deadline - time.monotonic()
+
+    def exhausted(self) -> bool:
+        return self.attempts_left <= 0 or self.remaining() < DOMAIN_MIN_ATTEMPT_SEC
+
+    def take(self) -> bool:
+        if self.exhausted():
+            return False
+        self.attempts_left -= 1
+        return True
 
-    if not path.exists():
 
+class HostBreaker:
+    """Per-target-host circuit breaker.
 
+    After HOST_BREAKER_FAILURES unreachable results (timeouts / connection errors without any HTTP
+    response) the host is short-circuited with its last failure until HOST_BREAKER_OPEN_SEC passes.
+    Any HTTP response resets it. Proxy-level errors say nothing about the host and are ignored.
+    """
 
-        return []
+    UNREACHABLE = ("timeout", CDN_TIMEOUT_LABEL, "connection_error")
 
+    def __init__(self):
+        self._hosts: Dict[str, list] = {}  # host -> [failures, open_until, last_failure, updated]
+        self._records = 0
+        self.trips = 0
+        self.short_circuits = 0
+
+    def allow(self, host: str) -> bool:
+        entry = self._hosts.get(host)
+        if entry is None or not entry[1]:
+            return True
+        if entry[1] <= time.monotonic():
+            del self._hosts[host]
+            return True
+        self.short_circuits += 1
+        return False
 
+    def last_failure(self, host: str) -> Tuple[str, Optional[int], Optional[str]]:
+        entry = self._hosts.get(host)
+        return entry[2] if entry else ("timeout", None, None)
 
-    proxies: List[str] = []
+    def record(self, host: str, label: str, http_status: Optional[int], err_detail: Optional[str]) -> None:
+        if label == "proxy_error":
+            return
+        if http_status is not None or label not in self.UNREACHABLE:
+            self._hosts.pop(host, None)
+            return
+        now = time.monotonic()
+        entry = self._hosts.setdefault(host, [0, 0.0, None, now])
+        entry[0] += 1
+        entry[2] = (label, http_status, err_detail)
+        entry[3] = now
+        if entry[0] >= HOST_BREAKER_FAILURES and not entry[1]:
+            entry[1] = now + HOST_BREAKER_OPEN_SEC
+            self.trips += 1
+        self._records += 1
+        if self._records % 5000 == 0:
+            cutoff = now - HOST_BREAKER_OPEN_SEC
+            for stale in [h for h, e in self._hosts.items() if e[3] < cutoff and (not e[1] or e[1] <= now)]:
+                del self._hosts[stale]
+
+
+class FastPassScheduler:
+    """Hands fast-pass domains to workers with a per-origin-IP concurrency cap.
+
+    Domains are grouped by the IP they resolve to. A group runs at most ``per_ip`` domains at once
+    and starts them ``spacing`` seconds apart; while it is busy its domains stay parked and workers
+    take other groups' domains round-robin, so one shared-hosting box never gets dozens of parallel
+    requests. Domains with no known IP share one group that is neither capped nor spaced; without
+    any IPs this is a plain bounded FIFO. get() returns None once close() was called and
+    everything has been handed out.
+    """
 
+    def __init__(self, maxsize: int, per_ip: int = IP_MAX_PARALLEL, spacing: float = IP_MIN_INTERVAL_SEC, park_limit: int = 0):
+        self.maxsize = max(1, maxsize)
+        self.per_ip = max(1, per_ip)
+        self.spacing = max(0.0, spacing)
+        self.park_limit = max(0, park_limit)
+        self._groups: Dict[Optional[str], deque] = {}
+        self._active: Dict[str, int] = {}
+        self._next_at: Dict[str, float] = {}
+        self._running: Dict[str, str] = {}  # domain -> IP while a worker has it
+        self._ready: deque = deque()  # groups that can start a domain now, in round-robin order
+        self._cooling: List[Tuple[float, str]] = []  # (next start, IP) for groups inside their spacing
+        self._scheduled: Set[Optional[str]] = set()
+        self._getters: deque = deque()
+        self._putters: deque = deque()
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._timer_at = 0.0
+        self._size = 0
+        self._closed = False
+        self.domains_per_ip: Dict[str, int] = {}
+        self.ungrouped = 0
+        self.parked = 0
+        self.max_backlog = 0
+
+    def qsize(self) -> int:
+        return self._size
+
+    def parked_now(self) -> int:
+        # Domains held back by their IP's cap or spacing
+        cooling = {ip for _, ip in self._cooling}
+        return sum(len(group) for ip, group in self._groups.items() if ip is not None and (ip in cooling or ip not in self._scheduled))
+
+    def busy_ips(self) -> int:
+        return len(self._active)
+
+    async def put(self, domain: str, ip: Optional[str] = None) -> None:
+        # park_limit is headroom for domains waiting on busy IPs, so their backlog doesn't stall the input
+        while self._size >= self.maxsize + self.park_limit:
+            fut = asyncio.get_running_loop().create_future()
+            self._putters.append(fut)
+            await fut
+        group = self._groups.get(ip)
+        if group is None:
+            group = self._groups[ip] = deque()
+        group.append(domain)
+        self._size += 1
+        if ip is None:
+            self.ungrouped += 1
+        else:
+            self.domains_per_ip[ip] = self.domains_per_ip.get(ip, 0) + 1
+            if len(group) > self.per_ip - self._active.get(ip, 0):
+                self.parked += 1
+                self.max_backlog = max(self.max_backlog, len(group))
+        self._schedule(ip)
+        self._wake(self._getters)
+
+    def close(self) -> None:
+        self._closed = True
+        while self._getters:
+            self._wake(self._getters)
+
+    async def get(self) -> Optional[str]:
+        while True:
+            domain = self._take()
+            if domain is not None:
+                self._wake(self._putters)
+                if self._ready:
+                    self._wake(self._getters)
+                self._arm_timer()
+                return domain
+            if self._closed and not self._size:
+                self.close()
+                return None
+            self._arm_timer()
+            fut = asyncio.get_running_loop().create_future()
+            self._getters.append(fut)
+            try:
+                await fut
+            except asyncio.CancelledError:
+                if fut.done() and not fut.cancelled():
+                    # Woken just before the cancel landed; pass the wake-up on
+                    self._wake(self._getters)
+                raise
+
+    def release(self, domain: str) -> None:
+        ip = self._running.pop(domain, None)
+        if ip is None:
+            return
+        active = self._active[ip] - 1
+        if active:
+            self._active[ip] = active
+        else:
+            del self._active[ip]
+            if ip not in self._groups and self._next_at.get(ip, 0.0) <= time.monotonic():
+                self._next_at.pop(ip, None)
+        self._schedule(ip)
+        self._wake(self._getters)
+
+    def _schedule(self, ip: Optional[str]) -> None:
+        # Put a group with waiting domains back in rotation unless it is already there or at its cap;
+        # release() reschedules capped groups
+        if ip not in self._groups or ip in self._scheduled:
+            return
+        if ip is not None and self._active.get(ip, 0) >= self.per_ip:
+            return
+        self._scheduled.add(ip)
+        start_at = self._next_at.get(ip, 0.0) if ip is not None else 0.0
+        if start_at > time.monotonic():
+            heapq.heappush(self._cooling, (start_at, ip))
+        else:
+            self._ready.append(ip)
 
+    def _take(self) -> Optional[str]:
+        now = time.monotonic()
+        while self._cooling and self._cooling[0][0] <= now:
+            self._ready.append(heapq.heappop(self._cooling)[1])
+        if not self._ready:
+            return None
+        ip = self._ready.popleft()
+        self._scheduled.discard(ip)
+        group = self._groups[ip]
+        domain = group.popleft()
+        if not group:
+            del self._groups[ip]
+        self._size -= 1
+        if ip is not None:
+            self._active[ip] = self._active.get(ip, 0) + 1
+            self._running[domain] = ip
+            if self.spacing:
+                self._next_at[ip] = now + self.spacing
+        self._schedule(ip)
+        return domain
+
+    def _arm_timer(self) -> None:
+        # One timer for the earliest cooling group; it wakes a single getter, which chains the rest
+        if not self._cooling:
+            return
+        due = self._cooling[0][0]
+        if self._timer is not None and self._timer_at <= due:
+            return
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer_at = due
+        self._timer = asyncio.get_running_loop().call_later(max(0.0, due - time.monotonic()), self._on_timer)
 
-    try:
+    def _on_timer(self) -> None:
+        self._timer = None
+        self._wake(self._getters)
 
+    @staticmethod
+    def _wake(waiters: deque) -> None:
+        while waiters:
+            fut = waiters.popleft()
+            if not fut.done():
+                fut.set_result(None)
+                return
 
+    def report_line(self) -> Optional[str]:
+        if not self.domains_per_ip:
+            return None
+        grouped = sum(self.domains_per_ip.values())
+        shared = sum(1 for n in self.domains_per_ip.values() if n > 1)
+        busiest = max(self.domains_per_ip.values())
+        return (
+            f"🏘️  IP grouping: {grouped:,} domains on {len(self.domains_per_ip):,} IPs ({shared:,} shared, busiest {busiest:,}), "
+            f"{self.ungrouped:,} unresolved; {self.parked:,} parked behind a busy IP (largest backlog {self.max_backlog:,})"
+        )
+
+
+def pick_group_ip(ips: Iterable[str]) -> Optional[str]:
+    # Stable representative of a host's addresses: the lowest IPv4, else the lowest IPv6
+    ips = sorted(set(ips))
+    v4 = [ip for ip in ips if ":" not in ip]
+    return (v4 or ips or [None])[0]
+
+
+def load_ip_sidecar(path: str) -> Dict[str, str]:
+    # domain -> group IP from step 2's "domain<TAB>ip ip ..." file; IP strings are shared
+    ips: Dict[str, str] = {}
+    interned: Dict[str, str] = {}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            for ln in f:
+                dom, _, rest = ln.strip().partition("\t")
+                ip = pick_group_ip(rest.split())
+                if dom and ip:
+                    ips[dom.lower()] = interned.setdefault(ip, ip)
+    except FileNotFoundError:
+        pass
+    return ips
 
-        with open(path, 'r', encoding='utf-8') as f:
 
+async def feed_fast_pass(
+    scheduler: FastPassScheduler,
+    domains: Iterable[str],
+    known_ips: Optional[Dict[str, str]],
+    dispatch: Optional[Callable[[str, Optional[str]], Awaitable[None]]] = None,
+    families: Optional[FamilySampler] = None,
+    infer: Optional[Callable[[str, str, str], Awaitable[None]]] = None,
+    deadline: Optional[Deadline] = None,
+) -> None:
+    """Stream domains with their addresses into dispatch (default scheduler.put), then close the scheduler.
+
+    known_ips None skips address lookups. Domains missing from it are resolved through the shared DNS
+    cache, IP_PRERESOLVE_CONCURRENCY at a time, which also warms the cache for the fetch itself;
+    those are dispatched in resolution order rather than input order.
+    With families, held-back members are skipped in the input and fed once their family's sample
+    disagrees, or handed to infer(domain, verdict, family) when it agrees; the scheduler stays open
+    until every family has an outcome, or until the deadline's cutoff, which releases them all.
+    """
+    dispatch = dispatch or scheduler.put
+    dns = get_shared_dns() if known_ips is not None else None
+    slots = asyncio.Semaphore(IP_PRERESOLVE_CONCURRENCY)
+    pending: Set[asyncio.Task] = set()
 
+    async def _resolve_and_put(dom: str):
+        try:
+            try:
+                answer = await asyncio.wait_for(dns.resolve(dom, 443), IP_PRERESOLVE_TIMEOUT_SEC)
+                ip = pick_group_ip(entry["host"] for entry in answer)
+            except Exception:
+                ip = None
+            await dispatch(dom, ip)
+        finally:
+            slots.release()
+
+    async def _feed(dom: str):
+        ip = known_ips.get(dom) if known_ips else None
+        if ip or dns is None:
+            await dispatch(dom, ip)
+            return
+        await slots.acquire()
+        task = asyncio.create_task(_resolve_and_put(dom))
+        pending.add(task)
+        task.add_done_callback(pending.discard)
 
-            for line in f:
+    async def _family_outcomes():
+        for dom in families.take_released():
+            await _feed(dom)
+        for dom, verdict, family in families.take_inferred():
+            await infer(dom, verdict, family)
 
+    try:
+        for dom in domains:
+            if families is not None:
+                await _family_outcomes()
+                if not families.admit(dom):
+                    continue
+            await _feed(dom)
+        if families is not None:
+            # Sampled members finish in workers and rescue tiers running alongside this loop
+            while families.pending:
+                if deadline is not None and deadline.cutoff_reached():
+                    # Workers carry released members over like any domain taken after the cutoff
+                    families.release_all()
+                elif not await families.wait(FAMILY_STALL_SEC):
+                    released = families.release_all()
+                    print_status(f"👪 No sampled verdict for {FAMILY_STALL_SEC}s; probing {released:,} held domains", "warning")
+                await _family_outcomes()
+            await _family_outcomes()
+        if pending:
+            await asyncio.gather(*pending)
+    finally:
+        for task in pending:
+            task.cancel()
+        scheduler.close()
 
 
-                raw = line.strip()
+async def save_carryover(carry: CarryOver, previous: Optional[PreviousVerdicts], writer: "Writer") -> None:
+    """Save the domains a --deadline run left over and write their previous verdicts, if any, to the outputs."""
+    reused: List[Tuple[str, str]] = []
 
+    def _reuse(dom: str):
+        label = previous.get(dom) if previous is not None else None
+        if label is not None:
+            reused.append((label, dom))
 
+    try:
+        stats['deadline_carried'] = carry.save(_reuse)
+    except OSError as e:
+        print_status(f"⚠️ Could not save {carry.path}: {e}", "warning")
+        return
+    for label, dom in reused:
+        await writer.write_line(label, dom)
+    stats['deadline_reused'] = len(reused)
+
+
+class WallTimeHistogram:
+    # Fixed-bucket histogram of durations in seconds, plus a reservoir sample for percentiles.
+    def __init__(self, bounds: Iterable[float] = DOMAIN_TIME_BUCKETS, samples: int = DOMAIN_TIME_SAMPLES):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.total = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+        self._capacity = samples
+        self._samples: List[float] = []
+
+    def observe(self, seconds: float) -> None:
+        self.counts[bisect.bisect_left(self.bounds, seconds)] += 1
+        self.total += 1
+        self.sum += seconds
+        self.max = max(self.max, seconds)
+
+        if len(self._samples) < self._capacity:
+            self._samples.append(seconds)
+        else:
+            slot = random.randrange(self.total)
+            if slot < self._capacity:
+                self._samples[slot] = seconds
+
+    def percentile(self, pct: float) -> float:
+        if not self._samples:
+            return 0.0
+        ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+    def format_lines(self, title: str) -> List[str]:
+        if not self.total:
+            return []
+        p50, p95, p99 = (self.percentile(q) for q in (50, 95, 99))
+        lines = [
+            f"{title} (n={self.total:,}, mean {self.sum / self.total:.1f}s, "
+            f"p50 {p50:.1f}s, p95 {p95:.1f}s, p99 {p99:.1f}s, max {self.max:.1f}s)"
+        ]
+        labels = [f"<= {b:g}s" for b in self.bounds] + [f"> {self.bounds[-1]:g}s"]
+        for label, count in zip(labels, self.counts):
+            if count:
+                lines.append(f"   {label:>8}: {count:,} ({count / self.total * 100:.1f}%)")
+        return lines
+
+    def to_json(self) -> Dict[str, Any]:
+        return {
+            "count": self.total,
+            "sum": round(self.sum, 4),
+            "max": round(self.max, 4),
+            "p50": round(self.percentile(50), 4),
+            "p95": round(self.percentile(95), 4),
+            "p99": round(self.percentile(99), 4),
+            "buckets": self.counts,
+        }
 
-                if not raw or raw.startswith('#'):
 
+PHASES = ("queued", "dns", "connect", "request_sent", "first_byte", "body", "total")
 
 
-                    continue
+def _add_phase(ctx, phase: str, seconds: float) -> None:
+    phases = ctx.trace_request_ctx
+    phases[phase] = phases.get(phase, 0.0) + max(0.0, seconds)
 
 
+def _close_phase(ctx, now: float) -> None:
+    # Close the currently open sequential phase; the next one starts at `now`
+    if ctx.open:
+        _add_phase(ctx, ctx.open, now - ctx.mark)
+    ctx.open, ctx.mark = None, now
 
-                scheme = "http"
 
+def build_phase_trace_config() -> aiohttp.TraceConfig:
+    """TraceConfig that adds per-phase seconds into the dict passed as trace_request_ctx.
 
+    aiohttp resolves DNS inside connection creation and has no TLS hook, so "connect"
+    is TCP + proxy CONNECT + TLS with the DNS time taken out. Redirect hops add to the
+    same phases; "body" and "total" are closed by finish_phases() once the response
+    has been consumed or the request failed.
+    """
+    config = aiohttp.TraceConfig()
+
+    def hook(fn):
+        async def _hook(session, ctx, params):
+            if ctx.trace_request_ctx is not None:
+                fn(ctx, time.monotonic())
+        return _hook
+
+    def request_start(ctx, now):
+        ctx.trace_request_ctx.setdefault("_start", now)
+        ctx.open, ctx.mark = None, now
+        ctx.dns_start = ctx.connect_start = None
+        ctx.dns_in_connect = 0.0
+
+    def queued_start(ctx, now):
+        _close_phase(ctx, now)
+        ctx.open = "queued"
+
+    def dns_start(ctx, now):
+        ctx.dns_start = now
+
+    def dns_end(ctx, now):
+        if ctx.dns_start is not None:
+            _add_phase(ctx, "dns", now - ctx.dns_start)
+            if ctx.connect_start is not None:
+                ctx.dns_in_connect += now - ctx.dns_start
+            ctx.dns_start = None
+
+    def connect_start(ctx, now):
+        _close_phase(ctx, now)
+        ctx.connect_start, ctx.dns_in_connect = now, 0.0
+
+    def connect_end(ctx, now):
+        if ctx.connect_start is not None:
+            _add_phase(ctx, "connect", now - ctx.connect_start - ctx.dns_in_connect)
+            ctx.connect_start = None
+        ctx.open, ctx.mark = "request_sent", now
+
+    def reuse(ctx, now):
+        _close_phase(ctx, now)
+        ctx.open = "request_sent"
+
+    def headers_sent(ctx, now):
+        ctx.open = ctx.open or "request_sent"
+        _close_phase(ctx, now)
+        ctx.open = "first_byte"
+
+    def response_headers(ctx, now):
+        _close_phase(ctx, now)
+        ctx.trace_request_ctx["_body_start"] = now
+
+    def failed(ctx, now):
+        # Charge the time up to the failure to whichever phase it happened in
+        dns_end(ctx, now)
+        if ctx.connect_start is not None:
+            _add_phase(ctx, "connect", now - ctx.connect_start - ctx.dns_in_connect)
+            ctx.connect_start = None
+        _close_phase(ctx, now)
+
+    config.on_request_start.append(hook(request_start))
+    config.on_connection_queued_start.append(hook(queued_start))
+    config.on_connection_queued_end.append(hook(_close_phase))
+    config.on_dns_resolvehost_start.append(hook(dns_start))
+    config.on_dns_resolvehost_end.append(hook(dns_end))
+    config.on_connection_create_start.append(hook(connect_start))
+    config.on_connection_create_end.append(hook(connect_end))
+    config.on_connection_reuseconn.append(hook(reuse))
+    config.on_request_headers_sent.append(hook(headers_sent))
+    config.on_request_redirect.append(hook(response_headers))
+    config.on_request_end.append(hook(response_headers))
+    config.on_request_exception.append(hook(failed))
+    return config
+
+
+def finish_phases(phases: Dict[str, float]) -> Dict[str, float]:
+    # Turn the raw marks into "body" and "total" once the response (or failure) is done
+    now = time.monotonic()
+    body_start = phases.pop("_body_start", None)
+    if body_start is not None:
+        phases["body"] = now - body_start
+    start = phases.pop("_start", None)
+    if start is not None:
+        phases["total"] = now - start
+    return phases
+
+
+class PhaseStats:
+    """Request phase histograms per proxy and per outcome label, plus optional per-domain timings."""
 
-                body = raw
+    def __init__(self):
+        self.by_proxy: Dict[str, Dict[str, WallTimeHistogram]] = {}
+        self.by_outcome: Dict[str, Dict[str, WallTimeHistogram]] = {}
+        self.overall: Dict[str, WallTimeHistogram] = {}
+        self.requests = 0
+        self._domains: Optional[Dict[str, Dict[str, float]]] = None
+        self._domain_path: Optional[Path] = None
+        self._domain_lines: List[str] = []
 
+    @staticmethod
+    def _hist(table: Dict[str, WallTimeHistogram], phase: str) -> WallTimeHistogram:
+        hist = table.get(phase)
+        if hist is None:
+            hist = table[phase] = WallTimeHistogram(PHASE_TIME_BUCKETS, PHASE_TIME_SAMPLES)
+        return hist
+
+    def open_domain_file(self, path: str) -> None:
+        self._domains = {}
+        self._domain_path = Path(path)
+        self._domain_path.write_text("\t".join(("domain", "verdict", "requests") + PHASES) + "\n", encoding="utf-8")
+
+    def observe(self, proxy: Optional[str], label: str, domain: str, requests: List[Dict[str, float]]) -> None:
+        proxy_key = mask_proxy(proxy) if proxy else "direct"
+        per_proxy = self.by_proxy.setdefault(proxy_key, {})
+        per_outcome = self.by_outcome.setdefault(label, {})
+        acc = None
+        if self._domains is not None:
+            acc = self._domains.setdefault(domain, {"requests": 0.0})
+        for phases in requests:
+            self.requests += 1
+            for phase, seconds in phases.items():
+                self._hist(per_proxy, phase).observe(seconds)
+                self._hist(per_outcome, phase).observe(seconds)
+                self._hist(self.overall, phase).observe(seconds)
+                if acc is not None:
+                    acc[phase] = acc.get(phase, 0.0) + seconds
+            if acc is not None:
+                acc["requests"] += 1
+
+    def domain_verdict(self, domain: str, verdict: str) -> None:
+        # Called for every verdict line; emits the time this domain spent in each phase across all requests
+        if self._domains is None:
+            return
+        acc = self._domains.pop(domain, None)
+        if acc is None:
+            return
+        cells = [f"{acc.get(phase, 0.0):.3f}" for phase in PHASES]
+        self._domain_lines.append("\t".join([domain, verdict, str(int(acc["requests"]))] + cells))
+        if len(self._domain_lines) >= BATCH_LINES:
+            self.flush()
 
+    def flush(self) -> None:
+        if self._domain_path is None or not self._domain_lines:
+            return
+        with open(self._domain_path, "a", encoding="utf-8") as f:
+            f.write("\n".join(self._domain_lines) + "\n")
+        self._domain_lines.clear()
+
+    def write_report(self, path: str) -> None:
+        def table(groups: Dict[str, Dict[str, WallTimeHistogram]]) -> Dict[str, Any]:
+            return {key: {p: h.to_json() for p, h in phases.items()} for key, phases in sorted(groups.items())}
+
+        report = {
+            "generated": datetime.now().isoformat(timespec="seconds"),
+            "requests": self.requests,
+            "phases": list(PHASES),
+            "bucket_bounds": list(PHASE_TIME_BUCKETS),
+            "overall": {p: h.to_json() for p, h in self.overall.items()},
+            "by_proxy": table(self.by_proxy),
+            "by_outcome": table(self.by_outcome),
+        }
+        tmp = Path(f"{path}.tmp")
+        tmp.write_text(json.dumps(report, indent=2), encoding="utf-8")
+        os.replace(tmp, path)
 
-                if "://" in raw:
+    def summary_line(self) -> str:
+        parts = []
+        for phase in PHASES:
+            hist = self.overall.get(phase)
+            if hist is not None and hist.total:
+                parts.append(f"{phase} {hist.percentile(50):.2f}/{hist.percentile(95):.2f}s")
+        return f"🔬 Request phases p50/p95 over {self.requests:,} requests: " + ", ".join(parts)
 
 
+_phase_stats: Optional[PhaseStats] = None
 
-                    scheme, body = raw.split("://", 1)
 
+def get_phase_stats() -> Optional[PhaseStats]:
+    global _phase_stats
+    if _phase_stats is None and PHASE_TRACING:
+        _phase_stats = PhaseStats()
+    return _phase_stats
 
 
-                parts = body.split(":")
+def failure_rank(label: str) -> int:
+    # Position in FAILOVER_STATUS_PREFERENCE; lower means more informative.
+    try:
+        return FAILOVER_STATUS_PREFERENCE.index(label)
+    except ValueError:
+        return len(FAILOVER_STATUS_PREFERENCE)
+
+
+async def hedge_race(
+    factories: List[Callable[[], Awaitable[Any]]],
+    usable: Callable[[Any], bool],
+    delay: float,
+    max_parallel: int,
+) -> Tuple[Optional[Any], List[Any]]:
+    """Run candidates in order, starting the next one early when the current ones are slow.
+
+    The next candidate starts as soon as a running one finishes unusable, or after `delay` seconds
+    without an answer while fewer than `max_parallel` are in flight (delay <= 0 means strictly
+    sequential). Returns (first usable result, unusable results in start order); the remaining
+    candidates are cancelled once a usable result arrives.
+    """
+    if delay <= 0:
+        max_parallel = 1
+    pending: Dict[asyncio.Future, int] = {}
+    finished: List[Tuple[int, Any]] = []
+    next_idx = 0
+
+    def launch() -> None:
+        nonlocal next_idx
+        pending[asyncio.ensure_future(factories[next_idx]())] = next_idx
+        next_idx += 1
+
+    if factories:
+        launch()
+    try:
+        while pending:
+            can_hedge = next_idx < len(factories) and len(pending) < max_parallel
+            done, _ = await asyncio.wait(
+                pending, timeout=delay if can_hedge else None, return_when=asyncio.FIRST_COMPLETED
+            )
+            if not done:
+                update_stats("hedges_launched")
+                launch()
+                continue
+            for task in done:
+                idx = pending.pop(task)
+                result = task.result()
+                if usable(result):
+                    if idx > 0:
+                        update_stats("hedge_wins")
+                    return result, [r for _, r in sorted(finished, key=lambda x: x[0])]
+                finished.append((idx, result))
+            while next_idx < len(factories) and len(pending) < max_parallel:
+                launch()
+        return None, [r for _, r in sorted(finished, key=lambda x: x[0])]
+    finally:
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
 
 
+def is_target_failure(label: str, http_status: Optional[int]) -> bool:
+    # No response from the target itself; says nothing about the proxy on its own.
+    return http_status is None and label in ("timeout", CDN_TIMEOUT_LABEL, "connection_error")
 
-                if len(parts) >= 4:
 
+class ProxyHealth:
+    # Rolling outcome statistics for one proxy.
+    __slots__ = (
+        "success_ewma", "latencies", "errors", "requests", "successes",
+        "consecutive_failures", "consecutive_proxy_errors", "consecutive_successes",
+        "backoff_level", "ejected_until", "probe_started", "ejections",
+    )
 
+    def __init__(self):
+        self.success_ewma = 1.0
+        self.latencies = deque(maxlen=PROXY_LATENCY_WINDOW)
+        self.errors: Dict[str, int] = {}
+        self.requests = 0
+        self.successes = 0
+        self.consecutive_failures = 0
+        self.consecutive_proxy_errors = 0
+        self.consecutive_successes = 0
+        self.backoff_level = 0
+        self.ejected_until = 0.0  # wall clock so it survives restarts; 0 = admitted
+        self.probe_started = 0.0
+        self.ejections = 0
+
+    def latency_pct(self, pct: float) -> Optional[float]:
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+    def score(self) -> float:
+        p50 = self.latency_pct(50)
+        penalty = 1.0 + (p50 / PROXY_LATENCY_REF_SEC if p50 else 0.0)
+        return max(PROXY_MIN_WEIGHT, self.success_ewma / penalty)
+
+    def to_json(self) -> Dict:
+        return {
+            "success_ewma": round(self.success_ewma, 4),
+            "latencies": [round(x, 3) for x in list(self.latencies)[-50:]],
+            "backoff_level": self.backoff_level,
+            "ejected_until": self.ejected_until,
+        }
 
-                    host, port, user, pwd = parts[0], parts[1], parts[2], ":".join(parts[3:])
+    @classmethod
+    def from_json(cls, data: Dict) -> "ProxyHealth":
+        h = cls()
+        h.success_ewma = float(data.get("success_ewma", 1.0))
+        h.latencies.extend(float(x) for x in data.get("latencies", []))
+        h.backoff_level = int(data.get("backoff_level", 0))
+        h.ejected_until = float(data.get("ejected_until", 0.0))
+        return h
 
 
+class ProxyPool:
 
-                    prox = f"{scheme}://{user}:{pwd}@{host}:{port}"
 
 
+    """Health-aware proxy selection.
 
-                elif len(parts) >= 2:
+    Proxies are picked by score (success rate discounted by median latency). A proxy that keeps
+    failing is ejected for an exponentially growing period; once that expires it is half-open and
+    the next attempt through it is a probe that either re-admits it or ejects it again.
+    """
 
+    def __init__(self, proxies: List[str], health_file: Optional[str] = PROXY_HEALTH_FILE):
+        if not proxies:
 
 
-                    host, port = parts[0], parts[1]
 
+            raise ValueError("No proxies provided")
 
 
-                    prox = f"{scheme}://{host}:{port}"
 
+        self.proxies = proxies
 
 
-                else:
 
+        self.health_file = health_file
+        self.health: Dict[str, ProxyHealth] = {p: ProxyHealth() for p in proxies}
+        if health_file:
+            self._load()
 
+    def _load(self) -> None:
+        try:
+            data = json.loads(Path(self.health_file).read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return
+        restored = 0
+        for proxy in self.proxies:
+            entry = data.get(mask_proxy(proxy))
+            if isinstance(entry, dict):
+                try:
+                    self.health[proxy] = ProxyHealth.from_json(entry)
+                    restored += 1
+                except (TypeError, ValueError):
+                    continue
+        if restored:
+            print_status(f"🧭 Restored health for {restored}/{len(self.proxies)} proxies from {self.health_file}", "info")
 
-                    prox = f"{scheme}://{body}"
+    def save(self) -> None:
+        if not self.health_file:
+            return
+        data = {mask_proxy(p): h.to_json() for p, h in self.health.items()}
+        tmp = Path(self.health_file + ".tmp")
+        try:
+            tmp.write_text(json.dumps(data, indent=1, sort_keys=True), encoding="utf-8")
+            os.replace(tmp, self.health_file)
+        except OSError as e:
+            print_status(f"⚠️ Could not save proxy health: {e}", "warning")
 
+    def _admitted(self) -> List[str]:
+        return [p for p in self.proxies if self.health[p].ejected_until == 0]
 
+    def _half_open(self, now: float) -> List[str]:
+        return [
+            p for p in self.proxies
+            if 0 < self.health[p].ejected_until <= now and now - self.health[p].probe_started > PROXY_PROBE_TIMEOUT_SEC
+        ]
 
-                proxies.append(prox)
+    def next_proxy(self) -> str:
 
 
 
-    except Exception as e:
+        admitted = self._admitted() or self.proxies
+        return random.choices(admitted, weights=[self.health[p].score() for p in admitted])[0]
 
+    def pick(self, preferred: Optional[str]) -> str:
+        # Keep a worker on its home proxy unless that proxy is ejected or clearly worse than its peers.
+        if preferred in self.health and self.health[preferred].ejected_until == 0:
+            admitted = self._admitted()
+            mean_score = sum(self.health[p].score() for p in admitted) / len(admitted)
+            if self.health[preferred].score() >= 0.5 * mean_score:
+                return preferred
+        return self.next_proxy()
 
+    def order_from(self, first: str) -> List[str]:
 
-        logger.error(f'Failed to read proxies from {proxy_file}: {e}')
 
 
+        # Due probes go first: a failed probe costs one attempt, the chain then falls through to healthy proxies.
+        now = time.time()
+        admitted = sorted(self._admitted(), key=lambda p: self.health[p].score(), reverse=True)
+        if first in admitted:
+            admitted.remove(first)
+            admitted.insert(0, first)
+        chain = self._half_open(now) + admitted
+        if not chain:
+            # Everything is ejected; try the proxies closest to re-admission rather than nothing.
+            chain = sorted(self.proxies, key=lambda p: self.health[p].ejected_until)
+        return chain
+
+    def begin_attempt(self, proxy: str) -> bool:
+        """Claim a half-open proxy for probing; False if another task is already probing it."""
+        h = self.health[proxy]
+        now = time.time()
+        if 0 < h.ejected_until <= now:
+            if now - h.probe_started <= PROXY_PROBE_TIMEOUT_SEC:
+                return False
+            h.probe_started = now
+        return True
 
-    if any(p.lower().startswith('socks') for p in proxies) and not HAVE_SOCKS:
+    def record(self, proxy: str, label: str, http_status: Optional[int], latency: float) -> None:
+        h = self.health[proxy]
+        h.requests += 1
+        if label != "success":
+            h.errors[label] = h.errors.get(label, 0) + 1
+        if is_target_failure(label, http_status):
+            # A dead or slow target fails through every proxy alike; blame() counts it only once
+            # another proxy reached the same domain.
+            return
+        if label == "proxy_error":
+            self._fail(proxy, h, proxy_failure=True)
+            return
+        h.success_ewma += PROXY_HEALTH_EWMA_ALPHA * (1.0 - h.success_ewma)
+        h.successes += 1
+        h.latencies.append(latency)
+        h.consecutive_failures = 0
+        h.consecutive_proxy_errors = 0
+        h.consecutive_successes += 1
+        if h.ejected_until > 0 and h.probe_started > 0:
+            h.ejected_until = 0.0
+            h.probe_started = 0.0
+            h.success_ewma = max(h.success_ewma, 0.5)
+            print_status(f"🧭 Proxy {mask_proxy(proxy)} re-admitted after probe", "info")
+        if h.consecutive_successes >= PROXY_RECOVERY_SUCCESSES:
+            h.backoff_level = 0
+
+    def blame(self, proxy: str) -> None:
+        """Count a target-side failure through `proxy` after another proxy reached the same domain."""
+        self._fail(proxy, self.health[proxy], proxy_failure=False)
+
+    def _fail(self, proxy: str, h: ProxyHealth, *, proxy_failure: bool) -> None:
+        h.success_ewma -= PROXY_HEALTH_EWMA_ALPHA * h.success_ewma
+        probing = h.ejected_until > 0 and h.probe_started > 0
+        h.consecutive_successes = 0
+        h.consecutive_failures += 1
+        if proxy_failure:
+            h.consecutive_proxy_errors += 1
+        if (
+            probing
+            or h.consecutive_proxy_errors >= PROXY_EJECT_PROXY_ERRORS
+            or h.consecutive_failures >= PROXY_EJECT_FAILURES
+        ):
+            self._eject(proxy, h)
+
+    def _eject(self, proxy: str, h: ProxyHealth) -> None:
+        if h.ejected_until > time.time():
+            return
+        duration = min(PROXY_EJECT_BASE_SEC * (2 ** h.backoff_level), PROXY_EJECT_MAX_SEC)
+        h.backoff_level += 1
+        h.ejected_until = time.time() + duration
+        h.probe_started = 0.0
+        h.consecutive_failures = 0
+        h.consecutive_proxy_errors = 0
+        h.ejections += 1
+        print_status(f"🧭 Proxy {mask_proxy(proxy)} ejected for {duration:.0f}s", "warning")
+
+    def report_lines(self, limit: int = 10) -> List[str]:
+        now = time.time()
+        ejected = sum(1 for h in self.health.values() if h.ejected_until > now)
+        ejections = sum(h.ejections for h in self.health.values())
+        lines = [f"🧭 Proxy health: {len(self.proxies) - ejected} usable, {ejected} ejected ({ejections} ejections this run)"]
+        used = [p for p in self.proxies if self.health[p].requests]
+        for proxy in sorted(used, key=lambda p: self.health[p].score())[:limit]:
+            h = self.health[proxy]
+            p50, p95 = h.latency_pct(50), h.latency_pct(95)
+            lat = f"p50 {p50:.2f}s p95 {p95:.2f}s" if p50 is not None else "no latency"
+            top_errors = ", ".join(f"{k}={v}" for k, v in sorted(h.errors.items(), key=lambda kv: -kv[1])[:3])
+            lines.append(
+                f"   {mask_proxy(proxy)}: {h.successes}/{h.requests} ok, score {h.score():.2f}, {lat}"
+                + (f", errors: {top_errors}" if top_errors else "")
+            )
+        return lines
 
 
 
-        logger.warning('Socks proxies requested but aiohttp_socks not installed; those entries will fail')
+def load_proxies(proxy_file: str) -> List[str]:
 
 
 
-    return proxies
+    path = Path(proxy_file)
 
 
 
-def compute_concurrency_limits(proxy_count: int) -> Tuple[int, int]:
+    if not path.exists():
 
-    if proxy_count <= 0:
 
-        return CONCURRENCY, CONCURRENCY
 
-    per_host = max(1, PROXY_PARALLEL_PER_HOST)
+        return []
 
-    base_total = max(per_host * proxy_count, per_host)
 
-    overall = base_total if PROXY_PARALLEL_ONLY else min(CONCURRENCY, base_total)
 
-    per_proxy = max(2, overall // proxy_count)
+    proxies: List[str] = []
 
-    return overall, per_proxy
 
 
-def mask_proxy(proxy: str) -> str:
+    try:
 
 
 
-    """Hide credentials; return scheme://host:port."""
+        with open(path, 'r', encoding='utf-8') as f:
 
 
 
-    try:
+            for line in f:
 
 
 
-        parsed = urlparse(proxy)
+                raw = line.strip()
 
 
 
-        scheme = parsed.scheme or "http"
+                if not raw or raw.startswith('#'):
 
 
 
-        host = parsed.hostname or ""
+                    continue
 
 
 
-        port = parsed.port
+                scheme = "http"
 
 
 
-        if not host:
+                body = raw
+
+
+
+                if "://" in raw:
+
+
+
+                    scheme, body = raw.split("://", 1)
+
+
+
+                parts = body.split(":")
+
+
+
+                if len(parts) >= 4:
+
+
+
+                    host, port, user, pwd = parts[0], parts[1], parts[2], ":".join(parts[3:])
+
+
+
+                    prox = f"{scheme}://{user}:{pwd}@{host}:{port}"
+
+
+
+                elif len(parts) >= 2:
+
+
+
+                    host, port = parts[0], parts[1]
+
+
+
+                    prox = f"{scheme}://{host}:{port}"
+
+
+
+                else:
+
+
+
+                    prox = f"{scheme}://{body}"
+
+
+
+                proxies.append(prox)
+
+
+
+    except Exception as e:
+
+
+
+        logger.error(f'Failed to read proxies from {proxy_file}: {e}')
+
+
+
+    if any(p.lower().startswith('socks') for p in proxies) and not HAVE_SOCKS:
+
+
+
+        logger.warning('Socks proxies requested but aiohttp_socks not installed; those entries will fail')
+
+
+
+    return proxies
+
+
+
+def compute_concurrency_limits(proxy_count: int) -> Tuple[int, int]:
+
+    if proxy_count <= 0:
+
+        return CONCURRENCY, CONCURRENCY
+
+    per_host = max(1, PROXY_PARALLEL_PER_HOST)
+
+    base_total = max(per_host * proxy_count, per_host)
+
+    overall = base_total if PROXY_PARALLEL_ONLY else min(CONCURRENCY, base_total)
+
+    per_proxy = max(2, overall // proxy_count)
+
+    return overall, per_proxy
+
+
+def adaptive_concurrency_ceiling(overall: int) -> int:
+    # Highest fast-pass limit the controller may grow to
+    if not ADAPTIVE_CONCURRENCY:
+        return overall
+    ceiling = overall * ADAPTIVE_MAX_FACTOR
+    fd_limit = _get_fd_soft_limit()
+    if fd_limit is not None:
+        spare = max(fd_limit - FD_SAFETY_MARGIN, 128) - _estimate_fd_usage(0, RESCUE_CONCURRENCY, FALLBACK_MAX_BROWSERS)
+        ceiling = min(ceiling, spare // 2)
+    return max(overall, ceiling)
+
+
+def mask_proxy(proxy: str) -> str:
+
+
+
+    """Hide credentials; return scheme://host:port."""
+
+
+
+    try:
+
+
+
+        parsed = urlparse(proxy)
+
+
+
+        scheme = parsed.scheme or "http"
+
+
+
+        host = parsed.hostname or ""
+
+
+
+        port = parsed.port
+
+
+
+        if not host:
 
 
 
@@ -3510,6 +5220,122 @@ def proxy_arg_for_browser(proxy: Optional[str]) -> Optional[str]:
 
 
 
+class SharedDNSCache:
+    """Process-wide DNS cache used by every Fetcher connector.
+
+    Answers are kept for their record TTL (clamped to DNS_MIN_TTL..DNS_MAX_TTL; DNS_CACHE_TTL when
+    resolving through getaddrinfo), failures for DNS_NEGATIVE_TTL, and concurrent lookups of the
+    same name share one query. Connectors get thin resolver views via resolver(); the cache itself
+    outlives them and is closed at the end of main().
+    """
+
+    def __init__(self):
+        self._cache: Dict[Tuple[str, int], Tuple[float, object]] = {}
+        self._inflight: Dict[Tuple[str, int], asyncio.Future] = {}
+        self._aiodns = None
+        self.lookups = 0
+        self.hits = 0
+        self.coalesced = 0
+        self.failures = 0
+
+    def resolver(self, forced_family: int = socket.AF_UNSPEC) -> "aiohttp.abc.AbstractResolver":
+        cache = self
+
+        class _SharedResolver(aiohttp.abc.AbstractResolver):
+            async def resolve(self, host, port=0, family=socket.AF_INET):
+                return await cache.resolve(host, port, forced_family)
+
+            async def close(self):
+                pass
+
+        return _SharedResolver()
+
+    async def resolve(self, host: str, port: int = 0, family: int = socket.AF_UNSPEC) -> List[Dict]:
+        key = (host.lower(), family)
+        now = time.monotonic()
+        entry = self._cache.get(key)
+        if entry is not None and entry[0] > now:
+            self.hits += 1
+            answer = entry[1]
+        else:
+            # The lookup runs as its own task so a cancelled caller (e.g. a hedging loser) doesn't
+            # cancel it for everyone else waiting on the same name.
+            task = self._inflight.get(key)
+            if task is not None:
+                self.coalesced += 1
+            else:
+                task = asyncio.ensure_future(self._lookup(key[0], family))
+                self._inflight[key] = task
+                task.add_done_callback(lambda _t, k=key: self._inflight.pop(k, None))
+            answer = await asyncio.shield(task)
+        if isinstance(answer, OSError):
+            raise answer
+        return [
+            {"hostname": host, "host": ip, "port": port, "family": fam, "proto": 0,
+             "flags": socket.AI_NUMERICHOST | socket.AI_NUMERICSERV}
+            for fam, ip in answer
+        ]
+
+    async def _lookup(self, host: str, family: int) -> object:
+        # Returns [(family, ip), ...] or an OSError; either way the result is cached.
+        self.lookups += 1
+        try:
+            if aiodns is not None:
+                answer, ttl = await self._lookup_aiodns(host, family)
+            else:
+                answer, ttl = await self._lookup_getaddrinfo(host, family)
+        except Exception as e:
+            self.failures += 1
+            if not isinstance(e, OSError):
+                e = OSError(None, str(e) or "Name or service not known")
+            self._cache[(host, family)] = (time.monotonic() + DNS_NEGATIVE_TTL, e)
+            return e
+        self._cache[(host, family)] = (time.monotonic() + ttl, answer)
+        if len(self._cache) > 200_000:
+            now = time.monotonic()
+            for stale in [k for k, v in self._cache.items() if v[0] <= now]:
+                del self._cache[stale]
+        return answer
+
+    async def _lookup_aiodns(self, host: str, family: int) -> Tuple[List[Tuple[int, str]], float]:
+        if self._aiodns is None:
+            self._aiodns = aiodns.DNSResolver()
+        qtypes = [("A", socket.AF_INET)] if family == socket.AF_INET else [("A", socket.AF_INET), ("AAAA", socket.AF_INET6)]
+        results = await asyncio.gather(*(self._aiodns.query(host, q) for q, _ in qtypes), return_exceptions=True)
+        answer: List[Tuple[int, str]] = []
+        ttls: List[float] = []
+        for (_, fam), res in zip(qtypes, results):
+            if isinstance(res, Exception):
+                continue
+            for record in res:
+                answer.append((fam, record.host))
+                ttls.append(getattr(record, "ttl", DNS_CACHE_TTL))
+        if not answer:
+            raise OSError(socket.EAI_NONAME, "Name or service not known")
+        return answer, min(DNS_MAX_TTL, max(DNS_MIN_TTL, min(ttls)))
+
+    async def _lookup_getaddrinfo(self, host: str, family: int) -> Tuple[List[Tuple[int, str]], float]:
+        infos = await asyncio.get_running_loop().getaddrinfo(host, 0, family=family, type=socket.SOCK_STREAM)
+        answer = list(dict.fromkeys((fam, sockaddr[0]) for fam, _, _, _, sockaddr in infos))
+        return answer, DNS_CACHE_TTL
+
+    async def close(self) -> None:
+        if self._aiodns is not None:
+            with contextlib.suppress(Exception):
+                self._aiodns.cancel()
+            self._aiodns = None
+
+
+_shared_dns: Optional[SharedDNSCache] = None
+
+
+def get_shared_dns() -> Optional[SharedDNSCache]:
+    global _shared_dns
+    if _shared_dns is None and SHARED_DNS_CACHE:
+        _shared_dns = SharedDNSCache()
+    return _shared_dns
+
+
 class Fetcher:
     # HTTP fetcher with retry/rescue support and optional proxy routing.
 
@@ -3568,6 +5394,7 @@ class Fetcher:
 
 
         timeout = ClientTimeout(total=total_timeout, connect=connect_timeout, sock_read=read_timeout)
+        self.timeout = timeout
 
 
 
@@ -3575,10 +5402,10 @@ class Fetcher:
 
 
 
-        if force_ipv4:
-
-
-
+        shared_dns = get_shared_dns()
+        if shared_dns is not None:
+            resolver = shared_dns.resolver(socket.AF_INET if force_ipv4 else socket.AF_UNSPEC)
+        elif force_ipv4:
             class IPv4Resolver(aiohttp.abc.AbstractResolver):
 
 
@@ -3679,6 +5506,7 @@ class Fetcher:
 
 
 
+                use_dns_cache=shared_dns is None,
                 resolver=resolver,
 
 
@@ -3707,7 +5535,9 @@ class Fetcher:
 
 
 
-        self.session = aiohttp.ClientSession(timeout=timeout, connector=self.connector, trust_env=False)
+        self._phase_stats = get_phase_stats()
+        trace_configs = [build_phase_trace_config()] if self._phase_stats is not None else None
+        self.session = aiohttp.ClientSession(timeout=timeout, connector=self.connector, trust_env=False, trace_configs=trace_configs)
 
 
 
@@ -3735,7 +5565,13 @@ class Fetcher:
 
 
 
-    async def _fetch_once(self, scheme: str, domain: str) -> Tuple[str, int, aiohttp.typedefs.LooseHeaders, str]:
+    async def _fetch_once(
+        self,
+        scheme: str,
+        domain: str,
+        budget: Optional[DomainBudget] = None,
+        timings: Optional[List[Dict[str, float]]] = None,
+    ) -> Tuple[str, int, aiohttp.typedefs.LooseHeaders, str]:
 
 
 
@@ -3779,66 +5615,127 @@ class Fetcher:
 
 
 
-        async with self.session.get(url, allow_redirects=True, headers=headers, **proxy_kwargs) as r:
-
-
-
-            if not is_html_content_type(r.headers.get("Content-Type")):
-
-
-
-                return "", r.status, r.headers, str(r.url)
-
-
-
-            buf = bytearray()
-
-
+        if budget is not None:
+            remaining = budget.remaining()
+            if remaining < self.timeout.total:
+                proxy_kwargs["timeout"] = ClientTimeout(
+                    total=remaining,
+                    connect=min(self.timeout.connect, remaining),
+                    sock_read=min(self.timeout.sock_read, remaining),
+                )
+        phases = None
+        if timings is not None:
+            phases = {}
+            timings.append(phases)
+        try:
+            async with self.session.get(url, allow_redirects=True, headers=headers, trace_request_ctx=phases, **proxy_kwargs) as r:
+                if not is_html_content_type(r.headers.get("Content-Type")):
+                    return "", r.status, r.headers, str(r.url)
+                if r.history and r.status < 400:
+                    # Landed on a redirect target with a cached verdict; the caller reuses it, no body needed
+                    redirect_cache = get_redirect_cache()
+                    if redirect_cache is not None and redirect_cache.skip_bodies and redirect_cache.known(redirect_target_key(domain, str(r.url))):
+                        stream_stats["redirect_cached"] += 1
+                        return "", r.status, r.headers, str(r.url)
+                return await self._read_body(r, domain)
+        finally:
+            if phases is not None:
+                finish_phases(phases)
 
+    @staticmethod
+    async def _read_body(r, domain: str) -> Tuple[str, int, aiohttp.typedefs.LooseHeaders, str]:
+        # The body goes into a pooled buffer and through the bytes prefilter. Text is only streamed
+        # through StreamingAnalyzer once a candidate keyword shows up; a page without any can only
+        # classify as clean with score 0, so just its head is decoded for the summary.
+        # Leaving the response context early closes the connection, so an early stop also frees the proxy slot.
+        stream_stats["responses"] += 1
+        if STREAM_ANALYSIS and r.status in BODYLESS_INACTIVE_STATUSES:
+            stream_stats["skipped_body"] += 1
+            return "", r.status, r.headers, str(r.url)
+        charset = r.charset or "utf-8"
+        prefilter = BodyPrefilter.for_charset(charset) if PREFILTER else None
+        candidate = prefilter is None
+        analyzer: Optional[StreamingAnalyzer] = None
+        pool = get_buffer_pool()
+        buf = pool.acquire()
+        try:
+            size = 0
             async for chunk in r.content.iter_chunked(CHUNK_SIZE):
-
-
-
-                buf.extend(chunk)
-
-
-
-                if len(buf) >= MAX_BYTES:
-
-
-
+                start, size = size, min(size + len(chunk), len(buf))
+                buf[start:size] = chunk[:size - start]
+                if not candidate:
+                    candidate = prefilter.scan(buf, start, size)
+                if STREAM_ANALYSIS and candidate:
+                    if analyzer is None:
+                        analyzer = StreamingAnalyzer(domain, charset)
+                        start = 0
+                    verdict = analyzer.feed(buf[start:size])
+                    if verdict is not None:
+                        stream_stats["early_" + verdict] += 1
+                        break
+                if size >= MAX_BYTES:
                     break
-
-
-
-            charset = r.charset or "utf-8"
-
-
-
-            try:
-
-
-
-                text = buf.decode(charset, errors="ignore")
-
-
-
-            except Exception:
-
-
-
-                text = buf.decode("utf-8", errors="ignore")
-
-
-
-            return text, r.status, r.headers, str(r.url)
-
-
-
-    async def fetch(self, domain: str) -> Tuple[Optional[str], str, Optional[int], Optional[Dict[str, str]], Optional[str]]:
-
-
-
+            stream_stats["bytes"] += size
+            if analyzer is not None and analyzer.filtered and analyzer.verdict is None:
+                stream_stats["settled_filtered"] += 1
+            if not candidate:
+                stream_stats["prefilter_skips"] += 1
+                text = decode_body(memoryview(buf)[:min(size, PREFILTER_HEAD_BYTES)], charset)
+            elif analyzer is not None:
+                text = analyzer.text()
+            else:
+                text = decode_body(memoryview(buf)[:size], charset)
+        finally:
+            pool.release(buf)
+        return text, r.status, r.headers, str(r.url)
+
+
+
+    async def fetch(self, domain: str, budget: Optional[DomainBudget] = None) -> Tuple[Optional[str], str, Optional[int], Optional[Dict[str, str]], Optional[str], Optional[str]]:
+        # Returns (html, label, http_status, headers, err_detail, final_url).
+        # With hedging enabled https://domain, https://www.domain and http://domain are raced as
+        # candidates; otherwise https is tried with retries and www. only after connect errors.
+        if HEDGE_DELAY_SEC <= 0 or HEDGE_MAX_PARALLEL < 2:
+            return await self._traced_candidate(domain, domain, budget)
+        candidates = [(domain, ("https",))]
+        if domain.count(".") == 1:
+            candidates.append(("www." + domain, ("https",)))
+        candidates.append((domain, ("http",)))
+        factories = [
+            functools.partial(self._traced_candidate, domain, host, budget, schemes, False)
+            for host, schemes in candidates
+        ]
+        winner, failures = await hedge_race(factories, lambda r: r[1] == "success", HEDGE_DELAY_SEC, HEDGE_MAX_PARALLEL)
+        if winner is not None:
+            return winner
+        return min(failures, key=lambda r: failure_rank(r[1]))
+
+    async def _traced_candidate(
+        self,
+        key: str,
+        domain: str,
+        budget: Optional[DomainBudget] = None,
+        schemes: Tuple[str, ...] = ("https", "http"),
+        www_fallback: bool = True,
+    ) -> Tuple[Optional[str], str, Optional[int], Optional[Dict[str, str]], Optional[str], Optional[str]]:
+        # _fetch_candidate with its request phases filed under this proxy, the candidate's label and `key`
+        if self._phase_stats is None:
+            return await self._fetch_candidate(domain, budget, schemes, www_fallback)
+        timings: List[Dict[str, float]] = []
+        result = await self._fetch_candidate(domain, budget, schemes, www_fallback, timings)
+        self._phase_stats.observe(self.proxy_url, result[1], key, timings)
+        return result
+
+    async def _fetch_candidate(
+        self,
+        domain: str,
+        budget: Optional[DomainBudget] = None,
+        schemes: Tuple[str, ...] = ("https", "http"),
+        www_fallback: bool = True,
+        timings: Optional[List[Dict[str, float]]] = None,
+    ) -> Tuple[Optional[str], str, Optional[int], Optional[Dict[str, str]], Optional[str], Optional[str]]:
+        # With a budget every request draws on it and is capped at the time left; once it runs out
+        # the most recent failure is returned instead of trying further.
         domain_norm = normalize_host(domain)
 
 
@@ -3847,7 +5744,8 @@ class Fetcher:
 
 
 
-        for scheme in ("https", "http"):
+        last_failure: Tuple[str, Optional[int], Optional[str]] = ("timeout", None, "domain budget exhausted")
+        for scheme in schemes:
 
 
 
@@ -3855,11 +5753,16 @@ class Fetcher:
 
 
 
+                if budget is not None and not budget.take():
+                    label, status, detail = last_failure
+                    return None, label, status, None, detail, None
                 try:
 
 
 
-                    text, status, hdrs, final_url = await self._fetch_once(scheme, domain)
+                    text, status, hdrs, final_url = await self._fetch_once(scheme, domain, budget, timings)
+                    if status == 429:
+                        stats['http_429'] += 1
 
 
 
@@ -3875,7 +5778,7 @@ class Fetcher:
 
 
 
-                        return None, "non_html", status, dict(hdrs), None
+                        return None, "non_html", status, dict(hdrs), None, final_url
 
 
 
@@ -3883,7 +5786,7 @@ class Fetcher:
 
 
 
-                        return None, "cloudflare", status, dict(hdrs), None
+                        return None, "cloudflare", status, dict(hdrs), None, final_url
 
 
 
@@ -3895,6 +5798,7 @@ class Fetcher:
 
 
 
+                            last_failure = ("error", status, None)
                             await asyncio.sleep(0.3 * (attempt + 1))
 
 
@@ -3903,7 +5807,7 @@ class Fetcher:
 
 
 
-                        return None, "error", status, dict(hdrs), None
+                        return None, "error", status, dict(hdrs), None, final_url
 
 
 
@@ -3915,7 +5819,7 @@ class Fetcher:
 
 
 
-                        return None, lbl, status, dict(hdrs), None
+                        return None, lbl, status, dict(hdrs), None, final_url
 
 
 
@@ -3923,19 +5827,22 @@ class Fetcher:
 
 
 
-                        return text or "", "success", status, dict(hdrs), None
+                        return text or "", "success", status, dict(hdrs), None, final_url
 
 
 
-                    return text or "", "success", status, dict(hdrs), None
+                    return text or "", "success", status, dict(hdrs), None, final_url
 
 
 
+                except (ClientProxyConnectionError, ClientHttpProxyError) as e:
+                    # The proxy itself failed; no point retrying through it, the caller moves to the next proxy.
+                    return None, "proxy_error", None, None, f"proxy: {e}", None
                 except ClientSSLError:
 
 
 
-                    return None, "ssl_error", None, None, None
+                    return None, "ssl_error", None, None, None, None
 
 
 
@@ -3943,10 +5850,12 @@ class Fetcher:
 
 
 
+                    label = CDN_TIMEOUT_LABEL if cdn_candidate else "timeout"
                     if attempt < MAX_RETRIES:
 
 
 
+                        last_failure = (label, None, None)
                         await asyncio.sleep(0.2 * (attempt + 1))
 
 
@@ -3955,11 +5864,7 @@ class Fetcher:
 
 
 
-                    label = CDN_TIMEOUT_LABEL if cdn_candidate else "timeout"
-
-
-
-                    return None, label, None, None, None
+                    return None, label, None, None, None, None
 
 
 
@@ -3967,7 +5872,7 @@ class Fetcher:
 
 
 
-                    if attempt == MAX_RETRIES and domain.count(".") == 1:
+                    if www_fallback and attempt == MAX_RETRIES and domain.count(".") == 1 and (budget is None or budget.take()):
 
 
 
@@ -3975,7 +5880,7 @@ class Fetcher:
 
 
 
-                            text, status, hdrs, final_url = await self._fetch_once(scheme, "www." + domain)
+                            text, status, hdrs, final_url = await self._fetch_once(scheme, "www." + domain, budget, timings)
 
 
 
@@ -3991,7 +5896,7 @@ class Fetcher:
 
 
 
-                                return None, "non_html", status, dict(hdrs), None
+                                return None, "non_html", status, dict(hdrs), None, final_url
 
 
 
@@ -4007,15 +5912,15 @@ class Fetcher:
 
 
 
-                                    return None, lbl, status, dict(hdrs), None
+                                    return None, lbl, status, dict(hdrs), None, final_url
 
 
 
-                                return text or "", "success", status, dict(hdrs), None
+                                return text or "", "success", status, dict(hdrs), None, final_url
 
 
 
-                            return text or "", "success", status, dict(hdrs), None
+                            return text or "", "success", status, dict(hdrs), None, final_url
 
 
 
@@ -4035,6 +5940,7 @@ class Fetcher:
 
 
 
+                        last_failure = ("connection_error", None, err_detail)
                         await asyncio.sleep(0.2 * (attempt + 1))
 
 
@@ -4043,7 +5949,7 @@ class Fetcher:
 
 
 
-                    return None, "connection_error", None, None, err_detail
+                    return None, "connection_error", None, None, err_detail, None
 
 
 
@@ -4055,6 +5961,7 @@ class Fetcher:
 
 
 
+                        last_failure = ("error", None, str(e))
                         await asyncio.sleep(0.2 * (attempt + 1))
 
 
@@ -4063,11 +5970,11 @@ class Fetcher:
 
 
 
-                    return None, "error", None, None, str(e)
+                    return None, "error", None, None, str(e), None
 
 
 
-        return None, "error", None, None, None
+        return None, "error", None, None, None, None
 
 
 
@@ -4096,6 +6003,7 @@ class Writer:
 
 
         self._flusher_task: Optional[asyncio.Task] = None
+        self.on_verdict: Optional[Callable[[str, str], None]] = None  # (domain, label) for every final line
 
 
 
@@ -4160,6 +6068,10 @@ class Writer:
 
 
         buf.append(line.strip())
+        if _phase_stats is not None:
+            _phase_stats.domain_verdict(line.strip(), key)
+        if self.on_verdict is not None:
+            self.on_verdict(line.strip(), key)
 
 
 
@@ -4267,3523 +6179,2950 @@ class Writer:
 
 
 
+# =========================
+# Response corpus (record + offline replay)
+#
+# Each record is an independent zstd frame (zlib when zstandard is missing)
+# holding a JSON header line followed by the decoded, MAX_BYTES-truncated body.
+# The tab-separated side index maps a domain to its frame so --replay can seek
+# straight to it; later records for the same domain win.
 # =========================
 
 
+def _corpus_compress(codec: str, raw: bytes, compressor=None) -> bytes:
+    if codec == "zstd":
+        return compressor.compress(raw)
+    return zlib.compress(raw, 6)
 
-# Fallback collection
 
+def _corpus_decompress(codec: str, blob: bytes) -> bytes:
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("zstandard is required to read zstd corpus records")
+        return zstandard.ZstdDecompressor().decompress(blob)
+    return zlib.decompress(blob)
 
 
-# =========================
+class ResponseCorpus:
+    # Append-only writer; all calls happen on the event loop thread.
+    # Every page that gets a verdict is recorded with the tier that fetched it ("fast", a rescue
+    # tier's tag, "FB" for the browser), cached redirect verdicts included.
 
+    def __init__(self, path: str):
+        self.path = Path(path)
+        self.index_path = Path(f"{path}{CORPUS_INDEX_SUFFIX}")
+        self.codec = "zstd" if zstandard is not None else "zlib"
+        self._compressor = zstandard.ZstdCompressor(level=CORPUS_ZSTD_LEVEL) if zstandard is not None else None
+        self._data = open(self.path, "ab")
+        self._index = open(self.index_path, "a", encoding="utf-8")
+        self._pending = 0
+        self.records = 0
+        self.raw_bytes = 0
+        self.stored_bytes = 0
 
+    def record(
+        self,
+        domain: str,
+        final_url: Optional[str],
+        http_status: Optional[int],
+        headers: Optional[Dict[str, str]],
+        html: str,
+        verdict: str,
+        score: float,
+        proxy: Optional[str] = None,
+        tier: str = "fast",
+    ) -> None:
+        header = {
+            "domain": domain,
+            "final_url": final_url,
+            "status": http_status,
+            "headers": list(headers.items()) if headers else [],
+            "verdict": verdict,
+            "score": round(score, 2),
+            "proxy": mask_proxy(proxy) if proxy else None,
+            "tier": tier,
+            "ts": int(time.time()),
+        }
+        raw = json.dumps(header, ensure_ascii=False).encode("utf-8") + b"\n" + html.encode("utf-8", errors="ignore")
+        blob = _corpus_compress(self.codec, raw, self._compressor)
+        offset = self._data.tell()
+        self._data.write(blob)
+        self._index.write(f"{domain}\t{offset}\t{len(blob)}\t{self.codec}\t{verdict}\t{score:.2f}\n")
+        self.records += 1
+        self.raw_bytes += len(raw)
+        self.stored_bytes += len(blob)
+        self._pending += 1
+        if self._pending >= CORPUS_FLUSH_EVERY:
+            self.flush()
+
+    def flush(self) -> None:
+        # Data first so the index never points past the end of the data file.
+        self._data.flush()
+        self._index.flush()
+        self._pending = 0
+
+    def close(self) -> None:
+        self.flush()
+        self._data.close()
+        self._index.close()
+
+
+def load_corpus_index(corpus_path: str) -> Dict[str, Tuple[int, int, str, str, float]]:
+    """Return domain -> (offset, length, codec, verdict, score) for the latest record of each domain."""
+    index_path = Path(f"{corpus_path}{CORPUS_INDEX_SUFFIX}")
+    if not index_path.exists():
+        return {}
+    data_size = Path(corpus_path).stat().st_size if Path(corpus_path).exists() else 0
+    latest: Dict[str, Tuple[int, int, str, str, float]] = {}
+    with open(index_path, "r", encoding="utf-8") as f:
+        for line in f:
+            parts = line.rstrip("\n").split("\t")
+            if len(parts) < 6:
+                continue
+            try:
+                offset, length, score = int(parts[1]), int(parts[2]), float(parts[5])
+            except ValueError:
+                continue
+            if offset + length > data_size:
+                # Torn write from an interrupted run.
+                continue
+            latest[parts[0]] = (offset, length, parts[3], parts[4], score)
+    return latest
 
-class FallbackCollector:
 
+def _replay_chunk(corpus_path: str, entries: List[Tuple[str, int, int, str, str]]) -> List[Tuple[str, str, str, float, str]]:
+    # Runs in a worker process: re-classify recorded pages without any network access.
+    results: List[Tuple[str, str, str, float, str]] = []
+    with open(corpus_path, "rb") as f:
+        for domain, offset, length, codec, old_verdict in entries:
+            try:
+                f.seek(offset)
+                raw = _corpus_decompress(codec, f.read(length))
+                header_line, _, body = raw.partition(b"\n")
+                header = json.loads(header_line)
+                html = body.decode("utf-8", errors="ignore")
+                label, score, reason, hits_by_cat = classify_page(html, header.get("status") or 200, domain)
+                detail = f"inactive: {reason}" if reason else (f"hits={hits_by_cat}" if hits_by_cat else "")
+            except Exception as e:
+                label, score, detail = "error", 0.0, f"replay failed: {e}"
+            results.append((domain, old_verdict, label, score, detail))
+    return results
+
+
+def replay_corpus(corpus_path: str, workers: Optional[int] = None) -> int:
+    """Re-score every recorded page with the current rules and report verdict changes."""
+    start_time = time.time()
+    index = load_corpus_index(corpus_path)
+    if not index:
+        print_status(f"❌ No corpus records found for {corpus_path}", "error")
+        return 1
+
+    # Offset order keeps each worker's reads sequential on disk.
+    entries = sorted(
+        ((domain, offset, length, codec, verdict) for domain, (offset, length, codec, verdict, _) in index.items()),
+        key=lambda e: e[1],
+    )
+    chunks = [entries[i:i + REPLAY_CHUNK] for i in range(0, len(entries), REPLAY_CHUNK)]
+    workers = max(1, workers or os.cpu_count() or 1)
+    mp_context = multiprocessing.get_context("fork") if "fork" in multiprocessing.get_all_start_methods() else None
+
+    print_status(f"🔁 Replaying {len(entries):,} recorded pages from {corpus_path} on {workers} workers", "progress")
+
+    verdict_counts: Dict[str, int] = {}
+    transitions: Dict[Tuple[str, str], int] = {}
+    changes: List[Tuple[str, str, str, float, str]] = []
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers, mp_context=mp_context) as pool, tqdm(
+        total=len(entries),
+        desc=f"{Fore.CYAN}Replay{Style.RESET_ALL}",
+        unit="domain",
+        bar_format="{l_bar}{bar}| {n_fmt}/{total_fmt} [{elapsed}<{remaining}, {rate_fmt}]",
+        colour="cyan",
+        dynamic_ncols=True,
+    ) as pbar:
+        futures = [pool.submit(_replay_chunk, corpus_path, chunk) for chunk in chunks]
+        for fut in concurrent.futures.as_completed(futures):
+            results = fut.result()
+            for domain, old_verdict, new_verdict, score, detail in results:
+                verdict_counts[new_verdict] = verdict_counts.get(new_verdict, 0) + 1
+                if old_verdict != new_verdict:
+                    key = (old_verdict, new_verdict)
+                    transitions[key] = transitions.get(key, 0) + 1
+                    changes.append((domain, old_verdict, new_verdict, score, detail))
+            pbar.update(len(results))
+
+    changes.sort()
+    with open(REPLAY_CHANGES_FILE, "w", encoding="utf-8") as f:
+        for domain, old_verdict, new_verdict, score, detail in changes:
+            f.write(f"{domain} | {old_verdict} -> {new_verdict} | score={score:.2f} {detail}".rstrip() + "\n")
 
+    elapsed = time.time() - start_time
+    print_status("=" * 80, "success")
+    print_status("🔁 REPLAY RESULTS", "success")
+    print_status("=" * 80, "success")
+    print_status(f"⏱️  Replay time: {elapsed:.2f} seconds ({len(entries) / elapsed if elapsed > 0 else 0:.0f} domains/second)", "info")
+    for label in sorted(verdict_counts):
+        print_status(f"   {label}: {verdict_counts[label]:,}", "info")
+    print_status(f"🔀 Changed verdicts: {len(changes):,} (details in {REPLAY_CHANGES_FILE})", "warning" if changes else "success")
+    for (old_verdict, new_verdict), count in sorted(transitions.items(), key=lambda item: -item[1]):
+        print_status(f"   {old_verdict} -> {new_verdict}: {count:,}", "info")
+    return 0
+
+
+def _sample_match(items, rng: random.Random) -> str:
+    """A string the parsed regex would match, ignoring anchors and lookarounds."""
+    out: List[str] = []
+    for op, av in items:
+        name = str(op)
+        if name == "LITERAL":
+            out.append(chr(av))
+        elif name == "NOT_LITERAL":
+            out.append("y" if av == ord("x") else "x")
+        elif name == "ANY":
+            out.append(rng.choice("ab "))
+        elif name == "IN":
+            choice = rng.choice(av)
+            kind = str(choice[0])
+            if str(av[0][0]) == "NEGATE":
+                out.append("#")
+            elif kind == "LITERAL":
+                out.append(chr(choice[1]))
+            elif kind == "RANGE":
+                out.append(chr(rng.randint(*choice[1])))
+            else:
+                out.append({"CATEGORY_SPACE": " ", "CATEGORY_DIGIT": "7"}.get(str(choice[1]), "w"))
+        elif name == "BRANCH":
+            out.append(_sample_match(rng.choice(av[1]), rng))
+        elif name == "SUBPATTERN":
+            out.append(_sample_match(av[-1], rng))
+        elif name == "ATOMIC_GROUP":
+            out.append(_sample_match(av, rng))
+        elif name in ("MAX_REPEAT", "MIN_REPEAT", "POSSESSIVE_REPEAT"):
+            lo, hi, sub = av
+            out.extend(_sample_match(sub, rng) for _ in range(rng.randint(lo, min(hi, lo + 2))))
+    return "".join(out)
+
+
+class _CheckBody:
+    # Stands in for aiohttp's response.content, handing out chunks of random size.
+    def __init__(self, data: bytes, rng: random.Random):
+        self._data = data
+        self._rng = rng
+
+    async def iter_chunked(self, size: int):
+        pos = 0
+        while pos < len(self._data):
+            step = self._rng.randint(1, size)
+            yield self._data[pos:pos + step]
+            pos += step
+
+
+class _CheckResponse:
+    def __init__(self, data: bytes, charset: str, rng: random.Random):
+        self.status = 200
+        self.charset = charset
+        self.headers: Dict[str, str] = {}
+        self.url = "https://check.invalid/"
+        self.content = _CheckBody(data, rng)
+
+
+def _check_page(rng: random.Random, phrases: List[str], markers: List[str]) -> str:
+    filler = ["lorem", "ipsum", "dolor", "новости", "каталог", "контакты", "about", "shop", "доставка", "weather", "2024", "—"]
+    tags = ["<p>", "</p>", "<div class=\"x\">", "</div>", "<br>", "<a href=\"/a\">", "</a>", "<span>", "</span>"]
+    density = rng.choice((0.0, 0.0, 0.0005, 0.005, 0.03))
+
+    def text(n: int) -> str:
+        words = []
+        for _ in range(n):
+            roll = rng.random()
+            if roll < density:
+                phrase = rng.choice(phrases)
+                words.append(rng.choice((phrase, phrase.upper(), phrase.title())))
+            elif roll < 0.15:
+                words.append(rng.choice(tags))
+            else:
+                words.append(rng.choice(filler))
+        return " ".join(words)
 
-    def __init__(self):
+    head = f"<title>{text(rng.randint(1, 8))}</title>"
+    if rng.random() < 0.5:
+        head += f'<meta name="description" content="{text(rng.randint(1, 12))}">'
+    script = f"<script>var s = '{text(rng.randint(0, 30))}';</script>" if rng.random() < 0.3 else ""
+    body = text(rng.randint(0, 8000))
+    if rng.random() < 0.25:
+        cut = rng.randint(0, len(body))
+        body = f"{body[:cut]} {rng.choice(markers)} {body[cut:]}"
+    return f"<html><head>{head}{script}</head><body>{body}</body></html>"
 
 
+def check_prefilter(samples: int, seed: int = 0) -> int:
+    """Read random pages through Fetcher._read_body and compare verdicts with classify_page on the full page.
 
-        self.cloudflare: Set[str] = set()
+    Covers the bytes prefilter, the head-only decode and the streaming early stop with the current
+    STREAM_ANALYSIS / PREFILTER settings. Clean verdicts must also keep their score.
+    """
+    rng = random.Random(seed)
+    def samples_of(patterns) -> List[str]:
+        found = [_sample_match(sre_parse.parse(cre.pattern, cre.flags), rng) for cre in patterns for _ in range(3)]
+        return [p for p in found if p.strip()]
+
+    phrases = samples_of([cre for _, cre in CATEGORY_RES] + CRITICAL_RE)
+    phrases += [sub for subs in CATEGORY_SUBSTRINGS.values() for sub in subs]
+    markers = samples_of(INACTIVE_RE)
+    charsets = ["utf-8", "windows-1251", "koi8-r", "latin-1"]
+    verdict_counts: Dict[str, int] = {}
+    mismatches: List[str] = []
+
+    async def run() -> None:
+        for i in range(samples):
+            charset = rng.choice(charsets)
+            data = _check_page(rng, phrases, markers).encode(charset, errors="xmlcharrefreplace")[:MAX_BYTES]
+            domain = f"check-{i}.invalid"
+            expected = classify_page(decode_body(data, charset), 200, domain)
+            text, _, _, _ = await Fetcher._read_body(_CheckResponse(data, charset, rng), domain)
+            got = classify_page(text, 200, domain)
+            verdict_counts[expected[0]] = verdict_counts.get(expected[0], 0) + 1
+            if got[0] != expected[0] or (expected[0] == "clean" and abs(got[1] - expected[1]) > 1e-6):
+                mismatches.append(f"sample {i} ({charset}, {len(data):,} bytes): expected {expected[0]} {expected[1]:.2f}, got {got[0]} {got[1]:.2f}")
 
+    start_time = time.time()
+    asyncio.run(run())
+    elapsed = time.time() - start_time
+    counts = ", ".join(f"{label}={n:,}" for label, n in sorted(verdict_counts.items()))
+    print_status(f"🧪 Prefilter check: {samples:,} pages in {elapsed:.1f}s (seed {seed}; {counts}; stream_analysis={STREAM_ANALYSIS}, prefilter={PREFILTER})", "info")
+    print_status(f"   skipped without candidates: {stream_stats['prefilter_skips']:,}, early inactive: {stream_stats['early_inactive']:,}, settled filtered: {stream_stats['settled_filtered']:,}", "info")
+    for line in mismatches[:20]:
+        print_status(f"   {line}", "error")
+    if mismatches:
+        print_status(f"❌ {len(mismatches):,} verdicts differ from the full-page path", "error")
+        return 1
+    print_status("✅ All verdicts match the full-page path", "success")
+    return 0
 
 
-        self.timeout: Set[str] = set()
 
+# =========================
 
 
-        self.cdn_timeout: Set[str] = set()
 
+# SELENIUM fallback (works on ARM64 via Selenium Manager)
 
 
-        self.connection_error: Set[str] = set()
 
+# =========================
 
 
-        self.ssl_error: Set[str] = set()
 
+from selenium import webdriver
 
 
-        self._lock = asyncio.Lock()
 
+from selenium.webdriver.chrome.options import Options as ChromeOptions
 
 
-    async def add(self, reason: str, domain: str):
 
+from selenium.webdriver.support.ui import WebDriverWait
 
 
-        async with self._lock:
 
+from selenium.common.exceptions import TimeoutException, WebDriverException
 
 
-            if reason == "cloudflare":
 
+def _selenium_options(profile_dir: Path, proxy_url: Optional[str] = None) -> ChromeOptions:
 
 
-                self.cloudflare.add(domain)
 
+    opts = ChromeOptions()
 
 
-            elif reason == "timeout":
 
+    opts.add_argument("--headless=new")
 
 
-                self.timeout.add(domain)
 
+    opts.add_argument("--no-sandbox")
 
 
-            elif reason == CDN_TIMEOUT_LABEL:
 
+    opts.add_argument("--disable-dev-shm-usage")
 
 
-                self.cdn_timeout.add(domain)
 
+    opts.add_argument("--disable-gpu")
 
 
-            elif reason == "connection_error":
 
+    opts.add_argument("--window-size=1920,1080")
 
 
-                self.connection_error.add(domain)
 
+    opts.add_argument("--disable-extensions")
 
 
-            elif reason == "ssl_error":
 
+    opts.add_argument("--disable-notifications")
 
 
-                self.ssl_error.add(domain)
 
+    opts.add_argument("--disable-popup-blocking")
 
 
-    def ordered_list(self) -> List[str]:
 
+    opts.add_argument("--disable-software-rasterizer")
 
 
-        out, seen = [], set()
 
+    opts.add_argument("--blink-settings=imagesEnabled=false")
 
 
-        for group in (self.cloudflare, self.cdn_timeout, self.timeout, self.connection_error, self.ssl_error):
 
+    opts.add_argument("--disable-logging")
 
 
-            for d in group:
 
+    opts.add_argument("--log-level=3")
 
 
-                if d not in seen:
 
+    opts.add_argument("--lang=en-US,en;q=0.9,ru;q=0.8")
 
 
-                    out.append(d); seen.add(d)
 
+    # eager page load to reduce wait
 
 
-        return out
 
+    opts.set_capability("pageLoadStrategy", "eager")
 
 
-# =========================
 
+    # Isolated profile
 
 
-# SELENIUM fallback (works on ARM64 via Selenium Manager)
 
+    opts.add_argument(f"--user-data-dir={str(profile_dir)}")
 
 
-# =========================
 
+    opts.add_argument("--profile-directory=Default")
 
 
-from selenium import webdriver
 
+    proxy_arg = proxy_arg_for_browser(proxy_url)
 
 
-from selenium.webdriver.chrome.options import Options as ChromeOptions
 
+    if proxy_arg:
 
 
-from selenium.webdriver.support.ui import WebDriverWait
 
+        opts.add_argument(f"--proxy-server={proxy_arg}")
 
 
-from selenium.common.exceptions import TimeoutException, WebDriverException
 
+        opts.add_argument("--proxy-bypass-list=<-loopback>")
 
 
-def _selenium_options(profile_dir: Path, proxy_url: Optional[str] = None) -> ChromeOptions:
 
+    return opts
 
 
-    opts = ChromeOptions()
 
+def _new_selenium_browser(profile_dir: Path, proxy_url: Optional[str] = None):
 
 
-    opts.add_argument("--headless=new")
 
+    # Selenium Manager will fetch CfT + chromedriver for ARM64 automatically
 
 
-    opts.add_argument("--no-sandbox")
 
+    opts = _selenium_options(profile_dir, proxy_url)
 
 
-    opts.add_argument("--disable-dev-shm-usage")
 
+    return webdriver.Chrome(options=opts)
 
 
-    opts.add_argument("--disable-gpu")
 
+def fallback_pool_options() -> Dict[str, Any]:
+    # Read at call time so CLI overrides apply
+    return dict(
+        max_pages=FALLBACK_PAGES_PER_BROWSER,
+        max_rss_mb=FALLBACK_MAX_RSS_MB,
+        standby=FALLBACK_STANDBY,
+        page_timeout=FALLBACK_HTTP_TIMEOUT,
+        quiet_ms=FALLBACK_QUIET_MS,
+        settle_max=FALLBACK_SETTLE_MAX_SEC,
+        body_min=FALLBACK_BODY_MIN,
+    )
 
 
-    opts.add_argument("--window-size=1920,1080")
+class SeleniumPool(BrowserPool):
+    def __init__(self, size: int, proxies: List[str]):
+        super().__init__(
+            _new_selenium_browser, size, proxies, profile_base=TMP_PROFILE_BASE, profile_prefix="sel_prof", **fallback_pool_options()
+        )
 
 
 
-    opts.add_argument("--disable-extensions")
+# =========================
 
 
 
-    opts.add_argument("--disable-notifications")
+# UC fallback (x86_64 only; optional import)
 
 
 
-    opts.add_argument("--disable-popup-blocking")
+# =========================
 
 
 
-    opts.add_argument("--disable-software-rasterizer")
+def _which(cmd: str) -> Optional[str]:
 
 
 
-    opts.add_argument("--blink-settings=imagesEnabled=false")
+    """Shallow wrapper around shutil.which for late import contexts."""
 
 
 
-    opts.add_argument("--disable-logging")
+    try:
 
 
 
-    opts.add_argument("--log-level=3")
+        return shutil.which(cmd)
 
 
 
-    opts.add_argument("--lang=en-US,en;q=0.9,ru;q=0.8")
+    except Exception:
 
 
 
-    # eager page load to reduce wait
+        return None
 
 
 
-    opts.set_capability("pageLoadStrategy", "eager")
+def _detect_chrome_binary() -> Optional[str]:
 
 
 
-    # Isolated profile
+    """Try to locate a Chrome/Chromium binary on Linux.
 
 
 
-    opts.add_argument(f"--user-data-dir={str(profile_dir)}")
+    Order: env override -> common names via PATH -> common absolute paths.
 
 
 
-    opts.add_argument("--profile-directory=Default")
+    """
 
 
 
-    proxy_arg = proxy_arg_for_browser(proxy_url)
+    # env override (allows user to set CHROME_PATH explicitly)
 
 
 
-    if proxy_arg:
+    for key in ("CHROME_PATH", "GOOGLE_CHROME_SHIM", "BROWSER"):
 
 
 
-        opts.add_argument(f"--proxy-server={proxy_arg}")
+        p = os.environ.get(key)
 
 
 
-        opts.add_argument("--proxy-bypass-list=<-loopback>")
+        if p and os.path.exists(p):
 
 
 
-    return opts
+            return p
 
 
 
-def _new_selenium_browser(profile_dir: Path, proxy_url: Optional[str] = None):
+    # common names available in PATH
 
 
 
-    # Selenium Manager will fetch CfT + chromedriver for ARM64 automatically
+    for name in ("google-chrome", "google-chrome-stable", "chromium", "chromium-browser"):
 
 
 
-    opts = _selenium_options(profile_dir, proxy_url)
+        p = _which(name)
 
 
 
-    return webdriver.Chrome(options=opts)
+        if p:
 
 
 
-def _selenium_fetch_html(br, domain: str) -> Tuple[Optional[str], str]:
+            return p
 
 
 
-    def _try(url: str) -> Optional[str]:
+    # common absolute locations
 
 
 
-        try:
+    for p in (
 
 
 
-            br.get(url)
+        "/usr/bin/google-chrome",
 
 
 
-            WebDriverWait(br, FALLBACK_HTTP_TIMEOUT).until(
+        "/usr/bin/google-chrome-stable",
 
 
 
-                lambda d: d.execute_script("return document.readyState") in ("interactive", "complete")
+        "/usr/bin/chromium",
 
 
 
-            )
+        "/usr/bin/chromium-browser",
 
 
 
-            time.sleep(0.8)
+        "/opt/google/chrome/chrome",
 
 
 
-            html = br.page_source or ""
+    ):
 
 
 
-            if len(html.strip()) >= FALLBACK_BODY_MIN:
+        if os.path.exists(p):
 
 
 
-                return html
+            return p
 
 
 
-            return None
+    return None
 
 
 
-        except TimeoutException:
+def _selenium_manager_find_chrome() -> Optional[str]:
 
 
 
-            return None
+    """Ask Selenium Manager for a Chrome for Testing browser path if available.
 
 
 
-        except WebDriverException:
+    Works on Selenium >= 4.11. Falls back silently otherwise.
 
 
 
-            return None
+    """
 
 
 
-    for scheme in ("https", "http"):
+    try:
 
 
 
-        html = _try(f"{scheme}://{domain}")
+        # Selenium 4.11+ provides SeleniumManager which can return a browser path
 
 
 
-        if html: return html, "success"
+        from selenium.webdriver.common.selenium_manager import SeleniumManager  # type: ignore
 
 
 
-    if domain.count(".") == 1:
+        mgr = SeleniumManager()
 
 
 
-        for scheme in ("https", "http"):
+        # Try several APIs for broader version compatibility
 
 
 
-            html = _try(f"{scheme}://www.{domain}")
+        try:
 
 
 
-            if html: return html, "success"
+            # Newer API (returns dict)
 
 
 
-    return None, "timeout"
+            res = mgr.binary_paths("chrome")  # type: ignore[attr-defined]
 
 
 
-class SeleniumPool:
+            if isinstance(res, dict):
 
 
 
-    def __init__(self, size: int, proxies: List[str]):
+                p = res.get("browser_path") or res.get("browser")
 
 
 
-        self.size = max(1, size)
+                if p and os.path.exists(p):
 
 
 
-        self.proxies = proxies
+                    return p
 
 
 
-        self.browsers = []
+        except Exception:
 
 
 
-        self.profiles = []
+            pass
 
 
 
-        self.proxy_for_idx: List[Optional[str]] = []
+        try:
 
 
 
-        self.queue: asyncio.Queue[int] = asyncio.Queue()
+            # Older API (returns str)
 
 
 
-    async def start(self):
+            p = mgr.browser_path("chrome")  # type: ignore[attr-defined]
 
 
 
-        for i in range(self.size):
+            if isinstance(p, str) and os.path.exists(p):
 
 
 
-            proxy = self.proxies[i % len(self.proxies)] if self.proxies else None
+                return p
 
 
 
-            prof = Path(tempfile.mkdtemp(prefix=f"sel_prof_{i}_", dir=str(TMP_PROFILE_BASE)))
+        except Exception:
 
 
 
-            self.profiles.append(prof)
+            pass
 
 
 
-            br = await asyncio.to_thread(_new_selenium_browser, prof, proxy)
+    except Exception:
 
 
 
-            self.browsers.append(br)
+        return None
 
 
 
-            self.proxy_for_idx.append(proxy)
+    return None
 
 
 
-            await self.queue.put(i)
+def _detect_chrome_major() -> Optional[int]:
 
 
 
-            await asyncio.sleep(0.1)
+    candidates = ["google-chrome", "google-chrome-stable", "chromium", "chromium-browser"]
 
 
 
-    async def acquire(self) -> int:
+    for binname in candidates:
 
 
 
-        return await self.queue.get()
+        try:
 
 
 
-    async def release(self, idx: int):
+            out = subprocess.check_output([binname, "--version"], text=True, timeout=2)
 
 
 
-        await self.queue.put(idx)
+            m = re.search(r"\b(\d+)\.", out)
 
 
 
-    async def close(self):
+            if m:
 
 
 
-        for br in self.browsers:
+                return int(m.group(1))
 
 
 
-            try:
+        except Exception:
 
 
 
-                await asyncio.to_thread(br.quit)
+            continue
 
 
 
-            except Exception:
+    return None
 
 
 
-                pass
+def _ensure_uc_import():
 
 
 
-        # clean profiles
+    try:
 
 
 
-        for prof in self.profiles:
+        import undetected_chromedriver as uc  # noqa: F401
 
 
 
-            try:
+        return True
 
 
 
-                if prof.exists():
+    except Exception as e:
 
 
 
-                    for p in sorted(prof.glob("**/*"), reverse=True):
+        logger.warning(f"undetected_chromedriver not available: {e}")
 
 
 
-                        try: p.unlink()
+        return False
 
 
 
-                        except IsADirectoryError:
+def _uc_options(profile_dir: Path, binary_path: Optional[str] = None, proxy_url: Optional[str] = None):
 
 
 
-                            try: p.rmdir()
+    import undetected_chromedriver as uc
 
 
 
-                            except Exception: pass
+    opts = uc.ChromeOptions()
 
 
 
-                        except Exception:
+    proxy_arg = proxy_arg_for_browser(proxy_url)
 
 
 
-                            pass
+    if proxy_arg:
 
 
 
-                    try: prof.rmdir()
+        opts.add_argument(f"--proxy-server={proxy_arg}")
 
 
 
-                    except Exception: pass
+        opts.add_argument("--proxy-bypass-list=<-loopback>")
 
 
 
-            except Exception:
+    opts.add_argument("--headless=new")
 
 
 
-                pass
+    opts.add_argument("--no-sandbox")
 
 
 
-        # help OS reclaim memory sooner on constrained hosts
+    opts.add_argument("--disable-dev-shm-usage")
 
 
 
-        try:
+    opts.add_argument("--disable-gpu")
 
 
 
-            gc.collect()
+    opts.add_argument("--window-size=1920,1080")
 
 
 
-        except Exception:
+    opts.add_argument("--disable-extensions")
 
 
 
-            pass
+    opts.add_argument("--disable-notifications")
 
 
 
-# =========================
+    opts.add_argument("--disable-popup-blocking")
 
 
 
-# UC fallback (x86_64 only; optional import)
+    opts.add_argument("--disable-software-rasterizer")
 
 
 
-# =========================
+    opts.add_argument("--disable-logging")
 
 
 
-def _which(cmd: str) -> Optional[str]:
+    opts.add_argument("--log-level=3")
 
 
 
-    """Shallow wrapper around shutil.which for late import contexts."""
+    opts.add_argument("--blink-settings=imagesEnabled=false")
 
 
 
-    try:
+    opts.add_argument("--disable-features=Translate")
 
 
 
-        return shutil.which(cmd)
+    opts.add_argument("--disable-blink-features=AutomationControlled")
 
 
 
-    except Exception:
+    opts.add_argument("--ignore-certificate-errors")
 
 
 
-        return None
+    opts.add_argument("--ignore-ssl-errors")
 
 
 
-def _detect_chrome_binary() -> Optional[str]:
+    opts.add_argument("--remote-debugging-port=0")
 
 
 
-    """Try to locate a Chrome/Chromium binary on Linux.
+    opts.add_argument("--no-first-run")
 
 
 
-    Order: env override -> common names via PATH -> common absolute paths.
+    opts.add_argument("--no-default-browser-check")
 
 
 
-    """
+    opts.add_argument("--lang=en-US,en;q=0.9,ru;q=0.8")
 
 
 
-    # env override (allows user to set CHROME_PATH explicitly)
+    opts.add_argument(f"--user-data-dir={str(profile_dir)}")
 
 
 
-    for key in ("CHROME_PATH", "GOOGLE_CHROME_SHIM", "BROWSER"):
+    opts.add_argument("--profile-directory=Default")
 
 
 
-        p = os.environ.get(key)
+    # If we have a Chrome/Chromium binary, point UC at it explicitly
 
 
 
-        if p and os.path.exists(p):
+    if binary_path:
 
 
 
-            return p
+        try:
 
 
 
-    # common names available in PATH
+            # Ensure string type to satisfy UC/Selenium expectations
 
 
 
-    for name in ("google-chrome", "google-chrome-stable", "chromium", "chromium-browser"):
+            opts.binary_location = str(binary_path)  # type: ignore[attr-defined]
 
 
 
-        p = _which(name)
+        except Exception:
 
 
 
-        if p:
+            pass
 
 
 
-            return p
+    return opts
 
 
 
-    # common absolute locations
+def _new_uc_browser(profile_dir: Path, proxy_url: Optional[str] = None):
 
 
 
-    for p in (
+    import undetected_chromedriver as uc
 
 
 
-        "/usr/bin/google-chrome",
+    last_err = None
 
 
 
-        "/usr/bin/google-chrome-stable",
+    major = _detect_chrome_major()
 
 
 
-        "/usr/bin/chromium",
+    # Try to locate a usable Chrome/Chromium binary; UC is much more reliable with an explicit binary
 
 
 
-        "/usr/bin/chromium-browser",
+    binary = _detect_chrome_binary() or _selenium_manager_find_chrome()
 
 
 
-        "/opt/google/chrome/chrome",
+    for attempt in range(1, 4):
 
 
 
-    ):
+        try:
 
 
 
-        if os.path.exists(p):
+            opts = _uc_options(profile_dir, binary, proxy_url)
 
 
 
-            return p
+            kw = {"options": opts, "headless": True, "use_subprocess": True}
 
 
 
-    return None
+            if major:
 
 
 
-def _selenium_manager_find_chrome() -> Optional[str]:
+                kw["version_main"] = major
 
 
 
-    """Ask Selenium Manager for a Chrome for Testing browser path if available.
+            return uc.Chrome(**kw)
 
 
 
-    Works on Selenium >= 4.11. Falls back silently otherwise.
+        except WebDriverException as e:
 
 
 
-    """
+            last_err = e
 
 
 
-    try:
+            try:
 
 
 
-        # Selenium 4.11+ provides SeleniumManager which can return a browser path
+                cache_dir = Path.home() / ".local" / "share" / "undetected_chromedriver"
 
 
 
-        from selenium.webdriver.common.selenium_manager import SeleniumManager  # type: ignore
+                if cache_dir.exists():
 
 
 
-        mgr = SeleniumManager()
+                    shutil.rmtree(cache_dir, ignore_errors=True)
 
 
 
-        # Try several APIs for broader version compatibility
+            except Exception:
 
 
 
-        try:
+                pass
 
 
 
-            # Newer API (returns dict)
+            time.sleep(0.6 * attempt)
 
 
 
-            res = mgr.binary_paths("chrome")  # type: ignore[attr-defined]
+    # Encourage GC after failed attempts (keeps memory stable on small hosts)
 
 
 
-            if isinstance(res, dict):
+    try:
 
 
 
-                p = res.get("browser_path") or res.get("browser")
+        gc.collect()
 
 
 
-                if p and os.path.exists(p):
+    except Exception:
 
 
 
-                    return p
+        pass
 
 
 
-        except Exception:
+    raise last_err if last_err else RuntimeError("UC launch failed")
 
 
 
-            pass
+class UCPool(BrowserPool):
+    def __init__(self, size: int, proxies: List[str]):
+        super().__init__(
+            _new_uc_browser, size, proxies, profile_base=TMP_PROFILE_BASE, profile_prefix="uc_prof", **fallback_pool_options()
+        )
 
 
 
-        try:
-
-
-
-            # Older API (returns str)
-
-
-
-            p = mgr.browser_path("chrome")  # type: ignore[attr-defined]
-
-
-
-            if isinstance(p, str) and os.path.exists(p):
-
-
-
-                return p
-
-
-
-        except Exception:
-
-
-
-            pass
-
-
-
-    except Exception:
-
-
-
-        return None
-
-
-
-    return None
-
-
-
-def _detect_chrome_major() -> Optional[int]:
-
-
-
-    candidates = ["google-chrome", "google-chrome-stable", "chromium", "chromium-browser"]
-
-
-
-    for binname in candidates:
-
-
-
-        try:
-
-
-
-            out = subprocess.check_output([binname, "--version"], text=True, timeout=2)
-
-
-
-            m = re.search(r"\b(\d+)\.", out)
-
-
-
-            if m:
-
-
-
-                return int(m.group(1))
-
-
-
-        except Exception:
-
-
-
-            continue
-
-
-
-    return None
-
-
-
-def _ensure_uc_import():
-
-
-
-    try:
-
-
-
-        import undetected_chromedriver as uc  # noqa: F401
-
-
-
-        return True
-
-
-
-    except Exception as e:
-
-
-
-        logger.warning(f"undetected_chromedriver not available: {e}")
-
-
-
-        return False
-
-
-
-def _uc_options(profile_dir: Path, binary_path: Optional[str] = None, proxy_url: Optional[str] = None):
-
-
-
-    import undetected_chromedriver as uc
-
-
-
-    opts = uc.ChromeOptions()
-
-
-
-    proxy_arg = proxy_arg_for_browser(proxy_url)
-
-
-
-    if proxy_arg:
-
-
-
-        opts.add_argument(f"--proxy-server={proxy_arg}")
-
-
-
-        opts.add_argument("--proxy-bypass-list=<-loopback>")
-
-
-
-    opts.add_argument("--headless=new")
-
-
-
-    opts.add_argument("--no-sandbox")
-
-
-
-    opts.add_argument("--disable-dev-shm-usage")
-
-
-
-    opts.add_argument("--disable-gpu")
-
-
-
-    opts.add_argument("--window-size=1920,1080")
-
-
-
-    opts.add_argument("--disable-extensions")
-
-
-
-    opts.add_argument("--disable-notifications")
-
-
-
-    opts.add_argument("--disable-popup-blocking")
-
-
-
-    opts.add_argument("--disable-software-rasterizer")
-
-
-
-    opts.add_argument("--disable-logging")
-
-
-
-    opts.add_argument("--log-level=3")
-
-
-
-    opts.add_argument("--blink-settings=imagesEnabled=false")
-
-
-
-    opts.add_argument("--disable-features=Translate")
-
-
-
-    opts.add_argument("--disable-blink-features=AutomationControlled")
-
-
-
-    opts.add_argument("--ignore-certificate-errors")
-
-
-
-    opts.add_argument("--ignore-ssl-errors")
-
-
-
-    opts.add_argument("--remote-debugging-port=0")
-
-
-
-    opts.add_argument("--no-first-run")
-
-
-
-    opts.add_argument("--no-default-browser-check")
-
-
-
-    opts.add_argument("--lang=en-US,en;q=0.9,ru;q=0.8")
-
-
-
-    opts.add_argument(f"--user-data-dir={str(profile_dir)}")
-
-
-
-    opts.add_argument("--profile-directory=Default")
-
-
-
-    # If we have a Chrome/Chromium binary, point UC at it explicitly
-
-
-
-    if binary_path:
-
-
-
-        try:
-
-
-
-            # Ensure string type to satisfy UC/Selenium expectations
-
-
-
-            opts.binary_location = str(binary_path)  # type: ignore[attr-defined]
-
-
-
-        except Exception:
-
-
-
-            pass
-
-
-
-    return opts
-
-
-
-def _new_uc_browser(profile_dir: Path, proxy_url: Optional[str] = None):
-
-
-
-    import undetected_chromedriver as uc
-
-
-
-    last_err = None
-
-
-
-    major = _detect_chrome_major()
-
-
-
-    # Try to locate a usable Chrome/Chromium binary; UC is much more reliable with an explicit binary
-
-
-
-    binary = _detect_chrome_binary() or _selenium_manager_find_chrome()
-
-
-
-    for attempt in range(1, 4):
-
-
-
-        try:
-
-
-
-            opts = _uc_options(profile_dir, binary, proxy_url)
-
-
-
-            kw = {"options": opts, "headless": True, "use_subprocess": True}
-
-
-
-            if major:
-
-
-
-                kw["version_main"] = major
-
-
-
-            return uc.Chrome(**kw)
-
-
-
-        except WebDriverException as e:
-
-
-
-            last_err = e
-
-
-
-            try:
-
-
-
-                cache_dir = Path.home() / ".local" / "share" / "undetected_chromedriver"
-
-
-
-                if cache_dir.exists():
-
-
-
-                    shutil.rmtree(cache_dir, ignore_errors=True)
-
-
-
-            except Exception:
-
-
-
-                pass
-
-
-
-            time.sleep(0.6 * attempt)
-
-
-
-    # Encourage GC after failed attempts (keeps memory stable on small hosts)
-
-
-
-    try:
-
-
-
-        gc.collect()
-
-
-
-    except Exception:
-
-
-
-        pass
-
-
-
-    raise last_err if last_err else RuntimeError("UC launch failed")
-
-
-
-def _uc_fetch_html(br, domain: str) -> Tuple[Optional[str], str]:
-
-
-
-    def _try(url: str) -> Optional[str]:
-
-
-
-        try:
-
-
-
-            br.get(url)
-
-
-
-            WebDriverWait(br, FALLBACK_HTTP_TIMEOUT).until(
-
-
-
-                lambda d: d.execute_script("return document.readyState") in ("interactive", "complete")
-
-
-
-            )
-
-
-
-            time.sleep(1.0)
-
-
-
-            html = br.page_source or ""
-
-
-
-            if len(html.strip()) >= FALLBACK_BODY_MIN:
-
-
-
-                return html
-
-
-
-            return None
-
-
-
-        except TimeoutException:
-
-
-
-            return None
-
-
-
-        except WebDriverException:
-
-
-
-            return None
-
-
-
-    for scheme in ("https", "http"):
-
-
-
-        html = _try(f"{scheme}://{domain}")
-
-
-
-        if html: return html, "success"
-
-
-
-    if domain.count(".") == 1:
-
-
-
-        for scheme in ("https", "http"):
-
-
-
-            html = _try(f"{scheme}://www.{domain}")
-
-
-
-            if html: return html, "success"
-
-
-
-    return None, "timeout"
-
-
-
-class UCPool:
-
-
-
-    def __init__(self, size: int, proxies: List[str]):
-
-
-
-        self.size = max(1, size)
-
-
-
-        self.proxies = proxies
-
-
-
-        self.browsers = []
-
-
-
-        self.profiles = []
-
-
-
-        self.proxy_for_idx: List[Optional[str]] = []
-
-
-
-        self.queue: asyncio.Queue[int] = asyncio.Queue()
-
-
-
-    async def start(self):
-
-
-
-        for i in range(self.size):
-
-
-
-            proxy = self.proxies[i % len(self.proxies)] if self.proxies else None
-
-
-
-            prof = Path(tempfile.mkdtemp(prefix=f"uc_prof_{i}_", dir=str(TMP_PROFILE_BASE)))
-
-
-
-            self.profiles.append(prof)
-
-
-
-            br = await asyncio.to_thread(_new_uc_browser, prof, proxy)
-
-
-
-            self.browsers.append(br)
-
-
-
-            self.proxy_for_idx.append(proxy)
-
-
-
-            await self.queue.put(i)
-
-
-
-            await asyncio.sleep(0.2)
-
-
-
-    async def acquire(self) -> int:
-
-
-
-        return await self.queue.get()
-
-
-
-    async def release(self, idx: int):
-
-
-
-        await self.queue.put(idx)
-
-
-
-    async def close(self):
-
-
-
-        for br in self.browsers:
-
-
-
-            try:
-
-
-
-                await asyncio.to_thread(br.quit)
-
-
-
-            except Exception:
-
-
-
-                pass
-
-
-
-        for prof in self.profiles:
-
-
-
-            try:
-
-
-
-                if prof.exists():
-
-
-
-                    for p in sorted(prof.glob("**/*"), reverse=True):
-
-
-
-                        try: p.unlink()
-
-
-
-                        except IsADirectoryError:
-
-
-
-                            try: p.rmdir()
-
-
-
-                            except Exception: pass
-
-
-
-                        except Exception:
-
-
-
-                            pass
-
-
-
-                    try: prof.rmdir()
-
-
-
-                    except Exception: pass
-
-
-
-            except Exception:
-
-
-
-                pass
-
-
-
-        try:
-
-
-
-            gc.collect()
-
-
-
-        except Exception:
-
-
-
-            pass
-
-
-
-# =========================
-
-
-
-# Pipeline
-
-
-
-# =========================
-
-
-
-timeouts_pending: List[str] = []
-
-
-
-cdn_timeouts_pending: List[str] = []
-
-
-
-async def process_domain(
-
-
-
-    domain: str,
-
-
-
-    proxy_pool: ProxyPool,
-
-
-
-    proxy_assignment: Dict[str, str],
-
-
-
-    fetchers: Dict[str, Fetcher],
-
-
-
-    writer: Writer,
-
-
-
-    fb: FallbackCollector,
-
-
-
-) -> None:
-
-
-
-    attempts: List[Tuple[str, Optional[int], Optional[str], str]] = []
-
-
-
-    preferred_proxy = proxy_assignment.get(domain) or proxy_pool.next_proxy()
-
-
-
-    proxy_chain = proxy_pool.order_from(preferred_proxy)
-
-
-
-    for proxy in proxy_chain:
-
-
-
-        fetcher = fetchers.get(proxy)
-
-
-
-        if fetcher is None:
-
-
-
-            continue
-
-
-
-        await asyncio.sleep(random.uniform(*REQUEST_DELAY_RANGE))
-
-
-
-        html, status_label, http_status, hdrs, err_detail = await fetcher.fetch(domain)
-
-
-
-        if status_label != "success":
-
-
-
-            attempts.append((status_label, http_status, err_detail, proxy))
-
-
-
-            continue
-
-
-
-        try:
-
-
-
-            inactive_reason = detect_inactive(html, http_status or 200)
-
-
-
-            if inactive_reason:
-
-
-
-                await writer.write_line("inactive", domain)
-
-
-
-                print_domain_status(domain, "inactive", details=f"(inactive: {inactive_reason} via {mask_proxy(proxy)})")
-
-
-
-                update_stats("inactive")
-
-
-
-                return
-
-
-
-            total_score, hits_by_cat, title_hits = score_content(html, domain)
-
-
-
-            if total_score >= THRESHOLD_SCORE:
-
-
-
-                await writer.write_line("filtered", domain)
-
-
-
-                sample = ", ".join(sample_matches(html))
-
-
-
-                print_domain_status(domain, "filtered", total_score, f"hits={hits_by_cat} sample=[{sample}] via {mask_proxy(proxy)}")
-
-
-
-                update_stats("filtered")
-
-
-
-            else:
-
-
-
-                await writer.write_line("clean", domain)
-
-
-
-                summary = summarize_clean_page(html)
-
-
-
-                detail = f"{summary} via {mask_proxy(proxy)}" if summary else f"via {mask_proxy(proxy)}"
-
-
-
-                print_domain_status(domain, "clean", total_score, detail)
-
-
-
-                update_stats("clean")
-
-
-
-            return
-
-
-
-        except Exception as e:
-
-
-
-            attempts.append(("error", http_status, str(e), proxy))
-
-
-
-    if not attempts:
-
-
-
-        await writer.write_line("error", domain)
-
-
-
-        print_domain_status(domain, "error", details="No proxy attempts executed")
-
-
-
-        update_stats("error")
-
-
-
-        return
-
-
-
-    final_status = None
-
-
-
-    final_http: Optional[int] = None
-
-
-
-    final_err: Optional[str] = None
-
-
-
-    final_proxy = None
-
-
-
-    for pref in FAILOVER_STATUS_PREFERENCE:
-
-
-
-        for status_label, http_status, err_detail, proxy in attempts:
-
-
-
-            if status_label == pref:
-
-
-
-                final_status, final_http, final_err, final_proxy = status_label, http_status, err_detail, proxy
-
-
-
-                break
-
-
-
-        if final_status:
-
-
-
-            break
-
-
-
-    if final_status is None:
-
-
-
-        final_status, final_http, final_err, final_proxy = attempts[-1]
-
-
-
-    detail_parts: List[str] = []
-
-
-
-    if final_http is not None:
-
-
-
-        detail_parts.append(f"(HTTP {final_http})")
-
-
-
-    if final_err:
-
-
-
-        sr = short_reason(final_err)
-
-
-
-        detail_parts.append(f"[{sr}]" if sr else f"[{final_err}]")
-
-
-
-    if final_proxy:
-
-
-
-        detail_parts.append(f"via {mask_proxy(final_proxy)}")
-
-
-
-    detail = " ".join(detail_parts)
-
-
-
-    if final_status == "connection_error" and final_err:
-
-
-
-        try:
-
-
-
-            with open(CONN_ERR_DETAIL_FILE, "a", encoding="utf-8") as f:
-
-
-
-                f.write(f"{domain} | {short_reason(final_err)} | {final_err}\\n")
-
-
-
-        except Exception:
-
-
-
-            pass
-
-
-
-    print_domain_status(domain, final_status, details=detail)
-
-
-
-    await writer.write_line(final_status, domain)
-
-
-
-    update_stats(final_status)
-
-
-
-    if final_status in ("cloudflare", "timeout", CDN_TIMEOUT_LABEL, "connection_error", "ssl_error"):
-
-
-
-        await fb.add(final_status, domain)
-
-
-
-async def fallback_process_domain(domain: str, engine: str, pool, writer: Writer):
-
-
-
-    idx = await pool.acquire()
-
-
-
-    br = pool.browsers[idx]
-
-
-
-    proxy_used = None
-
-
-
-    if getattr(pool, "proxy_for_idx", None) and idx < len(pool.proxy_for_idx):
-
-
-
-        proxy_used = pool.proxy_for_idx[idx]
-
-
-
-    try:
-
-
-
-        if engine == "selenium":
-
-
-
-            html, status_label = await asyncio.to_thread(_selenium_fetch_html, br, domain)
-
-
-
-        else:
-
-
-
-            html, status_label = await asyncio.to_thread(_uc_fetch_html, br, domain)
-
-
-
-        if status_label != "success" or not html:
-
-
-
-            print_domain_status(domain, "error", details=f"(FALLBACK_UNAVAIL via {mask_proxy(proxy_used)} )" if proxy_used else "(FALLBACK_UNAVAIL)")
-
-
-
-            return
-
-
-
-        inactive_reason = detect_inactive(html, 200)
-
-
-
-        if inactive_reason:
-
-
-
-            await writer.write_line("inactive", domain)
-
-
-
-            print_domain_status(domain, "inactive", details=f"(FB inactive: {inactive_reason} via {mask_proxy(proxy_used)})" if proxy_used else f"(FB inactive: {inactive_reason})")
-
-
-
-            update_stats("inactive")
-
-
-
-            return
-
-
-
-        total_score, hits_by_cat, title_hits = score_content(html, domain)
-
-
-
-        if total_score >= THRESHOLD_SCORE:
-
-
-
-            await writer.write_line("filtered", domain)
-
-
-
-            sample = ", ".join(sample_matches(html))
-
-
-
-            print_domain_status(domain, "filtered", total_score, f"(FB via {mask_proxy(proxy_used)}) hits={hits_by_cat} sample=[{sample}]" if proxy_used else f"(FB) hits={hits_by_cat} sample=[{sample}]")
-
-
-
-            update_stats("filtered")
-
-
-
-        else:
-
-
-
-            await writer.write_line("clean", domain)
-
-
-
-            summary = summarize_clean_page(html)
-
-
-
-            print_domain_status(domain, "clean", total_score, f"{summary} (FB via {mask_proxy(proxy_used)})" if summary and proxy_used else (f"(FB via {mask_proxy(proxy_used)})" if proxy_used else (f"{summary} (FB)" if summary else "(FB)")))
-
-
-
-            update_stats("clean")
-
-
-
-        stats['fallback_processed'] += 1
-
-
-
-    except Exception as e:
-
-
-
-        print_domain_status(domain, "error", details=f"(FB) Exception: {str(e)[:50]}")
-
-
-
-        update_stats("error")
-
-
-
-    finally:
-
-
-
-        await pool.release(idx)
-
-
-
-# =========================
-
-
-
-# Preflight
-
-
-
-# =========================
-
-
-
-def check_py_version():
-
-
-
-    v = sys.version_info
-
-
-
-    if (v.major, v.minor) not in SUPPORTED_PY:
-
-
-
-        raise RuntimeError(f"Unsupported Python {v.major}.{v.minor}. Supported: {SUPPORTED_PY_STR}")
-
-
-
-def check_ulimit():
-
-
-
-    try:
-
-
-
-        out = subprocess.check_output(["bash", "-lc", "ulimit -n"], text=True, timeout=3).strip()
-
-
-
-        val = int(out)
-
-
-
-        if val < 8192:
-
-
-
-            logger.warning(f"Open file limit is low: {val}. Recommend: ulimit -n 65535")
-
-
-
-    except Exception:
-
-
-
-        pass
-
-
-
-def check_input_output():
-
-
-
-    if not os.path.exists(INPUT_FILE):
-
-
-
-        raise FileNotFoundError(f"INPUT_FILE not found: {INPUT_FILE}")
-
-
-
-    with open(INPUT_FILE, "r", encoding="utf-8") as f:
-
-
-
-        _ = f.readline()
-
-
-
-    for k, fn in OUT_FILES.items():
-
-
-
-        with open(fn, "a", encoding="utf-8") as f:
-
-
-
-            pass
-
-
-
-    with open(CONN_ERR_DETAIL_FILE, "a", encoding="utf-8") as f:
-
-
-
-        pass
-
-
-
-async def smoke_aiohttp():
-
-
-
-    timeout = ClientTimeout(total=6, connect=3, sock_read=3)
-
-
-
-    async with aiohttp.ClientSession(timeout=timeout) as s:
-
-
-
-        async with s.get("https://example.com", allow_redirects=True) as r:
-
-
-
-            if r.status >= 400:
-
-
-
-                raise RuntimeError(f"aiohttp smoke: HTTP {r.status}")
-
-
-
-            _ = await r.text()
-
-
-
-    logger.info(f"{Fore.GREEN}aiohttp OK{Style.RESET_ALL}")
-
-
-
-def smoke_selenium_sync():
-
-
-
-    prof = Path(tempfile.mkdtemp(prefix="sel_smoke_", dir=str(TMP_PROFILE_BASE)))
-
-
-
-    br = None
-
-
-
-    try:
-
-
-
-        br = _new_selenium_browser(prof, None)
-
-
-
-        br.get("https://example.com")
-
-
-
-        WebDriverWait(br, 10).until(lambda d: d.execute_script("return document.readyState") in ("interactive","complete"))
-
-
-
-        html = br.page_source or ""
-
-
-
-        if len(html) < 100:
-
-
-
-            raise RuntimeError("Selenium smoke: short HTML")
-
-
-
-        logger.info(f"{Fore.GREEN}Selenium Chrome OK (Chrome for Testing via Selenium Manager){Style.RESET_ALL}")
-
-
-
-    finally:
-
-
-
-        try:
-
-
-
-            if br: br.quit()
-
-
-
-        except Exception:
-
-
-
-            pass
-
-
-
-        # cleanup profile
-
-
-
-        try:
-
-
-
-            if prof.exists():
-
-
-
-                for p in sorted(prof.glob("**/*"), reverse=True):
-
-
-
-                    try: p.unlink()
-
-
-
-                    except IsADirectoryError:
-
-
-
-                        try: p.rmdir()
-
-
-
-                        except Exception: pass
-
-
-
-                    except Exception:
-
-
-
-                        pass
-
-
-
-                try: prof.rmdir()
-
-
-
-                except Exception: pass
-
-
-
-        except Exception:
-
-
-
-            pass
-
-
-
-def smoke_uc_sync_if_x86():
-
-
-
-    if IS_ARM:
-
-
-
-        return
-
-
-
-    if not _ensure_uc_import():
-
-
-
-        raise RuntimeError("undetected_chromedriver missing on x86_64")
-
-
-
-    # Try launching UC once
-
-
-
-    prof = Path(tempfile.mkdtemp(prefix="uc_smoke_", dir=str(TMP_PROFILE_BASE)))
-
-
-
-    br = None
-
-
-
-    try:
-
-
-
-        br = _new_uc_browser(prof, None)
-
-
-
-        br.get("https://example.com")
-
-
-
-        WebDriverWait(br, 10).until(lambda d: d.execute_script("return document.readyState") in ("interactive","complete"))
-
-
-
-        html = br.page_source or ""
-
-
-
-        if len(html) < 100:
-
-
-
-            raise RuntimeError("UC smoke: short HTML")
-
-
-
-        logger.info(f"{Fore.GREEN}UC Chrome OK (x86_64){Style.RESET_ALL}")
-
-
-
-    finally:
-
-
-
-        try:
-
-
-
-            if br: br.quit()
-
-
-
-        except Exception:
-
-
-
-            pass
-
-
-
-        try:
-
-
-
-            if prof.exists():
-
-
-
-                for p in sorted(prof.glob("**/*"), reverse=True):
-
-
-
-                    try: p.unlink()
-
-
-
-                    except IsADirectoryError:
-
-
-
-                        try: p.rmdir()
-
-
-
-                        except Exception: pass
-
-
-
-                    except Exception:
-
-
-
-                        pass
-
-
-
-                try: prof.rmdir()
-
-
-
-                except Exception: pass
-
-
-
-        except Exception:
-
-
-
-            pass
-
-
-
-async def preflight():
-
-
-
-    logger.info(f"{Fore.CYAN}Running preflight checks...{Style.RESET_ALL}")
-
-
-
-    check_py_version()
-
-
-
-    check_ulimit()
-
-
-
-    check_input_output()
-
-
-
-    await smoke_aiohttp()
+# =========================
 
 
 
-    # Browser smoke: on x86 prefer UC, but if UC fails try Selenium CfT
+# Pipeline
 
 
 
-    if IS_ARM:
+# =========================
 
 
 
-        await asyncio.to_thread(smoke_selenium_sync)
+class ProxiedFetcher:
+    """Fetcher-compatible client for rescue tiers that must not bypass the proxies.
 
+    Holds one Fetcher per proxy with the tier's timeouts and sends every domain through the
+    fast pass's ProxyPool rotation and proxy hedging; outcomes feed the same proxy health.
+    """
 
+    def __init__(self, proxy_pool: ProxyPool, limiter: PolitenessLimiter, *, concurrency: int, tries: int = CDN_DIRECT_PROXY_TRIES, **fetcher_opts):
+        self.proxy_pool = proxy_pool
+        self.limiter = limiter
+        self.tries = max(1, tries)
+        per_proxy = max(1, -(-concurrency // len(proxy_pool.proxies)))
+        self.fetchers: Dict[str, Fetcher] = {}
+        for proxy in proxy_pool.proxies:
+            try:
+                self.fetchers[proxy] = Fetcher(concurrency=per_proxy, proxy_url=proxy, **fetcher_opts)
+            except Exception as e:
+                print_status(f"? Skipping proxy {mask_proxy(proxy)}: {e}", "warning")
+        if not self.fetchers:
+            raise RuntimeError("no valid proxies")
+
+    async def _attempt(self, proxy: str, domain: str):
+        # -> (result, proxy); result is None if the proxy was not used.
+        fetcher = self.fetchers.get(proxy)
+        if fetcher is None or not self.proxy_pool.begin_attempt(proxy):
+            return None, proxy
+        await self.limiter.acquire(proxy, None)
+        started = time.monotonic()
+        result = await fetcher.fetch(domain)
+        self.proxy_pool.record(proxy, result[1], result[2], time.monotonic() - started)
+        return result, proxy
+
+    async def fetch(self, domain: str) -> Tuple[Optional[str], str, Optional[int], Optional[Dict[str, str]], Optional[str], Optional[str]]:
+        chain = self.proxy_pool.order_from(self.proxy_pool.pick(None))[:self.tries]
+        winner, failures = await hedge_race(
+            [functools.partial(self._attempt, proxy, domain) for proxy in chain],
+            lambda outcome: outcome[0] is not None and outcome[0][1] == "success",
+            HEDGE_PROXY_DELAY_SEC,
+            HEDGE_MAX_PARALLEL,
+        )
+        tried = [(result, proxy) for result, proxy in failures if result is not None]
+        if winner is not None:
+            for result, proxy in tried:
+                if is_target_failure(result[1], result[2]):
+                    self.proxy_pool.blame(proxy)
+            return winner[0]
+        if not tried:
+            return None, "proxy_error", None, None, "no proxy available", None
+        return min((result for result, _ in tried), key=lambda result: failure_rank(result[1]))
+
+    async def close(self) -> None:
+        await asyncio.gather(*(f.close() for f in self.fetchers.values()), return_exceptions=True)
+
+
+def build_rescue_tiers(proxies: List[str]) -> List[Dict[str, Any]]:
+    """Rescue tiers in routing order; read at call time so CLI overrides apply.
+
+    A domain leaving the fast pass (or an earlier tier) with one of a tier's
+    ``accepts`` labels is queued there straight away. Hand-off tiers own the
+    final verdict; the others (browser) run on top of the label already written.
+    """
+    return [
+        {
+            "name": "Timeout rescue",
+            "tag": "R",
+            "kind": "http",
+            "enabled": USE_RESCUE_STAGE,
+            "accepts": ("timeout",),
+            "hand_off": True,
+            "concurrency": RESCUE_CONCURRENCY,
+            "fetcher": dict(
+                concurrency=RESCUE_CONCURRENCY,
+                total_timeout=RESCUE_TOTAL_TIMEOUT,
+                connect_timeout=RESCUE_CONNECT_TIMEOUT,
+                read_timeout=RESCUE_READ_TIMEOUT,
+                force_ipv4=RESCUE_FORCE_IPV4,
+                ttl_dns_cache=60,
+            ),
+            "final_labels": {},
+        },
+        {
+            "name": "CDN rescue",
+            "tag": "CDN",
+            "kind": "http",
+            "enabled": USE_RESCUE_STAGE,
+            "accepts": (CDN_TIMEOUT_LABEL,),
+            "hand_off": True,
+            "concurrency": CDN_RESCUE_CONCURRENCY,
+            "fetcher": dict(
+                concurrency=CDN_RESCUE_CONCURRENCY,
+                total_timeout=CDN_TOTAL_TIMEOUT,
+                connect_timeout=CDN_CONNECT_TIMEOUT,
+                read_timeout=CDN_READ_TIMEOUT,
+                force_ipv4=RESCUE_FORCE_IPV4,
+                ttl_dns_cache=120,
+            ),
+            # A CDN-throttled host that still times out stays a CDN timeout
+            "final_labels": {"timeout": CDN_TIMEOUT_LABEL},
+        },
+        {
+            # Domains routed by address before any fetch, still through the proxy rotation (ProxiedFetcher);
+            # cloudflare verdicts continue to the browser tier
+            "name": "CDN direct",
+            "tag": "CDN-IP",
+            "kind": "http",
+            "enabled": CDN_RANGE_ROUTING,
+            "accepts": (CDN_RANGE_LABEL,),
+            "hand_off": True,
+            "via_proxies": True,
+            "concurrency": CDN_DIRECT_CONCURRENCY,
+            "fetcher": dict(
+                concurrency=CDN_DIRECT_CONCURRENCY,
+                total_timeout=CDN_TOTAL_TIMEOUT,
+                connect_timeout=CDN_CONNECT_TIMEOUT,
+                read_timeout=CDN_READ_TIMEOUT,
+                force_ipv4=RESCUE_FORCE_IPV4,
+                ttl_dns_cache=120,
+            ),
+            "final_labels": {"timeout": CDN_TIMEOUT_LABEL},
+        },
+        {
+            "name": "Browser fallback",
+            "tag": "FB",
+            "kind": "browser",
+            "enabled": ENABLE_BROWSER_FALLBACK,
+            "accepts": ("cloudflare",),
+            "hand_off": False,
+            "concurrency": max(1, min(FALLBACK_MAX_BROWSERS, len(proxies))),
+        },
+    ]
+
+
+class RescueTier:
+    # Runtime state of one declared tier
+    def __init__(self, index: int, spec: Dict[str, Any]):
+        self.index = index
+        self.spec = spec
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.seen: Set[str] = set()
+        self.client = None
+        self.task: Optional[asyncio.Task] = None
+        self.failed = False
+        self.routed = 0
+        self.done = 0
+        self.skipped = 0
+        self.past_deadline = 0  # queued domains not started because the --deadline budget ran out
+        self.client_report: Optional[str] = None
+        self.verdicts: Dict[str, int] = {}
+        self.first_at: Optional[float] = None
+        self.last_at: Optional[float] = None
+
+
+class RescueRouter:
+    """Moves domains into rescue tiers as soon as their fast-pass attempt ends.
+
+    Every tier has its own queue, client and worker budget, started on the
+    first domain routed to it, so all tiers run alongside the fast pass.
+    Domains only move forward through the tier list, which keeps routing
+    loop-free and lets ``drain`` join the queues in order.
+    """
 
-    else:
+    def __init__(
+        self,
+        specs: List[Dict[str, Any]],
+        proxies: List[str],
+        writer: Writer,
+        limiter: PolitenessLimiter,
+        proxy_pool: Optional[ProxyPool] = None,
+    ):
+        self.tiers = [RescueTier(i, spec) for i, spec in enumerate(specs)]
+        self.proxies = proxies
+        self.proxy_pool = proxy_pool
+        self.writer = writer
+        self.limiter = limiter
+        # Set by main for --deadline runs: past the hard end, queued hand-off domains are carried over
+        self.deadline: Optional[Deadline] = None
+        self.carry: Optional[CarryOver] = None
+        # Set by main for --record-corpus
+        self.corpus: Optional[ResponseCorpus] = None
+
+    def route(self, label: str, domain: str, after: int = -1) -> bool:
+        # Queue the domain in the first enabled tier past `after` that accepts the label.
+        # True means that tier now owns the verdict and the caller must not write it.
+        for tier in self.tiers[after + 1:]:
+            if label not in tier.spec["accepts"]:
+                continue
+            if not tier.spec["enabled"]:
+                tier.skipped += 1
+                continue
+            if domain not in tier.seen:
+                tier.seen.add(domain)
+                tier.routed += 1
+                if tier.task is None:
+                    tier.task = asyncio.create_task(self._run_tier(tier))
+                tier.queue.put_nowait((domain, label))
+            return tier.spec["hand_off"]
+        return False
 
+    def pending(self) -> int:
+        return sum(t.routed - t.done for t in self.tiers)
 
+    async def drain(self):
+        # Earlier tiers feed later ones only, so joining in order waits for everything
+        for tier in self.tiers:
+            await tier.queue.join()
 
+    async def close(self):
+        for tier in self.tiers:
+            if tier.task is not None:
+                tier.task.cancel()
+                with contextlib.suppress(asyncio.CancelledError):
+                    await tier.task
+            if tier.client is not None:
+                if isinstance(tier.client, BrowserPool):
+                    tier.client_report = tier.client.report_line()
+                with contextlib.suppress(Exception):
+                    await tier.client.close()
+                tier.client = None
+
+    async def _run_tier(self, tier: RescueTier):
+        spec = tier.spec
+        print_status(f"🛟 {spec['name']} tier started ({spec['concurrency']} slots)", "progress")
         try:
-
-
-
-            await asyncio.to_thread(smoke_uc_sync_if_x86)
-
-
-
+            if spec["kind"] == "browser":
+                pool_cls = SeleniumPool if IS_ARM else UCPool
+                tier.client = pool_cls(spec["concurrency"], self.proxies)
+                await tier.client.start()
+            elif spec.get("via_proxies"):
+                proxy_pool = self.proxy_pool or ProxyPool(self.proxies, health_file=None)
+                tier.client = ProxiedFetcher(proxy_pool, self.limiter, **spec["fetcher"])
+            else:
+                tier.client = Fetcher(**spec["fetcher"])
         except Exception as e:
+            # Keep consuming so drain() finishes; hand-off domains fall back to their fast-pass label
+            print_status(f"🛟 {spec['name']} tier unavailable: {e}", "error")
+            tier.failed = True
+        workers = 1 if tier.failed else spec["concurrency"]
+        await asyncio.gather(*(self._tier_worker(tier) for _ in range(workers)))
+
+    async def _tier_worker(self, tier: RescueTier):
+        spec = tier.spec
+        while True:
+            domain, label = await tier.queue.get()
+            now = time.monotonic()
+            if tier.first_at is None:
+                tier.first_at = now
+            try:
+                if self.deadline is not None and self.deadline.expired():
+                    if spec["hand_off"] and self.carry is not None:
+                        self.carry.add(domain)
+                    tier.past_deadline += 1
+                elif tier.failed:
+                    if spec["hand_off"]:
+                        await self._finish(tier, label if label in OUT_FILES else "error", domain)
+                elif spec["kind"] == "browser":
+                    await self.limiter.acquire(None, domain)
+                    await fallback_process_domain(domain, tier.client, self.writer, self.corpus)
+                else:
+                    await self.limiter.acquire(None, domain)
+                    await self._http_rescue(tier, domain)
+            except Exception as e:
+                print_domain_status(domain, "error", details=f"({spec['tag']}) Exception: {str(e)[:50]}")
+                if spec["hand_off"]:
+                    await self._finish(tier, "error", domain)
+            finally:
+                tier.done += 1
+                tier.last_at = time.monotonic()
+                tier.queue.task_done()
+
+    async def _finish(self, tier: RescueTier, label: str, domain: str):
+        tier.verdicts[label] = tier.verdicts.get(label, 0) + 1
+        await self.writer.write_line(label, domain)
+        update_stats(label)
+
+    async def _http_rescue(self, tier: RescueTier, domain: str):
+        tag = tier.spec["tag"]
+        html, label, http_status, hdrs, err_detail, final_url = await tier.client.fetch(domain)
+        label = tier.spec["final_labels"].get(label, label)
+        if label == "success":
+
+            def _record(verdict: str, score: float) -> None:
+                if self.corpus is not None:
+                    self.corpus.record(domain, final_url, http_status, hdrs, html, verdict, score, tier=tag)
+
+            target, cached = lookup_redirect_verdict(domain, final_url, http_status)
+            if cached is not None:
+                verdict, total_score = cached
+                _record(verdict, total_score)
+                await self._finish(tier, verdict, domain)
+                print_domain_status(domain, verdict, None if verdict == "inactive" else total_score, f"({tag}) (→ {target}, cached verdict)")
+                return
+            try:
+                inactive_reason = detect_inactive(html, http_status or 200)
+                if inactive_reason:
+                    remember_redirect_verdict(domain, target, "inactive", 0.0, http_status)
+                    _record("inactive", 0.0)
+                    await self._finish(tier, "inactive", domain)
+                    print_domain_status(domain, "inactive", details=f"({tag}) reason={inactive_reason}")
+                    return
+                total_score, hits_by_cat, title_hits = score_content(html, domain)
+            except Exception as e:
+                await self._finish(tier, "error", domain)
+                print_domain_status(domain, "error", details=f"({tag}) analyze error: {str(e)[:50]}")
+                return
+            remember_redirect_verdict(domain, target, "filtered" if total_score >= THRESHOLD_SCORE else "clean", total_score, http_status)
+            _record("filtered" if total_score >= THRESHOLD_SCORE else "clean", total_score)
+            if total_score >= THRESHOLD_SCORE:
+                await self._finish(tier, "filtered", domain)
+                sample = ", ".join(sample_matches(html))
+                print_domain_status(domain, "filtered", total_score, f"({tag}) hits={hits_by_cat} title={title_hits} sample=[{sample}]")
+            else:
+                await self._finish(tier, "clean", domain)
+                summary = summarize_clean_page(html)
+                print_domain_status(domain, "clean", total_score, f"{summary} ({tag})" if summary else f"({tag})")
+            return
 
+        if label not in OUT_FILES:
+            label = "connection_error" if label == "proxy_error" else "error"
+        reason = short_reason(err_detail or "")
+        if self.route(label, domain, tier.index):
+            print_domain_status(domain, label, details=f"({tag}) -> rescue")
+            return
+        if label == "connection_error":
+            log_connection_error_detail(domain, reason, err_detail or "")
+        await self._finish(tier, label, domain)
+        print_domain_status(domain, label, details=f"({tag}) [{reason}]" if reason else f"({tag})")
+
+    def report_lines(self) -> List[Tuple[str, str]]:
+        lines = []
+        for tier in self.tiers:
+            name = tier.spec["name"]
+            if not tier.spec["enabled"]:
+                if tier.skipped:
+                    lines.append((f"🛟 {name} disabled; skipped {tier.skipped:,} domains", "warning"))
+                continue
+            if not tier.routed:
+                continue
+            active = (tier.last_at or tier.first_at or 0) - (tier.first_at or 0)
+            verdicts = ", ".join(f"{k} {v:,}" for k, v in sorted(tier.verdicts.items(), key=lambda kv: -kv[1]))
+            lines.append((
+                f"🛟 {name}: {tier.routed:,} routed, {tier.done:,} done in {active:.0f}s"
+                + (f" ({verdicts})" if verdicts else "")
+                + (f"; {tier.past_deadline:,} not started before the deadline" if tier.past_deadline else ""),
+                "info",
+            ))
+            if tier.client_report:
+                lines.append((tier.client_report, "info"))
+        return lines
 
 
-            logger.warning(f"UC smoke failed: {e}. Trying Selenium as fallback...")
-
-
-
-            await asyncio.to_thread(smoke_selenium_sync)
-
-
-
-    logger.info(f"{Fore.GREEN}Preflight passed ✓{Style.RESET_ALL}")
-
-
-
-# =========================
-
-
-
-# Main
-
-
-
-# =========================
-
-
+async def process_domain(
 
-async def main(no_qc: bool = False, monitor_interval: Optional[float] = None):
-    # Orchestrates fast pass, rescue, optional fallback, and final merge.
 
 
+    domain: str,
 
-    start_time = time.time()
 
 
+    proxy_pool: ProxyPool,
 
-    print_header()
 
 
+    preferred_proxy: Optional[str],
 
-    # uvloop if present
 
 
+    fetchers: Dict[str, Fetcher],
 
-    try:
 
 
+    writer: Writer,
 
-        import uvloop
 
 
+    router: "RescueRouter",
 
-        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
 
 
+    limiter: PolitenessLimiter,
+    breaker: HostBreaker,
+    corpus: Optional[ResponseCorpus] = None,
+) -> str:
 
-        print_status("⚡ Using uvloop for enhanced performance", "success")
 
 
+    attempts: List[Tuple[str, Optional[int], Optional[str], Optional[str]]] = []
+    budget = DomainBudget(DOMAIN_DEADLINE_SEC, DOMAIN_ATTEMPT_BUDGET)
+    host = normalize_host(domain)
+    preferred_proxy = proxy_pool.pick(preferred_proxy)
 
-    except Exception:
 
 
+    proxy_chain = proxy_pool.order_from(preferred_proxy)
 
-        print_status("ℹ️  Using default event loop", "info")
 
 
+    async def _attempt(proxy: str):
+        # One fetch through one proxy -> (result, proxy); result is None if the proxy was not used.
+        if not breaker.allow(host):
+            label, http_status, err_detail = breaker.last_failure(host)
+            return (None, label, http_status, None, err_detail, None), None
+        fetcher = fetchers.get(proxy)
 
-    # Check input file
 
 
+        if budget.exhausted() or fetcher is None or not proxy_pool.begin_attempt(proxy):
 
-    if not Path(INPUT_FILE).exists():
 
 
+            return None, proxy
 
-        print_status(f"❌ Input file not found: {INPUT_FILE}", "error")
 
 
+        await limiter.acquire(proxy, domain)
 
-        return
 
 
+        started = time.monotonic()
+        result = await fetcher.fetch(domain, budget)
+        proxy_pool.record(proxy, result[1], result[2], time.monotonic() - started)
+        breaker.record(host, result[1], result[2], result[4])
+        return result, proxy
 
-    print_status(f"📂 Loading domains from {INPUT_FILE}...", "progress")
+    winner, failures = await hedge_race(
+        [functools.partial(_attempt, proxy) for proxy in proxy_chain],
+        lambda outcome: outcome[0] is not None and outcome[0][1] == "success",
+        HEDGE_PROXY_DELAY_SEC,
+        HEDGE_MAX_PARALLEL,
+    )
+    for result, proxy in failures:
+        if result is not None:
+            attempts.append((result[1], result[2], result[4], proxy))
+            if winner is not None and proxy is not None and is_target_failure(result[1], result[2]):
+                proxy_pool.blame(proxy)
+    if winner is None and budget.exhausted():
+        update_stats("budget_exhausted")
+    if winner is not None:
+        (html, status_label, http_status, hdrs, err_detail, final_url), proxy = winner
+        try:
 
 
 
-    with open(INPUT_FILE, "r", encoding="utf-8") as f:
+            target, cached = lookup_redirect_verdict(domain, final_url, http_status)
+            if cached is not None:
+                verdict, total_score = cached
+                if corpus is not None:
+                    corpus.record(domain, final_url, http_status, hdrs, html, verdict, total_score, proxy)
+                await writer.write_line(verdict, domain)
+                print_domain_status(
+                    domain, verdict, None if verdict == "inactive" else total_score,
+                    f"(→ {target}, cached verdict) via {mask_proxy(proxy)}",
+                )
+                update_stats(verdict)
+                return verdict
+            verdict, total_score, inactive_reason, hits_by_cat = classify_page(html, http_status or 200, domain)
+            remember_redirect_verdict(domain, target, verdict, total_score, http_status)
+            if corpus is not None:
+                corpus.record(domain, final_url, http_status, hdrs, html, verdict, total_score, proxy)
+            if verdict == "inactive":
+                await writer.write_line("inactive", domain)
 
 
 
-        domains = [ln.strip().lower() for ln in f if ln.strip()]
+                print_domain_status(domain, "inactive", details=f"(inactive: {inactive_reason} via {mask_proxy(proxy)})")
 
 
 
-    domains = list(dict.fromkeys(domains))
+                update_stats("inactive")
 
 
 
-    domains = prioritize_domains(domains)
+                return "inactive"
 
 
 
-    proxies = load_proxies(PROXY_FILE)
+            if verdict == "filtered":
 
 
 
-    if not proxies:
+                await writer.write_line("filtered", domain)
 
 
 
-        print_status(f"? No proxies found in {PROXY_FILE}", "error")
+                sample = ", ".join(sample_matches(html))
 
 
 
-        return
+                print_domain_status(domain, "filtered", total_score, f"hits={hits_by_cat} sample=[{sample}] via {mask_proxy(proxy)}")
 
 
 
-    proxy_pool = ProxyPool(proxies)
+                update_stats("filtered")
 
 
 
-    proxy_assignment = {dom: proxy_pool.next_proxy() for dom in domains}
+            else:
 
 
 
-    overall_concurrency, per_proxy_concurrency = compute_concurrency_limits(len(proxies))
+                await writer.write_line("clean", domain)
 
 
 
-    stats['total'] = len(domains)
+                summary = summarize_clean_page(html)
 
 
 
-    print_status(f"?? Loaded {len(proxies)} proxies from {PROXY_FILE}", "info")
+                detail = f"{summary} via {mask_proxy(proxy)}" if summary else f"via {mask_proxy(proxy)}"
 
 
 
-    print_status(f"📊 Total domains to process: {stats['total']:,}", "info")
+                print_domain_status(domain, "clean", total_score, detail)
 
 
 
-    print_status(f"🔧 Configuration: {overall_concurrency} concurrent overall, {per_proxy_concurrency} per proxy", "info")
+                update_stats("clean")
 
 
 
-    print()
+            return verdict
 
 
 
-    # Setup output files
+        except Exception as e:
 
 
 
-    print_status("📁 Setting up output files...", "progress")
+            attempts.append(("error", http_status, str(e), proxy))
 
 
 
-    for fn in OUT_FILES.values():
+    if not attempts:
 
 
 
-        Path(fn).write_text("", encoding="utf-8")
+        await writer.write_line("error", domain)
 
 
 
-    Path(CONN_ERR_DETAIL_FILE).write_text("", encoding="utf-8")
+        print_domain_status(domain, "error", details="No proxy attempts executed")
 
 
 
-    Path(FINAL_OUTPUT_FILE).write_text("", encoding="utf-8")
+        update_stats("error")
 
 
 
-    print_status("?? Output files:", "info")
+        return "error"
 
 
 
-    for category, filename in OUT_FILES.items():
+    final_status = None
 
 
 
-        print_status(f"   {category}: {filename}", "info")
+    final_http: Optional[int] = None
 
 
 
-    print_status(f"   combined: {FINAL_OUTPUT_FILE}", "info")
+    final_err: Optional[str] = None
 
 
 
-    print()
+    final_proxy = None
 
 
 
-    fetchers: Dict[str, Fetcher] = {}
+    for pref in FAILOVER_STATUS_PREFERENCE:
 
 
 
-    for proxy in proxies:
+        for status_label, http_status, err_detail, proxy in attempts:
 
 
 
-        try:
+            if status_label == pref:
 
 
 
-            fetchers[proxy] = Fetcher(concurrency=per_proxy_concurrency, proxy_url=proxy, ttl_dns_cache=120)
+                final_status, final_http, final_err, final_proxy = status_label, http_status, err_detail, proxy
 
 
 
-        except Exception as e:
+                break
 
 
 
-            print_status(f"? Skipping proxy {mask_proxy(proxy)}: {e}", "warning")
+        if final_status:
 
 
 
-    if not fetchers:
+            break
 
 
 
-        print_status("? No valid proxies after initialization", "error")
+    if final_status is None:
 
 
 
-        return
+        final_status, final_http, final_err, final_proxy = attempts[-1]
+    if final_status == "proxy_error":
+        # Only proxies failed; the site itself is untested, so leave it to the rescue passes.
+        final_status = "connection_error"
 
 
 
-    if len(fetchers) != len(proxies):
+    detail_parts: List[str] = []
 
 
 
-        overall_concurrency, per_proxy_concurrency = compute_concurrency_limits(len(fetchers))
+    if final_http is not None:
 
 
 
-    writer = Writer()
+        detail_parts.append(f"(HTTP {final_http})")
 
 
 
-    fb = FallbackCollector()
+    if final_err:
 
 
 
-    monitor_task: Optional[asyncio.Task] = None
+        sr = short_reason(final_err)
 
 
 
-    if monitor_interval:
+        detail_parts.append(f"[{sr}]" if sr else f"[{final_err}]")
 
 
 
-        if psutil is None:
+    if final_proxy:
 
 
 
-            print_status("psutil not available; memory monitor disabled", "warning")
+        detail_parts.append(f"via {mask_proxy(final_proxy)}")
 
 
 
-        else:
+    detail = " ".join(detail_parts)
 
 
 
-            monitor_task = asyncio.create_task(memory_monitor(monitor_interval))
+    if final_status == "connection_error" and final_err:
 
 
 
-    await writer.start()
+        log_connection_error_detail(domain, short_reason(final_err), final_err)
 
 
 
-    sem = asyncio.Semaphore(overall_concurrency)
+    if final_status in ("cloudflare", CDN_TIMEOUT_LABEL):
+        # Fast-pass attempts spent finding out what the CDN range index could have told up front
+        stats['cdn_late_domains'] += 1
+        stats['cdn_late_attempts'] += DOMAIN_ATTEMPT_BUDGET - budget.attempts_left
+    handed_off = router.route(final_status, domain)
+    if handed_off:
+        detail = f"{detail} -> rescue" if detail else "-> rescue"
+    print_domain_status(domain, final_status, details=detail)
+    if handed_off:
+        return final_status
+    await writer.write_line(final_status, domain)
+    update_stats(final_status)
+    return final_status
 
 
 
+async def fallback_process_domain(domain: str, pool: BrowserPool, writer: Writer, corpus: Optional[ResponseCorpus] = None):
     try:
+        html, status_label, proxy_used = await pool.fetch(domain)
+        if status_label != "success" or not html:
+            print_domain_status(domain, "error", details=f"(FALLBACK_UNAVAIL via {mask_proxy(proxy_used)} )" if proxy_used else "(FALLBACK_UNAVAIL)")
+            return
+        inactive_reason = detect_inactive(html, 200)
 
 
 
-        # Fast pass
-
-
-
-        print_status("🚀 Starting fast pass (aiohttp)...", "success")
-
-
-
-        with tqdm(
-
-
-
-            total=len(domains), 
-
-
-
-            desc=f"{Fore.CYAN}Fast pass (aiohttp){Style.RESET_ALL}",
-
-
-
-            unit="domain",
-
-
-
-            bar_format="{l_bar}{bar}| {n_fmt}/{total_fmt} [{elapsed}<{remaining}, {rate_fmt}]",
-
-
-
-            colour="cyan",
-
-
-
-            dynamic_ncols=True,
-
+        if inactive_reason:
 
 
-            smoothing=0.05
 
+            if corpus is not None:
+                corpus.record(domain, None, None, None, html, "inactive", 0.0, proxy_used, tier="FB")
+            await writer.write_line("inactive", domain)
 
 
-        ) as pbar:
 
+            print_domain_status(domain, "inactive", details=f"(FB inactive: {inactive_reason} via {mask_proxy(proxy_used)})" if proxy_used else f"(FB inactive: {inactive_reason})")
 
 
-            async def _wrapped(dom: str):
 
+            update_stats("inactive")
 
 
-                async with sem:
 
+            return
 
 
-                    await process_domain(dom, proxy_pool, proxy_assignment, fetchers, writer, fb)
 
+        total_score, hits_by_cat, title_hits = score_content(html, domain)
+        if corpus is not None:
+            corpus.record(domain, None, None, None, html, "filtered" if total_score >= THRESHOLD_SCORE else "clean", total_score, proxy_used, tier="FB")
 
 
-                    pbar.update(1)
 
+        if total_score >= THRESHOLD_SCORE:
 
 
-                    # Update description with live stats
 
+            await writer.write_line("filtered", domain)
 
 
-                    if pbar.n % 1000 == 0 or pbar.n == len(domains):
 
+            sample = ", ".join(sample_matches(html))
 
 
-                        pbar.set_description(
 
+            print_domain_status(domain, "filtered", total_score, f"(FB via {mask_proxy(proxy_used)}) hits={hits_by_cat} sample=[{sample}]" if proxy_used else f"(FB) hits={hits_by_cat} sample=[{sample}]")
 
 
-                            f"{Fore.CYAN}Fast pass (aiohttp){Style.RESET_ALL} "
 
+            update_stats("filtered")
 
 
-                            f"{Fore.GREEN}(Clean: {stats['clean']:,}){Style.RESET_ALL} "
 
+        else:
 
 
-                            f"{Fore.RED}(Filtered: {stats['filtered']:,}){Style.RESET_ALL} "
 
+            await writer.write_line("clean", domain)
 
 
-                            f"{Fore.CYAN}(Inactive: {stats['inactive']:,}){Style.RESET_ALL} "
 
+            summary = summarize_clean_page(html)
 
 
-                            f"{Fore.BLUE}(Cloudflare: {stats['cloudflare']:,}){Style.RESET_ALL}"
 
+            print_domain_status(domain, "clean", total_score, f"{summary} (FB via {mask_proxy(proxy_used)})" if summary and proxy_used else (f"(FB via {mask_proxy(proxy_used)})" if proxy_used else (f"{summary} (FB)" if summary else "(FB)")))
 
 
-                        )
 
+            update_stats("clean")
 
 
-            tasks = [asyncio.create_task(_wrapped(d)) for d in domains]
 
+        stats['fallback_processed'] += 1
 
 
-            for chunk_start in range(0, len(tasks), 2000):
 
+    except Exception as e:
 
 
-                chunk = tasks[chunk_start:chunk_start+2000]
 
+        print_domain_status(domain, "error", details=f"(FB) Exception: {str(e)[:50]}")
 
 
-                await asyncio.gather(*chunk)
 
+        update_stats("error")
 
 
-        await asyncio.gather(*(f.close() for f in fetchers.values()))
 
+# =========================
 
 
-        # Timeout Rescue
 
+# Preflight
 
 
-        if USE_RESCUE_STAGE and timeouts_pending:
 
+# =========================
 
 
-            print_status(f"🔄 Timeout rescue for {len(timeouts_pending)} domains (longer timeouts, IPv4, low concurrency)", "progress")
 
+def check_py_version():
 
 
-            rescue_fetcher = Fetcher(
 
+    v = sys.version_info
 
 
-                concurrency=RESCUE_CONCURRENCY,
 
+    if (v.major, v.minor) not in SUPPORTED_PY:
 
 
-                total_timeout=RESCUE_TOTAL_TIMEOUT,
 
+        raise RuntimeError(f"Unsupported Python {v.major}.{v.minor}. Supported: {SUPPORTED_PY_STR}")
 
 
-                connect_timeout=RESCUE_CONNECT_TIMEOUT,
 
+def check_ulimit():
 
 
-                read_timeout=RESCUE_READ_TIMEOUT,
 
+    try:
 
 
-                force_ipv4=RESCUE_FORCE_IPV4,
 
+        out = subprocess.check_output(["bash", "-lc", "ulimit -n"], text=True, timeout=3).strip()
 
 
-                ttl_dns_cache=60,
 
+        val = int(out)
 
 
-            )
 
+        if val < 8192:
 
 
-            sem_rescue = asyncio.Semaphore(RESCUE_CONCURRENCY)
 
+            logger.warning(f"Open file limit is low: {val}. Recommend: ulimit -n 65535")
 
 
-            async def _rescue_one(dom: str):
 
+    except Exception:
 
 
-                async with sem_rescue:
 
+        pass
 
 
-                    html, status_label, http_status, hdrs, err_detail = await rescue_fetcher.fetch(dom)
 
+def check_input_output():
 
 
-                    if status_label == "success":
 
+    if not os.path.exists(INPUT_FILE):
 
 
-                        try:
 
+        raise FileNotFoundError(f"INPUT_FILE not found: {INPUT_FILE}")
 
 
-                            inactive_reason = detect_inactive(html, http_status or 200)
 
+    with open(INPUT_FILE, "r", encoding="utf-8") as f:
 
 
-                            if inactive_reason:
 
+        _ = f.readline()
 
 
-                                await writer.write_line("inactive", dom)
 
+    for k, fn in OUT_FILES.items():
 
 
-                                logger.info(f"{Fore.CYAN}INACTIVE(R)       {Style.RESET_ALL}{dom} reason={inactive_reason}")
 
+        with open(fn, "a", encoding="utf-8") as f:
 
 
-                                return
 
+            pass
 
 
-                            total_score, hits_by_cat, title_hits = score_content(html, dom)
 
+    with open(CONN_ERR_DETAIL_FILE, "a", encoding="utf-8") as f:
 
 
-                            if total_score >= THRESHOLD_SCORE:
 
+        pass
 
 
-                                await writer.write_line("filtered", dom)
 
+async def smoke_aiohttp():
 
 
-                                sample = ", ".join(sample_matches(html))
 
+    timeout = ClientTimeout(total=6, connect=3, sock_read=3)
 
 
-                                logger.info(f"{Fore.RED}FILTERED(R {total_score:.1f}) {Style.RESET_ALL}{dom} hits={hits_by_cat} title={title_hits} sample=[{sample}]")
 
+    async with aiohttp.ClientSession(timeout=timeout) as s:
 
 
-                            else:
 
+        async with s.get("https://example.com", allow_redirects=True) as r:
 
 
-                                await writer.write_line("clean", dom)
 
+            if r.status >= 400:
 
 
-                                summary = summarize_clean_page(html)
 
+                raise RuntimeError(f"aiohttp smoke: HTTP {r.status}")
 
 
-                                logger.info(f"{Fore.GREEN}CLEAN(R {total_score:.2f})   {Style.RESET_ALL}{dom}{(' ' + summary) if summary else ''}")
 
+            _ = await r.text()
 
 
-                        except Exception as e:
 
+    logger.info(f"{Fore.GREEN}aiohttp OK{Style.RESET_ALL}")
 
 
-                            await writer.write_line("error", dom)
 
+def smoke_selenium_sync():
 
 
-                            logger.error(f"{Fore.RED}ANALYZE ERROR(R)   {Style.RESET_ALL}{dom}: {e}")
 
+    prof = Path(tempfile.mkdtemp(prefix="sel_smoke_", dir=str(TMP_PROFILE_BASE)))
 
 
-                        return
 
+    br = None
 
 
-                    if status_label == "timeout":
 
+    try:
 
 
-                        await writer.write_line("timeout", dom)
 
+        br = _new_selenium_browser(prof, None)
 
 
-                        logger.info(f"{Fore.YELLOW}TIMEOUT(FINAL)     {Style.RESET_ALL}{dom}")
 
+        br.get("https://example.com")
 
 
-                    elif status_label == CDN_TIMEOUT_LABEL:
 
+        WebDriverWait(br, 10).until(lambda d: d.execute_script("return document.readyState") in ("interactive","complete"))
 
 
-                        cdn_timeouts_pending.append(dom)
 
+        html = br.page_source or ""
 
 
-                        logger.info(f"{Fore.MAGENTA}CDN_TIMEOUT(PENDING){Style.RESET_ALL} {dom}")
 
+        if len(html) < 100:
 
 
-                        return
 
+            raise RuntimeError("Selenium smoke: short HTML")
 
 
-                    elif status_label == "non_html":
 
+        logger.info(f"{Fore.GREEN}Selenium Chrome OK (Chrome for Testing via Selenium Manager){Style.RESET_ALL}")
 
 
-                        await writer.write_line("non_html", dom)
 
+    finally:
 
 
-                        logger.info(f"{Fore.YELLOW}NON_HTML(R)        {Style.RESET_ALL}{dom}")
 
+        try:
 
 
-                    elif status_label in ("cloudflare", "ssl_error"):
 
+            if br: br.quit()
 
 
-                        await writer.write_line(status_label, dom)
 
+        except Exception:
 
 
-                        await fb.add(status_label, dom)
 
+            pass
 
 
-                        logger.info(f"{Fore.YELLOW}{status_label.upper()}(R){Style.RESET_ALL} {dom}")
 
+        # cleanup profile
 
 
-                    elif status_label == "connection_error":
 
+        try:
 
 
-                        reason = short_reason(err_detail or "")
 
+            if prof.exists():
 
 
-                        await writer.write_line("connection_error", dom)
 
+                for p in sorted(prof.glob("**/*"), reverse=True):
 
 
-                        try:
 
+                    try: p.unlink()
 
 
-                            with open(CONN_ERR_DETAIL_FILE, "a", encoding="utf-8") as f:
 
+                    except IsADirectoryError:
 
 
-                                f.write(f"{dom} | {reason} | {err_detail or ''}\n")
 
+                        try: p.rmdir()
 
 
-                        except Exception:
 
+                        except Exception: pass
 
 
-                            pass
 
+                    except Exception:
 
 
-                        logger.info(f"{Fore.YELLOW}CONNECTION_ERROR(R)[{reason}]{Style.RESET_ALL} {dom}")
 
+                        pass
 
 
-                    else:
 
+                try: prof.rmdir()
 
 
-                        await writer.write_line("error", dom)
 
+                except Exception: pass
 
 
-                        update_stats("error")
 
+        except Exception:
 
 
-                        reason = short_reason(err_detail or "")
 
+            pass
 
 
-                        detail = f"[{reason}]" if reason else (f"[{err_detail}]" if err_detail else "")
 
+def smoke_uc_sync_if_x86():
 
 
-                        suffix = f" {detail}" if detail else ""
 
+    if IS_ARM:
 
 
-                        logger.info(f"{Fore.YELLOW}ERROR(R)           {Style.RESET_ALL}{dom}{suffix}")
 
+        return
 
 
-            with tqdm(
 
+    if not _ensure_uc_import():
 
 
-                total=len(timeouts_pending), 
 
+        raise RuntimeError("undetected_chromedriver missing on x86_64")
 
 
-                desc=f"{Fore.MAGENTA}Timeout rescue{Style.RESET_ALL}",
 
+    # Try launching UC once
 
 
-                unit="domain",
 
+    prof = Path(tempfile.mkdtemp(prefix="uc_smoke_", dir=str(TMP_PROFILE_BASE)))
 
 
-                bar_format="{l_bar}{bar}| {n_fmt}/{total_fmt} [{elapsed}<{remaining}, {rate_fmt}]",
 
+    br = None
 
 
-                colour="magenta",
 
+    try:
 
 
-                dynamic_ncols=True
 
+        br = _new_uc_browser(prof, None)
 
 
-            ) as pbar_r:
 
+        br.get("https://example.com")
 
 
-                tasks_r = [asyncio.create_task(_rescue_one(d)) for d in timeouts_pending]
 
+        WebDriverWait(br, 10).until(lambda d: d.execute_script("return document.readyState") in ("interactive","complete"))
 
 
-                for chunk_start in range(0, len(tasks_r), 2000):
 
+        html = br.page_source or ""
 
 
-                    chunk = tasks_r[chunk_start:chunk_start+2000]
 
+        if len(html) < 100:
 
 
-                    await asyncio.gather(*chunk)
 
+            raise RuntimeError("UC smoke: short HTML")
 
 
-                    pbar_r.update(len(chunk))
 
+        logger.info(f"{Fore.GREEN}UC Chrome OK (x86_64){Style.RESET_ALL}")
 
 
-            await rescue_fetcher.close()
 
+    finally:
 
 
-        if USE_RESCUE_STAGE and cdn_timeouts_pending:
 
+        try:
 
 
-            print_status(f"?? CDN throttle rescue for {len(cdn_timeouts_pending)} domains (low concurrency, extended timeouts)", "progress")
 
+            if br: br.quit()
 
 
-            cdn_fetcher = Fetcher(
 
+        except Exception:
 
 
-                concurrency=CDN_RESCUE_CONCURRENCY,
 
+            pass
 
 
-                total_timeout=CDN_TOTAL_TIMEOUT,
 
+        try:
 
 
-                connect_timeout=CDN_CONNECT_TIMEOUT,
 
+            if prof.exists():
 
 
-                read_timeout=CDN_READ_TIMEOUT,
 
+                for p in sorted(prof.glob("**/*"), reverse=True):
 
 
-                force_ipv4=RESCUE_FORCE_IPV4,
 
+                    try: p.unlink()
 
 
-                ttl_dns_cache=120,
 
+                    except IsADirectoryError:
 
 
-            )
 
+                        try: p.rmdir()
 
 
-            sem_cdn = asyncio.Semaphore(CDN_RESCUE_CONCURRENCY)
 
+                        except Exception: pass
 
 
-            async def _cdn_rescue_one(dom: str):
 
+                    except Exception:
 
 
-                async with sem_cdn:
 
+                        pass
 
 
-                    html, status_label, http_status, hdrs, err_detail = await cdn_fetcher.fetch(dom)
 
+                try: prof.rmdir()
 
 
-                    if status_label == "success":
 
+                except Exception: pass
 
 
-                        try:
 
+        except Exception:
 
 
-                            inactive_reason = detect_inactive(html, http_status or 200)
 
+            pass
 
 
-                            if inactive_reason:
 
+async def preflight():
 
 
-                                await writer.write_line("inactive", dom)
 
+    logger.info(f"{Fore.CYAN}Running preflight checks...{Style.RESET_ALL}")
 
 
-                                update_stats("inactive")
 
+    check_py_version()
 
 
-                                logger.info(f"{Fore.CYAN}INACTIVE(CDN)      {Style.RESET_ALL}{dom} reason={inactive_reason}")
 
+    check_ulimit()
 
 
-                                return
 
+    check_input_output()
 
 
-                            total_score, hits_by_cat, title_hits = score_content(html, dom)
 
+    await smoke_aiohttp()
 
 
-                            if total_score >= THRESHOLD_SCORE:
 
+    # Browser smoke: on x86 prefer UC, but if UC fails try Selenium CfT
 
 
-                                await writer.write_line("filtered", dom)
 
+    if IS_ARM:
 
 
-                                update_stats("filtered")
 
+        await asyncio.to_thread(smoke_selenium_sync)
 
 
-                                sample = ", ".join(sample_matches(html))
 
+    else:
 
 
-                                logger.info(f"{Fore.RED}FILTERED(CDN {total_score:.1f}) {Style.RESET_ALL}{dom} hits={hits_by_cat} title={title_hits} sample=[{sample}]")
 
+        try:
 
 
-                            else:
 
+            await asyncio.to_thread(smoke_uc_sync_if_x86)
 
 
-                                await writer.write_line("clean", dom)
 
+        except Exception as e:
 
 
-                                update_stats("clean")
 
+            logger.warning(f"UC smoke failed: {e}. Trying Selenium as fallback...")
 
 
-                                summary = summarize_clean_page(html)
 
+            await asyncio.to_thread(smoke_selenium_sync)
 
 
-                                logger.info(f"{Fore.GREEN}CLEAN(CDN {total_score:.2f})   {Style.RESET_ALL}{dom}{(' ' + summary) if summary else ''}")
 
+    logger.info(f"{Fore.GREEN}Preflight passed ✓{Style.RESET_ALL}")
 
 
-                        except Exception as e:
 
+def collect_pipeline_metrics(
+    exporter: MetricsExporter,
+    proxy_pool: ProxyPool,
+    router: RescueRouter,
+    limiter: PolitenessLimiter,
+    gate: Optional[AdjustableGate] = None,
+    scheduler: Optional[FastPassScheduler] = None,
+) -> List[MetricFamily]:
+    # Snapshot of the run for --metrics-port; evaluated on every scrape
+    fam = exporter.family
+    outcomes = fam("outcomes_total", "counter", "Final verdicts by outcome label")
+    for key in OUT_FILES:
+        outcomes.add(stats.get(key, 0), outcome=key)
+    events = fam("events_total", "counter", "Other pipeline counters from stats")
+    for key, value in stats.items():
+        if key not in OUT_FILES and key != "total" and isinstance(value, (int, float)):
+            events.add(value, event=key)
+    families = [outcomes, events, fam("domains_input", "gauge", "Domains in the input file").add(stats.get("total", 0))]
+
+    depth = fam("queue_depth", "gauge", "Domains waiting in each queue")
+    if scheduler is not None:
+        depth.add(scheduler.qsize(), queue="fast")
+    for tier in router.tiers:
+        depth.add(tier.queue.qsize(), queue=tier.spec["name"])
+    families.append(depth)
+    if gate is not None:
+        families.append(fam("inflight_domains", "gauge", "Fast-pass domains being processed").add(gate.in_use))
+        families.append(fam("concurrency_limit", "gauge", "Current fast-pass concurrency limit").add(gate.limit))
+    families.append(fam("rescue_pending", "gauge", "Domains routed to rescue tiers and not finished").add(router.pending()))
+    if scheduler is not None:
+        families.append(fam("ip_parked_domains", "gauge", "Fast-pass domains waiting for a busy origin IP").add(scheduler.parked_now()))
+        families.append(fam("ip_busy", "gauge", "Origin IPs with domains in flight").add(scheduler.busy_ips()))
+    families.append(fam("ratelimit_waits_total", "counter", "Politeness limiter waits").add(limiter.waits))
+    families.append(fam("ratelimit_wait_seconds_total", "counter", "Time spent waiting on the politeness limiter").add(round(limiter.wait_seconds, 3)))
+
+    requests = fam("proxy_requests_total", "counter", "Requests per proxy")
+    successes = fam("proxy_successes_total", "counter", "Successful requests per proxy")
+    errors = fam("proxy_errors_total", "counter", "Failed requests per proxy and label")
+    latency = fam("proxy_latency_seconds", "gauge", "Recent request latency per proxy")
+    ejected = fam("proxy_ejected", "gauge", "1 while the proxy is ejected")
+    now = time.time()
+    for proxy, health in proxy_pool.health.items():
+        name = mask_proxy(proxy)
+        requests.add(health.requests, proxy=name)
+        successes.add(health.successes, proxy=name)
+        for label, count in health.errors.items():
+            errors.add(count, proxy=name, label=label)
+        for quantile in (50, 95):
+            value = health.latency_pct(quantile)
+            if value is not None:
+                latency.add(round(value, 4), proxy=name, quantile=f"0.{quantile}")
+        ejected.add(1 if health.ejected_until > now else 0, proxy=name)
+    families.extend([requests, successes, errors, latency, ejected])
+
+    if _phase_stats is not None:
+        phases = fam("request_phase_seconds", "histogram", "Request phase durations per proxy")
+        for proxy, table in sorted(_phase_stats.by_proxy.items()):
+            for phase, hist in table.items():
+                phases.add_histogram(hist.bounds, hist.counts, hist.sum, proxy=proxy, phase=phase)
+        families.append(phases)
+    if _shared_dns is not None:
+        dns_events = fam("dns_resolutions_total", "counter", "Shared DNS cache resolutions by result")
+        for event in ("lookups", "hits", "coalesced", "failures"):
+            dns_events.add(getattr(_shared_dns, event), result=event)
+        families.append(dns_events)
+    if _redirect_cache is not None:
+        redirects = fam("redirect_verdicts_total", "counter", "Redirect-target verdicts reused from or stored in the cache")
+        redirects.add(_redirect_cache.hits, result="reused").add(_redirect_cache.stores, result="stored")
+        families.append(redirects)
+        families.append(fam("redirect_targets", "gauge", "Redirect targets with a cached verdict").add(len(_redirect_cache.entries)))
+    return families
+
+
+def pipeline_sizes(
+    proxy_pool: ProxyPool,
+    router: RescueRouter,
+    limiter: PolitenessLimiter,
+    writer: Writer,
+    gate: Optional[AdjustableGate] = None,
+    scheduler: Optional[FastPassScheduler] = None,
+) -> Dict[str, Any]:
+    # Pool and queue sizes for the SIGUSR1 diagnostics dump; runs on the loop thread
+    sizes: Dict[str, Any] = {}
+    if scheduler is not None:
+        sizes["fast_queue"] = f"{scheduler.qsize()} queued, {scheduler.parked_now()} parked behind busy IPs, {scheduler.busy_ips()} IPs busy"
+    if gate is not None:
+        sizes["gate"] = f"{gate.in_use} in use / {gate.limit} limit, {gate.waiting} waiting"
+    for tier in router.tiers:
+        sizes[f"tier[{tier.spec['tag']}]"] = (
+            f"queue {tier.queue.qsize()}, routed {tier.routed}, done {tier.done}, "
+            f"{'running' if tier.task is not None else 'idle'}{', failed' if tier.failed else ''}"
+        )
+    sizes["writer_buffered_lines"] = sum(len(v) for v in writer._buffers.values())
+    now = time.time()
+    sizes["proxies"] = f"{len(proxy_pool.health)} total, {sum(1 for h in proxy_pool.health.values() if h.ejected_until > now)} ejected"
+    sizes["limiter_buckets"] = f"{len(limiter._host_buckets)} hosts, {len(limiter._proxy_buckets)} proxies"
+    if _buffer_pool is not None:
+        sizes["buffer_pool"] = f"{_buffer_pool.in_use} in use, {len(_buffer_pool._free)} free, {_buffer_pool.allocated} allocated"
+    if _shared_dns is not None:
+        sizes["dns_cache"] = f"{len(_shared_dns._cache)} entries, {len(_shared_dns._inflight)} in flight"
+    return sizes
 
 
-                            await writer.write_line("error", dom)
+# =========================
 
 
 
-                            update_stats("error")
+# Main
 
 
 
-                            logger.error(f"{Fore.RED}ANALYZE ERROR(CDN) {Style.RESET_ALL}{dom}: {e}")
+# =========================
 
 
 
-                        return
+async def main(
+    no_qc: bool = False,
+    monitor_interval: Optional[float] = None,
+    corpus_path: Optional[str] = None,
+    timings_path: Optional[str] = None,
+):
+    # Orchestrates fast pass, rescue, optional fallback, and final merge.
 
 
 
-                    if status_label in (CDN_TIMEOUT_LABEL, "timeout"):
+    start_time = time.time()
+    deadline = Deadline(DEADLINE_SEC, DEADLINE_DRAIN_SEC) if DEADLINE_SEC else None
 
 
 
-                        await writer.write_line(CDN_TIMEOUT_LABEL, dom)
+    print_header()
 
 
 
-                        update_stats(CDN_TIMEOUT_LABEL)
+    # uvloop if present
 
 
 
-                        logger.info(f"{Fore.MAGENTA}CDN_TIMEOUT(FINAL) {Style.RESET_ALL}{dom}")
+    try:
 
 
 
-                    elif status_label == "non_html":
+        import uvloop
 
 
 
-                        await writer.write_line("non_html", dom)
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
 
 
 
-                        update_stats("non_html")
+        print_status("⚡ Using uvloop for enhanced performance", "success")
 
 
 
-                        logger.info(f"{Fore.YELLOW}NON_HTML(CDN)      {Style.RESET_ALL}{dom}")
+    except Exception:
 
 
 
-                    elif status_label in ("cloudflare", "ssl_error"):
+        print_status("ℹ️  Using default event loop", "info")
 
 
 
-                        await writer.write_line(status_label, dom)
+    # Check input file
 
 
 
-                        update_stats(status_label)
+    if not Path(INPUT_FILE).exists():
 
 
 
-                        await fb.add(status_label, dom)
+        print_status(f"❌ Input file not found: {INPUT_FILE}", "error")
 
 
 
-                        logger.info(f"{Fore.YELLOW}{status_label.upper()}(CDN){Style.RESET_ALL} {dom}")
+        return
 
 
 
-                    elif status_label == "connection_error":
+    print_status(f"📂 Counting domains in {INPUT_FILE}...", "progress")
+    total_domains = count_input_domains(INPUT_FILE)
+    proxies = load_proxies(PROXY_FILE)
 
 
 
-                        reason = short_reason(err_detail or "")
+    if not proxies:
 
 
 
-                        await writer.write_line("connection_error", dom)
+        print_status(f"? No proxies found in {PROXY_FILE}", "error")
 
 
 
-                        update_stats("connection_error")
+        return
 
 
 
-                        try:
+    proxy_pool = ProxyPool(proxies)
 
 
 
-                            with open(CONN_ERR_DETAIL_FILE, "a", encoding="utf-8") as f:
+    overall_concurrency, per_proxy_concurrency = compute_concurrency_limits(len(proxies))
 
 
 
-                                f.write(f"{dom} | {reason} | {err_detail or ''}\n")
+    stats['total'] = total_domains
 
 
 
-                        except Exception:
+    print_status(f"?? Loaded {len(proxies)} proxies from {PROXY_FILE}", "info")
 
 
 
-                            pass
+    print_status(f"📊 Total domains to process: {stats['total']:,}", "info")
 
 
 
-                        logger.info(f"{Fore.YELLOW}CONNECTION_ERROR(CDN)[{reason}]{Style.RESET_ALL} {dom}")
+    print_status(f"🔧 Configuration: {overall_concurrency} concurrent overall, {per_proxy_concurrency} per proxy", "info")
+    fast_ceiling = adaptive_concurrency_ceiling(overall_concurrency)
+    if fast_ceiling > overall_concurrency:
+        print_status(f"🎚️  Adaptive concurrency: starting at {overall_concurrency}, may grow to {fast_ceiling}", "info")
 
 
 
-                    else:
+    print()
 
 
 
-                        await writer.write_line("error", dom)
+    # Setup output files
 
 
 
-                        update_stats("error")
+    previous: Optional[PreviousVerdicts] = None
+    if deadline is not None:
+        print_status(deadline.plan_line(), "info")
+        # Read before the files are truncated below; a cut run writes these for the domains it carries over
+        previous = PreviousVerdicts(OUT_FILES)
+        if len(previous):
+            print_status(f"⌛ {len(previous):,} verdicts from the previous run kept for domains that get carried over", "info")
+    print_status("📁 Setting up output files...", "progress")
 
 
 
-                        reason = short_reason(err_detail or "")
+    for fn in OUT_FILES.values():
 
 
 
-                        detail = f"[{reason}]" if reason else (f"[{err_detail}]" if err_detail else "")
+        Path(fn).write_text("", encoding="utf-8")
 
 
 
-                        suffix = f" {detail}" if detail else ""
+    Path(CONN_ERR_DETAIL_FILE).write_text("", encoding="utf-8")
 
 
 
-                        logger.info(f"{Fore.YELLOW}ERROR(CDN)         {Style.RESET_ALL}{dom}{suffix}")
+    Path(FINAL_OUTPUT_FILE).write_text("", encoding="utf-8")
 
 
 
-            cdn_targets = list(dict.fromkeys(cdn_timeouts_pending))
+    print_status("?? Output files:", "info")
 
 
 
-            with tqdm(
+    for category, filename in OUT_FILES.items():
 
 
 
-                total=len(cdn_targets),
+        print_status(f"   {category}: {filename}", "info")
 
 
 
-                desc=f"{Fore.MAGENTA}CDN timeout rescue{Style.RESET_ALL}",
+    print_status(f"   combined: {FINAL_OUTPUT_FILE}", "info")
 
 
 
-                unit="domain",
+    print()
 
 
 
-                bar_format="{l_bar}{bar}| {n_fmt}/{total_fmt} [{elapsed}<{remaining}, {rate_fmt}]",
+    fetchers: Dict[str, Fetcher] = {}
 
 
 
-                colour="magenta",
+    # Connectors are sized for the adaptive ceiling; the fast-pass gate decides how much of it is used
+    connector_limit = max(per_proxy_concurrency, -(-fast_ceiling // len(proxies)))
+    for proxy in proxies:
 
 
 
-                dynamic_ncols=True
+        try:
 
 
 
-            ) as pbar_cdn:
+            fetchers[proxy] = Fetcher(concurrency=connector_limit, proxy_url=proxy, ttl_dns_cache=120)
 
 
 
-                tasks_cdn = [asyncio.create_task(_cdn_rescue_one(d)) for d in cdn_targets]
+        except Exception as e:
 
 
 
-                for chunk_start in range(0, len(tasks_cdn), 2000):
+            print_status(f"? Skipping proxy {mask_proxy(proxy)}: {e}", "warning")
 
 
 
-                    chunk = tasks_cdn[chunk_start:chunk_start+2000]
+    if not fetchers:
 
 
 
-                    await asyncio.gather(*chunk)
+        print_status("? No valid proxies after initialization", "error")
 
 
 
-                    pbar_cdn.update(len(chunk))
+        return
 
 
 
-            await cdn_fetcher.close()
+    if len(fetchers) != len(proxies):
 
 
 
-            cdn_timeouts_pending.clear()
+        overall_concurrency, per_proxy_concurrency = compute_concurrency_limits(len(fetchers))
+        fast_ceiling = adaptive_concurrency_ceiling(overall_concurrency)
 
 
 
-        # Fallback with browser (chunked + pool restart)
+    writer = Writer()
 
 
 
-        cf_targets = list(dict.fromkeys(sorted(fb.cloudflare)))
+    limiter = PolitenessLimiter(PROXY_RATE_PER_SEC, PROXY_BURST, HOST_RATE_PER_SEC, HOST_BURST)
+    router = RescueRouter(build_rescue_tiers(proxies), proxies, writer, limiter, proxy_pool)
+    breaker = HostBreaker()
+    wall_times = WallTimeHistogram(DOMAIN_TIME_BUCKETS)
+    corpus: Optional[ResponseCorpus] = None
+    if corpus_path:
+        corpus = ResponseCorpus(corpus_path)
+        print_status(f"🗜️  Recording responses to {corpus_path} ({corpus.codec})", "info")
+    redirect_cache = get_redirect_cache()
+    if redirect_cache is not None:
+        redirect_cache.open_audit_file(REDIRECT_AUDIT_FILE)
+        if corpus is not None:
+            # The corpus needs every body; verdicts are still stored for later runs
+            redirect_cache.skip_bodies = False
+    phase_stats = get_phase_stats()
+    if timings_path:
+        if phase_stats is None:
+            print_status("Phase tracing is disabled; --record-timings ignored", "warning")
+        else:
+            phase_stats.open_domain_file(timings_path)
+            print_status(f"⏱️  Recording per-domain request timings to {timings_path}", "info")
 
 
 
-        if ENABLE_BROWSER_FALLBACK and cf_targets:
+    monitor_task: Optional[asyncio.Task] = None
+    controller: Optional[AdaptiveConcurrencyController] = None
 
 
 
-            print_status(f"🌐 Browser fallback via proxies for {len(cf_targets)} Cloudflare domains", "progress")
+    if monitor_interval:
 
 
 
-            fb_workers = max(1, min(FALLBACK_MAX_BROWSERS, len(proxies)))
+        if psutil is None:
 
 
 
-            engine = "selenium" if IS_ARM else "uc"
+            print_status("psutil not available; memory monitor disabled", "warning")
 
 
 
-            pool_cls = SeleniumPool if IS_ARM else UCPool
+        else:
 
 
 
-            pool = pool_cls(fb_workers, proxies)
+            monitor_task = asyncio.create_task(memory_monitor(monitor_interval))
 
 
 
-            try:
+    await writer.start()
 
 
 
-                await pool.start()
+    gate: Optional[AdjustableGate] = None
+    scheduler: Optional[FastPassScheduler] = None
+    families: Optional[FamilySampler] = None
+    history: Optional[DomainHistory] = DomainHistory(HISTORY_FILE) if LPT_SCHEDULING or INCREMENTAL else None
+    carry = CarryOver(CARRYOVER_FILE)
+    router.deadline = deadline
+    router.carry = carry
+    router.corpus = corpus
+    cdn_routed: Dict[str, int] = {}
+    exporter: Optional[MetricsExporter] = None
+    if METRICS_PORT:
+        exporter = MetricsExporter("step3", METRICS_PORT, processed=lambda: sum(stats[k] for k in OUT_FILES), log=print_status)
+        # The closure sees gate / scheduler once the fast pass has created them
+        exporter.add_collector(lambda: collect_pipeline_metrics(exporter, proxy_pool, router, limiter, gate, scheduler))
+        try:
+            await exporter.start()
+        except OSError as e:
+            print_status(f"📡 Metrics endpoint disabled: {e}", "warning")
+            exporter = None
+    diagnostics = DiagnosticsDumper("step3", log=print_status)
+    # Same late binding as the metrics collector
+    diagnostics.add_probe("pipeline", lambda: pipeline_sizes(proxy_pool, router, limiter, writer, gate, scheduler))
+    diagnostics.install(asyncio.get_running_loop())
+    try:
 
 
 
-                sem_fb = asyncio.Semaphore(fb_workers)
+        # Fast pass: a fixed worker set per proxy pulls from a bounded queue fed from INPUT_FILE;
+        # the adaptive gate decides how many of those workers are busy at once
 
 
 
-                with tqdm(
+        print_status("🚀 Starting fast pass (aiohttp)...", "success")
 
 
 
-                    total=len(cf_targets),
+        home_proxies = list(fetchers)
+        worker_count = max(len(home_proxies), fast_ceiling)
+        gate = AdjustableGate(max(len(home_proxies), overall_concurrency))
+        if ADAPTIVE_CONCURRENCY:
+            controller = AdaptiveConcurrencyController(
+                gate,
+                min_limit=min(gate.limit, max(len(home_proxies), ADAPTIVE_MIN_CONCURRENCY)),
+                max_limit=worker_count,
+                log=print_status,
+                interval=ADAPTIVE_INTERVAL_SEC,
+                max_loop_lag=ADAPTIVE_MAX_LOOP_LAG_SEC,
+                name="fast-pass concurrency",
+            )
+            controller.start()
+        cdn_index: Optional[CdnRangeIndex] = None
+        if CDN_RANGE_ROUTING or IP_GROUPING:
+            try:
+                cdn_index = CdnRangeIndex.load()
+            except OSError as e:
+                print_status(f"🛰️  CDN ranges unavailable: {e}", "warning")
+        if CDN_RANGE_ROUTING and cdn_index is not None:
+            print_status(
+                f"🛰️  CDN ranges: {cdn_index.size:,} ranges ({', '.join(cdn_index.providers)}); matches go to the CDN direct tier",
+                "info",
+            )
+        known_ips: Optional[Dict[str, str]] = None
+        if IP_GROUPING or (CDN_RANGE_ROUTING and cdn_index is not None):
+            known_ips = load_ip_sidecar(IP_SIDECAR_FILE)
+        if IP_GROUPING:
+            source = f"{len(known_ips):,} from {IP_SIDECAR_FILE}" if known_ips else f"no {IP_SIDECAR_FILE}"
+            print_status(
+                f"🏘️  IP grouping: {IP_MAX_PARALLEL} per IP, {IP_MIN_INTERVAL_SEC}s apart "
+                f"({source}, rest {'resolved ahead' if SHARED_DNS_CACHE else 'ungrouped'})",
+                "info",
+            )
+        scheduler = FastPassScheduler(
+            worker_count * FAST_QUEUE_FACTOR, IP_MAX_PARALLEL, IP_MIN_INTERVAL_SEC, IP_PARK_LIMIT if IP_GROUPING else 0
+        )
+        if carry.load(lambda: iter_input_domains(INPUT_FILE)):
+            print_status(
+                f"⏭️  Carry-over: {len(carry.loaded):,} domains left by the previous time-boxed run go first"
+                + (f" ({carry.stale:,} no longer in the input)" if carry.stale else ""),
+                "info",
+            )
+        incremental: Optional[IncrementalPlan] = None
+        if INCREMENTAL and history is not None:
+            incremental = IncrementalPlan(
+                history, INCREMENTAL_COPYABLE, INCREMENTAL_MAX_AGE_SEC, INCREMENTAL_DEFAULT_MAX_AGE_SEC, INCREMENTAL_RECHECK_SHARE
+            )
+            incremental.plan(lambda: iter_input_domains(INPUT_FILE), force=carry.loaded)
+            print_status(incremental.plan_line(), "info")
+            # Written before the verdict hook below is set, so copies don't count as fresh checks in the history
+            for dom in iter_input_domains(INPUT_FILE):
+                outcome = incremental.copy_forward(dom)
+                if outcome is not None:
+                    await writer.write_line(outcome, dom)
+                    update_stats(outcome)
+            stats['incremental_copied'] = incremental.copied
+
+        def _to_check() -> Iterator[str]:
+            domains = iter_input_domains(INPUT_FILE)
+            return incremental.select(domains) if incremental is not None else domains
+
+        if FAMILY_SAMPLING:
+            families = FamilySampler(FAMILY_PROPAGATE, sample_size=FAMILY_SAMPLE_SIZE, min_family=FAMILY_MIN_SIZE)
+            families.plan(_to_check)
+            print_status(families.plan_line(), "info")
+
+        def _on_verdict(dom: str, label: str):
+            if families is not None:
+                families.observe(dom, label)
+            if history is not None:
+                history.note_verdict(dom, label)
+
+        writer.on_verdict = _on_verdict
+        if history is not None and LPT_SCHEDULING:
+            input_domains = history.schedule(_to_check)
+            print_status(history.plan_line(), "info")
+        else:
+            input_domains = _to_check()
+        if carry.loaded:
+            input_domains = carry.first(input_domains)
+        if deadline is not None:
+            input_domains = carry.until(input_domains, deadline)
+        with tqdm(
 
 
 
-                    desc=f"{Fore.GREEN}Browser fallback{Style.RESET_ALL}",
+            total=stats['total'] - stats['incremental_copied'],
 
 
 
-                    unit="domain",
+            desc=f"{Fore.CYAN}Fast pass (aiohttp){Style.RESET_ALL}",
 
 
 
-                    bar_format="{l_bar}{bar}| {n_fmt}/{total_fmt} [{elapsed}<{remaining}, {rate_fmt}]",
+            unit="domain",
 
 
 
-                    colour="green",
+            bar_format="{l_bar}{bar}| {n_fmt}/{total_fmt} [{elapsed}<{remaining}, {rate_fmt}]",
 
 
 
-                    dynamic_ncols=True
+            colour="cyan",
 
 
 
-                ) as pbar_fb:
+            dynamic_ncols=True,
 
 
 
-                    async def _fb(dom: str):
+            smoothing=0.05
 
 
 
-                        async with sem_fb:
+        ) as pbar:
 
 
 
-                            await asyncio.sleep(random.uniform(*REQUEST_DELAY_RANGE))
+            async def _dispatch(dom: str, ip: Optional[str]):
+                provider = cdn_index.lookup(ip) if cdn_index is not None else None
+                if provider is not None:
+                    if router.route(CDN_RANGE_LABEL, dom):
+                        cdn_routed[provider] = cdn_routed.get(provider, 0) + 1
+                        update_stats("cdn_range_routed")
+                        pbar.update(1)
+                        return
+                    # Anycast edges front unrelated sites; a per-IP cap would only throttle them
+                    ip = None
+                await scheduler.put(dom, ip if IP_GROUPING else None)
+
+            async def _infer(dom: str, verdict: str, family: str):
+                await writer.write_line(verdict, dom)
+                print_domain_status(dom, verdict, details=f"(family {family}: sample agreed)")
+                update_stats(verdict)
+                update_stats("family_inferred")
+                pbar.update(1)
+
+            async def _worker(home_proxy: str):
+                while True:
+                    async with gate:
+                        dom = await scheduler.get()
+                        if dom is None:
+                            return
+                        if deadline is not None and deadline.cutoff_reached():
+                            carry.add(dom)
+                            scheduler.release(dom)
+                            pbar.update(1)
+                            continue
+                        try:
+                            started = time.monotonic()
+                            final_status = await process_domain(dom, proxy_pool, home_proxy, fetchers, writer, router, limiter, breaker, corpus)
+                            elapsed = time.monotonic() - started
+                            wall_times.observe(elapsed)
+                            if history is not None:
+                                history.record(dom, elapsed)
+                            if controller is not None:
+                                controller.record(final_status in ADAPTIVE_FAILURE_LABELS)
+                        except Exception as e:
+                            await writer.write_line("error", dom)
+                            print_domain_status(dom, "error", details=f"Exception: {str(e)[:50]}")
+                            update_stats("error")
+                        finally:
+                            scheduler.release(dom)
+                    pbar.update(1)
 
 
 
-                            await fallback_process_domain(dom, engine, pool, writer)
+                    # Update description with live stats
 
 
 
-                            pbar_fb.update(1)
+                    if pbar.n % 1000 == 0 or pbar.n == stats['total']:
 
 
 
-                    tasks_fb = [asyncio.create_task(_fb(d)) for d in cf_targets]
+                        pbar.set_description(
 
 
 
-                for chunk_start in range(0, len(tasks_fb), 500):
+                            f"{Fore.CYAN}Fast pass (aiohttp){Style.RESET_ALL} "
 
 
 
-                    chunk = tasks_fb[chunk_start:chunk_start+500]
+                            f"{Fore.GREEN}(Clean: {stats['clean']:,}){Style.RESET_ALL} "
 
 
 
-                    await asyncio.gather(*chunk)
+                            f"{Fore.RED}(Filtered: {stats['filtered']:,}){Style.RESET_ALL} "
 
 
 
-            finally:
+                            f"{Fore.CYAN}(Inactive: {stats['inactive']:,}){Style.RESET_ALL} "
 
 
 
-                await pool.close()
+                            f"{Fore.BLUE}(Cloudflare: {stats['cloudflare']:,}){Style.RESET_ALL}"
 
 
 
-        elif cf_targets:
+                        )
 
 
 
-            print_status(f"🌐 Browser fallback disabled; skipping {len(cf_targets)} Cloudflare domains", "warning")
+            workers = [
+                asyncio.create_task(_worker(home_proxies[i % len(home_proxies)]))
+                for i in range(worker_count)
+            ]
+            await asyncio.gather(
+                feed_fast_pass(scheduler, input_domains, known_ips, _dispatch, families, _infer, deadline),
+                *workers,
+            )
+            if families is not None:
+                stats['family_released'] = families.released
 
 
 
+        if controller is not None:
+            await controller.stop()
+        await asyncio.gather(*(f.close() for f in fetchers.values()))
+        pending = router.pending()
+        if pending:
+            print_status(f"🛟 Fast pass done; waiting for rescue tiers ({pending:,} domains in flight)", "progress")
+        await router.drain()
+        if deadline is None:
+            carry.discard()
     finally:
 
 
@@ -7804,7 +9143,36 @@ async def main(no_qc: bool = False, monitor_interval: Optional[float] = None):
 
 
 
+        if controller is not None:
+            await controller.stop()
+        if exporter is not None:
+            await exporter.stop()
+        diagnostics.uninstall()
+        await router.close()
+        if deadline is not None:
+            # Reused verdicts are not checks of this run; keep them out of the history
+            writer.on_verdict = None
+            await save_carryover(carry, previous, writer)
         await writer.stop()
+        if phase_stats is not None:
+            phase_stats.flush()
+            try:
+                phase_stats.write_report(PHASE_REPORT_FILE)
+            except Exception as e:
+                print_status(f"Failed to write {PHASE_REPORT_FILE}: {e}", "warning")
+        if corpus is not None:
+            corpus.close()
+        proxy_pool.save()
+        if redirect_cache is not None:
+            redirect_cache.flush()
+            redirect_cache.save()
+        if history is not None:
+            try:
+                history.save()
+            except OSError as e:
+                print_status(f"⚠️ Could not save {HISTORY_FILE}: {e}", "warning")
+        if _shared_dns is not None:
+            await _shared_dns.close()
 
 
 
@@ -7941,6 +9309,83 @@ async def main(no_qc: bool = False, monitor_interval: Optional[float] = None):
 
 
     print_status(f"🌐 Fallback processed: {stats['fallback_processed']:,}", "fallback")
+    for line, kind in router.report_lines():
+        print_status(line, kind)
+    print_status(f"🚦 Rate-limit waits: {limiter.waits:,} ({limiter.wait_seconds:.0f}s total); HTTP 429 responses: {stats['http_429']:,}", "info")
+    if scheduler is not None and scheduler.report_line():
+        print_status(scheduler.report_line(), "info")
+    if families is not None and (families.sampled_families or families.www_pairs):
+        print_status(families.report_line(), "info")
+    if stats['cdn_range_routed'] or stats['cdn_late_domains']:
+        late = stats['cdn_late_domains']
+        by_provider = ", ".join(f"{p} {n:,}" for p, n in sorted(cdn_routed.items(), key=lambda kv: -kv[1]))
+        print_status(
+            f"🛰️  CDN ranges: {stats['cdn_range_routed']:,} domains routed before any fetch"
+            + (f" ({by_provider})" if by_provider else "")
+            + f"; fast pass spent {stats['cdn_late_attempts']:,} attempts on {late:,} domains that ended "
+            f"cloudflare/{CDN_TIMEOUT_LABEL} ({stats['cdn_late_attempts'] / late if late else 0:.1f} each)",
+            "info",
+        )
+    for line in proxy_pool.report_lines():
+        print_status(line, "info")
+    print_status(
+        f"🧯 Domain budget exhausted: {stats['budget_exhausted']:,}; host breaker trips: {breaker.trips:,}, "
+        f"short-circuited: {breaker.short_circuits:,}",
+        "info",
+    )
+    if controller is not None:
+        print_status(controller.report_line(), "info")
+    if phase_stats is not None and phase_stats.requests:
+        print_status(phase_stats.summary_line(), "info")
+        print_status(f"   per-proxy / per-outcome histograms: {PHASE_REPORT_FILE}", "info")
+    print_status(f"🏁 Hedged requests: {stats['hedges_launched']:,} started, {stats['hedge_wins']:,} won", "info")
+    if stream_stats['responses']:
+        avg_kb = stream_stats['bytes'] / stream_stats['responses'] / 1024
+        print_status(
+            f"📉 Body download: {stream_stats['bytes'] / (1024 ** 2):.1f} MiB over {stream_stats['responses']:,} responses "
+            f"(avg {avg_kb:.1f} KiB); early stops: {stream_stats['early_inactive']:,} inactive "
+            f"({stream_stats['settled_filtered']:,} settled as filtered); bodies skipped: {stream_stats['skipped_body']:,}; "
+            f"no keyword candidates: {stream_stats['prefilter_skips']:,}",
+            "info",
+        )
+    if redirect_cache is not None and (redirect_cache.hits or redirect_cache.stores):
+        print_status(redirect_cache.summary_line(), "info")
+    if history is not None and history.recorded:
+        print_status(history.report_line(), "info")
+    if deadline is not None:
+        if deadline.cut_at is not None:
+            print_status(
+                f"⌛ Deadline: stopped taking domains after {format_duration(deadline.cut_at - deadline.started)}; "
+                f"{stats['deadline_carried']:,} carried over to {CARRYOVER_FILE}, "
+                f"{stats['deadline_reused']:,} of them written with their previous verdict",
+                "warning",
+            )
+        else:
+            print_status(f"⌛ Deadline: finished with {format_duration(deadline.remaining())} of the budget left", "info")
+    if _shared_dns is not None:
+        requests_total = _shared_dns.hits + _shared_dns.coalesced + _shared_dns.lookups
+        hit_rate = (_shared_dns.hits + _shared_dns.coalesced) / requests_total * 100 if requests_total else 0.0
+        print_status(
+            f"📇 Shared DNS cache: {requests_total:,} resolutions, {_shared_dns.lookups:,} lookups "
+            f"({_shared_dns.failures:,} failed), {_shared_dns.hits:,} hits, {_shared_dns.coalesced:,} coalesced "
+            f"({hit_rate:.1f}% served without a query)",
+            "info",
+        )
+    if _buffer_pool is not None:
+        rss_note = ""
+        if psutil is not None:
+            with contextlib.suppress(Exception):
+                rss_note = f"; RSS {psutil.Process().memory_info().rss / (1024 ** 2):.0f} MiB"
+        print_status(
+            f"🧮 Receive buffers: {_buffer_pool.allocated:,} allocated, {_buffer_pool.reused:,} reused, "
+            f"peak {_buffer_pool.peak_in_use:,} in use ({_buffer_pool.size // 1024} KiB each){rss_note}",
+            "info",
+        )
+    for line in wall_times.format_lines("⏱️  Per-domain wall time"):
+        print_status(line, "info")
+    if corpus is not None and corpus.records:
+        ratio = corpus.raw_bytes / corpus.stored_bytes if corpus.stored_bytes else 0
+        print_status(f"🗜️  Corpus: {corpus.records:,} records, {corpus.stored_bytes / (1024 ** 2):.1f} MiB on disk ({ratio:.1f}x)", "info")
 
 
 
@@ -8035,9 +9480,42 @@ if __name__ == "__main__":
     parser.add_argument("--proxy-parallel-per-host", type=int, help=f"Override per-proxy parallelism (default {PROXY_PARALLEL_PER_HOST})")
 
     parser.add_argument("--proxy-parallel-only", action="store_true", help="Derive total concurrency only from per-proxy parallelism (ignore global max)")
+    parser.add_argument("--proxy-rate", type=float, help=f"Requests/sec allowed per proxy, 0 disables (default {PROXY_RATE_PER_SEC})")
+    parser.add_argument("--host-rate", type=float, help=f"Requests/sec allowed per target host, 0 disables (default {HOST_RATE_PER_SEC})")
+    parser.add_argument("--domain-deadline", type=float, help=f"Wall-clock seconds allowed per domain in the fast pass (default {DOMAIN_DEADLINE_SEC:g})")
+    parser.add_argument("--attempt-budget", type=int, help=f"Requests allowed per domain across schemes, retries and proxies (default {DOMAIN_ATTEMPT_BUDGET})")
+    parser.add_argument("--hedge-delay", type=float, help=f"Seconds before racing the next https/www/http candidate, 0 disables (default {HEDGE_DELAY_SEC:g})")
+    parser.add_argument("--hedge-proxy-delay", type=float, help=f"Seconds before racing the next proxy, 0 disables (default {HEDGE_PROXY_DELAY_SEC:g})")
+    parser.add_argument("--hedge-max", type=int, help=f"Max parallel hedged candidates per domain at each level (default {HEDGE_MAX_PARALLEL})")
+    parser.add_argument("--no-stream-analysis", action="store_true", help="Always download bodies up to MAX_BYTES before classifying")
+    parser.add_argument("--no-prefilter", action="store_true", help="Decode and analyse every body in full, even without a candidate keyword")
+    parser.add_argument("--check-prefilter", nargs='?', type=int, const=CHECK_PREFILTER_SAMPLES, metavar="N", help=f"Compare body-reading verdicts with full-page verdicts on N random pages and exit (default {CHECK_PREFILTER_SAMPLES})")
+    parser.add_argument("--no-shared-dns", action="store_true", help="Give every connector its own resolver and DNS cache")
+    parser.add_argument("--no-adaptive", action="store_true", help="Keep fast-pass concurrency fixed at the startup limit instead of adjusting it at runtime")
+    parser.add_argument("--no-ip-grouping", action="store_true", help="Schedule domains in input order without per-IP caps (for A/B comparison)")
+    parser.add_argument("--ip-max-parallel", type=int, help=f"Domains in flight per origin IP (default {IP_MAX_PARALLEL})")
+    parser.add_argument("--cdn-routing", action="store_true", help="Send domains in cdn_ranges.txt straight to the CDN direct tier (run --update-cdn-ranges first)")
+    parser.add_argument("--no-cdn-routing", action="store_true", help="Fetch CDN-hosted domains in the fast pass like any other")
+    parser.add_argument("--update-cdn-ranges", action="store_true", help="Refresh cdn_ranges.txt from the providers' published lists and exit")
+    parser.add_argument("--no-redirect-cache", action="store_true", help=f"Score every redirect target again instead of reusing verdicts from {REDIRECT_CACHE_FILE}")
+    parser.add_argument("--no-family-sampling", action="store_true", help="Fetch every domain even when its registrable-domain family was sampled")
+    parser.add_argument("--family-min-size", type=int, help=f"Smallest family that is sampled instead of fetched in full (default {FAMILY_MIN_SIZE})")
+    parser.add_argument("--family-sample", type=int, help=f"Members fetched per sampled family (default {FAMILY_SAMPLE_SIZE})")
+    parser.add_argument("--deadline", type=parse_duration, metavar="DURATION", help=f"Time budget such as 5h30m: stop taking domains in time to drain, carry the rest over to {CARRYOVER_FILE}")
+    parser.add_argument("--deadline-drain", type=parse_duration, metavar="DURATION", help=f"Part of the --deadline budget kept for draining in-flight work (default {DEADLINE_DRAIN_SEC // 60}m)")
+    parser.add_argument("--no-history", action="store_true", help=f"Schedule in PRIORITY_TLDS order instead of slowest-first from {HISTORY_FILE}, and don't update it unless --incremental needs it")
+    parser.add_argument("--incremental", action="store_true", help=f"Fetch only new domains and a slice of stale verdicts; copy the rest forward from {HISTORY_FILE}")
+    parser.add_argument("--max-age", action="append", metavar="LABEL=DURATION", help="Age after which a verdict is rechecked by --incremental, e.g. clean=7d (repeatable)")
+    parser.add_argument("--recheck-share", type=float, help=f"Largest share of known domains rechecked per --incremental run (default {INCREMENTAL_RECHECK_SHARE})")
 
     parser.add_argument("--monitor-mem", nargs='?', type=float, const=30.0, help="Log RSS/available memory every N seconds (default: 30s)")
 
+    parser.add_argument("--record-corpus", nargs='?', const=CORPUS_FILE, metavar="CORPUS", help=f"Append every page that gets a verdict (fast pass, rescue tiers, browser) to a compressed corpus (default: {CORPUS_FILE})")
+    parser.add_argument("--replay", metavar="CORPUS", help="Re-score a recorded corpus offline with the current rules and exit")
+    parser.add_argument("--replay-workers", type=int, help="Worker processes for --replay (default: all cores)")
+    parser.add_argument("--record-timings", nargs='?', const=TIMINGS_FILE, metavar="FILE", help=f"Write per-domain request phase timings as TSV (default: {TIMINGS_FILE})")
+    parser.add_argument("--no-phase-tracing", action="store_true", help="Don't attach the aiohttp phase-timing TraceConfig")
+    parser.add_argument("--metrics-port", type=int, help="Serve Prometheus metrics on 127.0.0.1:PORT/metrics while running")
     args = parser.parse_args()
 
 
@@ -8109,6 +9587,109 @@ if __name__ == "__main__":
         PROXY_PARALLEL_ONLY = True
         applied_overrides["proxy_parallel_only"] = True
 
+    if args.proxy_rate is not None:
+        PROXY_RATE_PER_SEC = args.proxy_rate
+        applied_overrides["proxy_rate"] = PROXY_RATE_PER_SEC
+
+    if args.host_rate is not None:
+        HOST_RATE_PER_SEC = args.host_rate
+        applied_overrides["host_rate"] = HOST_RATE_PER_SEC
+
+    if args.domain_deadline is not None:
+        DOMAIN_DEADLINE_SEC = max(DOMAIN_MIN_ATTEMPT_SEC, args.domain_deadline)
+        applied_overrides["domain_deadline"] = DOMAIN_DEADLINE_SEC
+
+    if args.attempt_budget is not None:
+        DOMAIN_ATTEMPT_BUDGET = max(1, args.attempt_budget)
+        applied_overrides["attempt_budget"] = DOMAIN_ATTEMPT_BUDGET
+
+    if args.hedge_delay is not None:
+        HEDGE_DELAY_SEC = max(0.0, args.hedge_delay)
+        applied_overrides["hedge_delay"] = HEDGE_DELAY_SEC
+
+    if args.hedge_proxy_delay is not None:
+        HEDGE_PROXY_DELAY_SEC = max(0.0, args.hedge_proxy_delay)
+        applied_overrides["hedge_proxy_delay"] = HEDGE_PROXY_DELAY_SEC
+
+    if args.hedge_max is not None:
+        HEDGE_MAX_PARALLEL = max(1, args.hedge_max)
+        applied_overrides["hedge_max"] = HEDGE_MAX_PARALLEL
+
+    if args.no_stream_analysis:
+        STREAM_ANALYSIS = False
+        applied_overrides["stream_analysis"] = False
+
+    if args.no_prefilter:
+        PREFILTER = False
+        applied_overrides["prefilter"] = False
+
+    if args.record_corpus:
+        # The corpus stores whole bodies for --replay: no early stop, no head-only decode
+        STREAM_ANALYSIS = PREFILTER = False
+        applied_overrides["stream_analysis"] = applied_overrides["prefilter"] = False
+
+    if args.no_shared_dns:
+        SHARED_DNS_CACHE = False
+        applied_overrides["shared_dns"] = False
+    if args.no_adaptive:
+        ADAPTIVE_CONCURRENCY = False
+        applied_overrides["adaptive_concurrency"] = False
+    if args.no_ip_grouping:
+        IP_GROUPING = False
+        applied_overrides["ip_grouping"] = False
+    if args.ip_max_parallel:
+        IP_MAX_PARALLEL = max(1, args.ip_max_parallel)
+        applied_overrides["ip_max_parallel"] = IP_MAX_PARALLEL
+    if args.cdn_routing:
+        CDN_RANGE_ROUTING = True
+        applied_overrides["cdn_routing"] = True
+    if args.no_cdn_routing:
+        CDN_RANGE_ROUTING = False
+        applied_overrides["cdn_routing"] = False
+    if args.no_redirect_cache:
+        REDIRECT_CACHE = False
+        applied_overrides["redirect_cache"] = False
+    if args.no_family_sampling:
+        FAMILY_SAMPLING = False
+        applied_overrides["family_sampling"] = False
+    if args.family_min_size:
+        FAMILY_MIN_SIZE = max(2, args.family_min_size)
+        applied_overrides["family_min_size"] = FAMILY_MIN_SIZE
+    if args.family_sample:
+        FAMILY_SAMPLE_SIZE = max(1, args.family_sample)
+        applied_overrides["family_sample"] = FAMILY_SAMPLE_SIZE
+    if args.no_history:
+        LPT_SCHEDULING = False
+        applied_overrides["lpt_scheduling"] = False
+    if args.incremental:
+        INCREMENTAL = True
+        applied_overrides["incremental"] = True
+    for item in args.max_age or ():
+        label, _, age = item.partition("=")
+        try:
+            seconds = parse_duration(age)
+        except ValueError as e:
+            parser.error(f"--max-age {item}: {e}")
+        if label not in INCREMENTAL_COPYABLE:
+            parser.error(f"--max-age {item}: not a copied-forward label (one of {', '.join(INCREMENTAL_COPYABLE)})")
+        INCREMENTAL_MAX_AGE_SEC[label] = seconds
+        applied_overrides[f"max_age_{label}"] = int(seconds)
+    if args.recheck_share is not None:
+        INCREMENTAL_RECHECK_SHARE = min(1.0, max(0.0, args.recheck_share))
+        applied_overrides["recheck_share"] = INCREMENTAL_RECHECK_SHARE
+    if args.deadline:
+        DEADLINE_SEC = args.deadline
+        applied_overrides["deadline_sec"] = int(DEADLINE_SEC)
+    if args.deadline_drain:
+        DEADLINE_DRAIN_SEC = args.deadline_drain
+        applied_overrides["deadline_drain_sec"] = int(DEADLINE_DRAIN_SEC)
+    if args.no_phase_tracing:
+        PHASE_TRACING = False
+        applied_overrides["phase_tracing"] = False
+    if args.metrics_port is not None:
+        METRICS_PORT = args.metrics_port
+        applied_overrides["metrics_port"] = METRICS_PORT
+
     fd_adjustments = ensure_fd_headroom()
 
     if fd_adjustments:
@@ -8152,6 +9733,15 @@ if __name__ == "__main__":
 
 
 
+        if args.replay:
+            sys.exit(replay_corpus(args.replay, args.replay_workers))
+        if args.check_prefilter:
+            sys.exit(check_prefilter(args.check_prefilter))
+        if args.update_cdn_ranges:
+            refreshed = update_ranges_file(log=print_status)
+            for provider, count in sorted(refreshed.items()):
+                print_status(f"🛰️  {provider}: {count:,} ranges", "success")
+            sys.exit(0 if refreshed else 1)
         if args.preflight:
 
 
@@ -8184,7 +9774,12 @@ if __name__ == "__main__":
 
 
 
-            asyncio.run(main(no_qc=args.no_qc, monitor_interval=args.monitor_mem))
+            asyncio.run(main(
+                no_qc=args.no_qc,
+                monitor_interval=args.monitor_mem,
+                corpus_path=args.record_corpus,
+                timings_path=args.record_timings,
+            ))
 
 
 
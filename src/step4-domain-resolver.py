@@ -18,6 +18,9 @@ from colorama import Fore, Style, init
 from idna import encode as idna_encode
 from tqdm import tqdm
 
+from diagnostics import DiagnosticsDumper
+from public_suffix import SuffixIndex
+
 
 GEOIP_DB_PATH = "GeoLite2-ASN.mmdb"
 GEOLITE_URL = "https://github.com/FyraLabs/geolite2/releases/latest/download/GeoLite2-ASN.mmdb"
@@ -258,14 +261,26 @@ COMPANY_DOMAINS = {
 }
 
 
+# Extra "domain asn [asn ...]" lines; the file is optional and overrides COMPANY_DOMAINS per domain
+COMPANY_DOMAINS_FILE = Path(__file__).resolve().with_name("company_domains.txt")
+
+
+def _parse_asns(fields):
+    # "15169" and "AS15169" are both accepted
+    asns = [int(re.sub(r"^AS", "", f, flags=re.IGNORECASE)) for f in fields]
+    if not asns:
+        raise ValueError("no ASN listed")
+    return asns
+
+
+COMPANY_INDEX = SuffixIndex(COMPANY_DOMAINS)
+COMPANY_INDEX.load_file(COMPANY_DOMAINS_FILE, _parse_asns)
+
+
 def is_trusted_domain(domain, asn):
     # Treat subdomains of trusted companies as trusted when ASN matches.
-    if domain in COMPANY_DOMAINS:
-        return asn in COMPANY_DOMAINS[domain]
-    for root_domain, asns in COMPANY_DOMAINS.items():
-        if domain.endswith(f".{root_domain}"):
-            return asn in asns
-    return False
+    asns = COMPANY_INDEX.get(domain)
+    return asns is not None and asn in asns
 
 
 def is_problematic_ip(ip):
@@ -555,6 +570,18 @@ def main():
             unit="domain",
             dynamic_ncols=True,
         ) as pbar:
+            # kill -USR1 <pid> dumps thread stacks, allocation growth and these sizes
+            diagnostics = DiagnosticsDumper("step4", log=lambda message, kind: logging.info(message))
+            diagnostics.add_probe(
+                "step4",
+                lambda: {
+                    "executor_queue": executor._work_queue.qsize(),
+                    "results_queue": results_queue.qsize(),
+                    "resolved": pbar.n,
+                    "cidrs_found": len(existing_cidrs),
+                },
+            )
+            diagnostics.install()
             for future in concurrent.futures.as_completed(future_to_domain):
                 domain = future_to_domain[future]
                 try:
@@ -569,6 +596,7 @@ def main():
                     pbar.update(1)
                     gc.collect()
 
+    diagnostics.uninstall()
     results_queue.put(None)
     writer_thread.join()
     reader.close()
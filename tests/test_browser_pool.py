@@ -0,0 +1,261 @@
+"""BrowserPool recycling and page-load handling, driven by a fake WebDriver.
+
+Run from the repository root:
+  python -m pytest tests
+  python -m unittest discover tests
+"""
+
+import asyncio
+import sys
+import tempfile
+import threading
+import unittest
+from pathlib import Path
+from unittest import mock
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
+
+import browser_pool  # noqa: E402
+from browser_pool import BrowserPool  # noqa: E402
+
+PAGE = "<html><body>" + "content " * 50 + "</body></html>"
+UNLOADED = "javascript error: document unloaded while waiting for result"
+
+
+class FakeDriver:
+    def __init__(self, number: int):
+        self.number = number
+        self.visited = []
+        self.fail_get = False
+        self.unloads = 0  # readiness waits that fail because the page navigated
+        self.block = None  # threading.Event a get() waits on
+        self.quit_calls = 0
+
+    def set_page_load_timeout(self, seconds):
+        pass
+
+    def set_script_timeout(self, seconds):
+        pass
+
+    def get(self, url):
+        if url == "about:blank":
+            return
+        self.visited.append(url)
+        if self.block is not None:
+            self.block.wait(5)
+        if self.fail_get:
+            raise RuntimeError("net::ERR_CONNECTION_REFUSED")
+
+    def execute_async_script(self, script, *args):
+        if self.unloads:
+            self.unloads -= 1
+            raise RuntimeError(UNLOADED)
+        return "quiet"
+
+    @property
+    def page_source(self):
+        return PAGE
+
+    def quit(self):
+        self.quit_calls += 1
+
+
+class FakeLauncher:
+    """launch(profile, proxy) for BrowserPool; every call returns a new FakeDriver unless failing."""
+
+    def __init__(self):
+        self.drivers = []
+        self.profiles = []
+        self.fail = False
+
+    def __call__(self, profile, proxy):
+        if self.fail:
+            raise RuntimeError("chrome failed to start")
+        driver = FakeDriver(len(self.drivers))
+        self.drivers.append(driver)
+        self.profiles.append(profile)
+        return driver
+
+
+class BrowserPoolTest(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self._tmp.cleanup)
+        self.launcher = FakeLauncher()
+
+    def make_pool(self, **options) -> BrowserPool:
+        options.setdefault("standby", False)
+        options.setdefault("rss", lambda driver: None)
+        return BrowserPool(self.launcher, 1, [], profile_base=Path(self._tmp.name), **options)
+
+    def run_pool(self, pool: BrowserPool, scenario):
+        async def main():
+            await pool.start()
+            try:
+                return await scenario()
+            finally:
+                await pool.close()
+
+        return asyncio.run(main())
+
+    @staticmethod
+    async def settle(pool: BrowserPool):
+        # Let the recycle spawned by the last fetch finish
+        while pool._background:
+            await asyncio.gather(*list(pool._background))
+
+    def test_recycles_after_max_pages(self):
+        pool = self.make_pool(max_pages=2)
+
+        async def scenario():
+            for domain in ("a.test", "b.test", "c.test"):
+                html, label, _ = await pool.fetch(domain)
+                self.assertEqual(label, "success")
+                self.assertEqual(html, PAGE)
+                await self.settle(pool)
+
+        self.run_pool(pool, scenario)
+        self.assertEqual(pool.recycled["pages"], 1)
+        self.assertEqual(len(self.launcher.drivers), 2)
+        first, second = self.launcher.drivers
+        self.assertEqual(first.quit_calls, 1)
+        self.assertFalse(self.launcher.profiles[0].exists())
+        self.assertEqual(second.visited, ["https://c.test"])
+
+    def test_recycles_on_rss(self):
+        readings = []
+
+        def rss(driver):
+            readings.append(driver.number)
+            return 2000.0 if driver.number == 0 else 100.0
+
+        pool = self.make_pool(max_rss_mb=1500, rss=rss)
+
+        async def scenario():
+            for domain in ("a.test", "b.test", "c.test"):
+                await pool.fetch(domain)
+                await self.settle(pool)
+
+        with mock.patch.object(browser_pool, "RSS_CHECK_PAGES", 1):
+            self.run_pool(pool, scenario)
+        self.assertEqual(pool.recycled["rss"], 1)
+        self.assertEqual(readings, [0, 1, 1])
+        self.assertEqual(self.launcher.drivers[0].quit_calls, 1)
+
+    def test_recycles_after_failed_loads(self):
+        pool = self.make_pool()
+
+        async def scenario():
+            self.launcher.drivers[0].fail_get = True
+            for i in range(browser_pool.MAX_FAILED_LOADS):
+                html, label, _ = await pool.fetch(f"down{i}.test")
+                self.assertIsNone(html)
+                self.assertEqual(label, "timeout")
+                await self.settle(pool)
+            return await pool.fetch("up.test")
+
+        html, label, _ = self.run_pool(pool, scenario)
+        self.assertEqual(pool.recycled["failures"], 1)
+        tried = len(browser_pool.candidate_urls("down0.test"))
+        self.assertEqual(len(self.launcher.drivers[0].visited), browser_pool.MAX_FAILED_LOADS * tried)
+        self.assertEqual(label, "success")
+        self.assertEqual(self.launcher.drivers[1].visited, ["https://up.test"])
+
+    def test_swaps_in_ready_standby(self):
+        pool = self.make_pool(max_pages=1, standby=True)
+
+        async def scenario():
+            await pool._standby
+            standby = self.launcher.drivers[1]
+            await pool.fetch("a.test")
+            await self.settle(pool)
+            self.assertIs(pool.browsers[0].driver, standby)
+            # A new standby is launched for the next recycle
+            await pool._standby
+
+        self.run_pool(pool, scenario)
+        self.assertEqual(pool.standby_ready, 1)
+        self.assertEqual(pool.recycled["pages"], 1)
+        self.assertEqual(len(self.launcher.drivers), 3)
+
+    def test_failed_replacement_keeps_old_browser(self):
+        pool = self.make_pool(max_pages=1)
+
+        async def scenario():
+            self.launcher.fail = True
+            await pool.fetch("a.test")
+            await self.settle(pool)
+            self.assertEqual(pool._idle.qsize(), 1)
+            html, label, _ = await pool.fetch("b.test")
+            await self.settle(pool)
+            return label
+
+        label = self.run_pool(pool, scenario)
+        self.assertEqual(label, "success")
+        self.assertEqual(len(self.launcher.drivers), 1)
+        self.assertEqual(pool.recycled["pages"], 0)
+        self.assertEqual(self.launcher.drivers[0].visited, ["https://a.test", "https://b.test"])
+        self.assertEqual(self.launcher.drivers[0].quit_calls, 1)  # only by close()
+
+    def test_returns_index_when_fetch_raises(self):
+        def rss(driver):
+            raise RuntimeError("psutil went away")
+
+        pool = self.make_pool(rss=rss)
+
+        async def scenario():
+            with self.assertRaises(RuntimeError):
+                await pool.fetch("a.test")
+            self.assertEqual(pool._idle.qsize(), 1)
+
+        with mock.patch.object(browser_pool, "RSS_CHECK_PAGES", 1):
+            self.run_pool(pool, scenario)
+
+    def test_returns_index_when_fetch_is_cancelled(self):
+        pool = self.make_pool()
+        release = threading.Event()
+        self.addCleanup(release.set)
+
+        async def scenario():
+            self.launcher.drivers[0].block = release
+            task = asyncio.ensure_future(pool.fetch("slow.test"))
+            while not self.launcher.drivers[0].visited:
+                await asyncio.sleep(0.01)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+            self.assertEqual(pool._idle.qsize(), 1)
+            release.set()
+
+        self.run_pool(pool, scenario)
+
+    def test_waits_again_after_page_navigates(self):
+        pool = self.make_pool()
+
+        async def scenario():
+            self.launcher.drivers[0].unloads = 1
+            return await pool.fetch("redirecting.test")
+
+        html, label, _ = self.run_pool(pool, scenario)
+        self.assertEqual(label, "success")
+        self.assertEqual(self.launcher.drivers[0].visited, ["https://redirecting.test"])
+        self.assertEqual(pool.navigated, 1)
+        self.assertEqual(pool.settled["quiet"], 1)
+        self.assertEqual(pool.browsers, [])  # closed
+        self.assertEqual(self.launcher.drivers[0].quit_calls, 1)
+
+    def test_reads_page_after_repeated_navigation(self):
+        pool = self.make_pool()
+
+        async def scenario():
+            self.launcher.drivers[0].unloads = browser_pool.READY_RETRIES + 1
+            return await pool.fetch("challenge.test")
+
+        html, label, _ = self.run_pool(pool, scenario)
+        self.assertEqual(label, "success")
+        self.assertEqual(pool.settled["busy"], 1)
+        self.assertEqual(self.launcher.drivers[0].visited, ["https://challenge.test"])
+
+
+if __name__ == "__main__":
+    unittest.main()